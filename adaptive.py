@@ -0,0 +1,156 @@
+# Adaptive sweeps: instead of evaluating the force on every position of a uniform grid, a coarse lattice is evaluated first and then only the cells where the force is not well described by interpolation (e.g. close to the equilibrium or where the focus crosses the surface of the sphere) are subdivided.
+# The evaluated positions are kept on an integer lattice (the finest one that can be reached), so that the points shared by neighbouring cells are only evaluated once.
+import itertools
+
+import numpy as np
+
+# All the d-tuples of the given values, as a (K,d) integer array (K=1 when d=0)
+def _product(values, d):
+    points = list(itertools.product(values, repeat=d))
+
+    return np.array(points, dtype=int).reshape(len(points), d)
+
+class AdaptiveSweep(object):
+    # The sweep covers the box between the positions lo and hi (3-element arrays). The coordinates where lo and hi are the same are kept fixed.
+    # The box is first divided into `coarse` cells along every varying coordinate, and each cell can be subdivided (in halves along every varying coordinate) up to max_depth times.
+    def __init__(self, lo, hi, coarse, max_depth):
+        if coarse < 1:
+            raise ValueError("Invalid number of coarse cells: {0}".format(coarse))
+        if max_depth < 0:
+            raise ValueError("Invalid maximum depth: {0}".format(max_depth))
+
+        self._lo = np.array(lo, dtype=float)
+        self._hi = np.array(hi, dtype=float)
+        self._active = np.flatnonzero(self._lo != self._hi)
+
+        self._coarse = coarse
+        self._max_depth = max_depth
+
+        # Number of cells of the finest level along each varying coordinate
+        self._M = coarse * 2**max_depth
+
+        # The offsets of the corners of a cell of unit size (in lattice units)
+        self._offsets = _product([0, 1], len(self._active))
+
+        # Forces on the evaluated lattice points (indexed by the tuple of lattice coordinates)
+        self._forces = {}
+
+        # The cells that were not subdivided, as a list of (array of corners, size) pairs (one pair per level)
+        self._leaves = []
+
+    # Converts lattice coordinates (a (K,d) integer array) into positions (a (K,3) array)
+    def _positions(self, ks):
+        pos = np.tile(self._lo, (len(ks), 1))
+        a = self._active
+        pos[:,a] = self._lo[a] + ks*(self._hi[a] - self._lo[a])/self._M
+
+        return pos
+
+    # Evaluates the force on the lattice points that have not been evaluated before (all of them in a single call to force_fun)
+    def _evaluate(self, force_fun, ks):
+        new = [k for k in set(map(tuple, ks)) if k not in self._forces]
+
+        if new:
+            forces = force_fun(self._positions(np.array(new, dtype=int).reshape(len(new), len(self._active))))
+            for k, F in zip(new, forces):
+                self._forces[k] = F
+
+    # The corners of all the given cells of the given size, as a (K*2^d,d) array
+    def _corners(self, cells, size):
+        return (cells[:,None,:] + size*self._offsets).reshape(len(cells)*len(self._offsets), len(self._active))
+
+    # Returns the forces on the lattice points ks
+    def _lookup(self, ks):
+        return np.array([self._forces[tuple(k)] for k in ks])
+
+    # Runs the sweep. force_fun takes an (M,3) array of positions and returns the (M,3) array of forces on them.
+    # Every cell is checked by evaluating the points that would subdivide it (the midpoints of its edges, faces and the center). If the force on any of them differs from the one interpolated from the corners of the cell by more than tol (in any of the components), the halves of the cell are checked in turn. Otherwise, the halves are final: the points used for the check are not wasted.
+    def run(self, force_fun, tol):
+        d = len(self._active)
+        size = 2**self._max_depth
+
+        # The points that subdivide a cell (in units of half the cell size) and their multilinear interpolation weights from the corners of the cell
+        sub = _product([0, 1, 2], d)
+        weights = np.prod(np.where(self._offsets[None,:,:] == 1, sub[:,None,:]/2, 1 - sub[:,None,:]/2), axis=2)
+
+        # Start from the coarse lattice
+        cells = size*_product(range(self._coarse), d)
+        self._evaluate(force_fun, self._corners(cells, size))
+
+        while len(cells) > 0:
+            # The cells of the finest level can't be subdivided anymore (and there is nothing to subdivide if all the coordinates are fixed)
+            if size == 1 or d == 0:
+                self._leaves.append((cells, size))
+                break
+
+            half = size//2
+
+            # Evaluate all the subdividing points at once and compare them with the interpolation
+            points = (cells[:,None,:] + half*sub).reshape(len(cells)*len(sub), d)
+            self._evaluate(force_fun, points)
+
+            corners = self._lookup(self._corners(cells, size)).reshape(len(cells), -1, 3)
+            interp = np.einsum('sk,ckj->csj', weights, corners)
+            err = np.max(np.abs(self._lookup(points).reshape(len(cells), -1, 3) - interp), axis=(1,2))
+            refine = err > tol
+
+            self._leaves.append((self._corners(cells[~refine], half), half))
+
+            cells = self._corners(cells[refine], half)
+            size = half
+
+    # Number of positions on which the force has been evaluated
+    def evaluations(self):
+        return len(self._forces)
+
+    # Returns the evaluated positions and the forces on them as two (M,3) arrays (scattered data)
+    def results(self):
+        ks = list(self._forces.keys())
+        positions = self._positions(np.array(ks, dtype=int).reshape(len(ks), len(self._active)))
+
+        return positions, self._lookup(ks)
+
+    # Interpolates the forces into the regular grid given by the values of xs, ys and zs (in the order of sweep.grid_positions). Every point is interpolated multilinearly from the corners of the cell that contains it.
+    def resample(self, xs, ys, zs):
+        xx, yy, zz = np.meshgrid(xs, ys, zs)
+        queries = np.vstack([xx.flatten(), yy.flatten(), zz.flatten()]).transpose()
+
+        a = self._active
+        d = len(a)
+        M = self._M
+
+        # Continuous lattice coordinates of the queries (points outside of the box are clamped to it)
+        u = np.clip((queries[:,a] - self._lo[a])/(self._hi[a] - self._lo[a])*M, 0, M)
+
+        # Every lattice point is encoded as a single integer for fast searching
+        radix = (M + 1)**np.arange(d)
+
+        codes = np.array(list(self._forces.keys()), dtype=int).reshape(len(self._forces), d) @ radix
+        order = np.argsort(codes)
+        codes = codes[order]
+        values = np.array(list(self._forces.values())).reshape(-1, 3)[order]
+
+        forces = np.full((len(queries), 3), np.nan)
+
+        for leaves, size in self._leaves:
+            if len(leaves) == 0:
+                continue
+
+            # The cells of a level are aligned to multiples of their size, so the cell that would contain each query is found directly
+            base = np.clip(np.floor(u/size).astype(int)*size, 0, M - size)
+
+            leaf_codes = np.sort(leaves @ radix)
+            pos = np.minimum(np.searchsorted(leaf_codes, base @ radix), len(leaf_codes) - 1)
+            found = (leaf_codes[pos] == base @ radix) & np.isnan(forces[:,0])
+
+            # Interpolation weights of the corners
+            t = (u[found] - base[found])/size
+            F = np.zeros((np.count_nonzero(found), 3))
+
+            for o in self._offsets:
+                w = np.prod(np.where(o == 1, t, 1 - t), axis=1)
+                F += w.reshape(-1,1) * values[np.searchsorted(codes, (base[found] + size*o) @ radix)]
+
+            forces[found] = F
+
+        return forces
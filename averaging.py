@@ -0,0 +1,164 @@
+# Averaging of force maps over the position noise of the particle (thermal motion, pointing noise of the beam...).
+# The force that is measured on a particle that jitters around a position is the static force averaged over the distribution of its displacements, i.e. the correlation of the force map with that distribution. It's computed here on the regular grids produced by run.py with FFT convolution (scipy.signal.fftconvolve), which costs about as much as reading the grid, instead of evaluating the force on lots of random positions.
+#
+# Usage example: python3 averaging.py results.npz --sigma 0.05 0.05 0.1 --edge renormalize --out averaged.npz
+import argparse
+
+import numpy as np
+
+import results
+
+# How the grid is extended beyond its edges (the kernel needs the force on positions outside of it):
+# - "renormalize": only the positions of the grid are averaged (the weights of the kernel are renormalized close to the edges). The positions where the force is NaN (e.g. not evaluated) are skipped in the same way
+# - "nearest": the force on the closest position of the grid
+# - "reflect": the force on the mirror position with respect to the edge
+# - "zero": no force (e.g. when the grid extends until the beam doesn't reach the particle anymore)
+edge_modes = ("renormalize", "nearest", "reflect", "zero")
+
+# Memory (in bytes) used for each chunk of the grid when no budget is given
+default_memory_budget = 2**28
+
+# Approximate memory (in bytes) used per point of a chunk by the convolution (the padded chunk, its transform and the temporaries)
+bytes_per_point = 96
+
+# Returns the spacing of the values of a coordinate (0 if the coordinate is fixed). Raises ValueError if they are not evenly spaced
+def grid_spacing(values):
+    values = np.atleast_1d(values)
+
+    if len(values) < 2:
+        return 0.0
+
+    d = np.diff(values)
+    if not np.allclose(d, d[0], rtol=1e-6, atol=0):
+        raise ValueError("The grid is not evenly spaced")
+
+    return d[0]
+
+# Samples the distribution of displacements given by fun (a function of the dx, dy, dz arrays, not necessarily normalized) on the spacings of the grid, up to the given half widths (in number of points) along each coordinate. Returns the normalized kernel, with an odd number of points along every coordinate and the zero displacement in the middle.
+# The kernel is indexed like the grid: along a coordinate whose values decrease (negative spacing), the kernel is flipped, so that the next point of the grid is still a negative displacement
+def kernel_from_function(fun, spacings, half_widths):
+    spacings = np.asarray(spacings, dtype=float)
+
+    d = [abs(s)*np.arange(-h, h + 1) for s, h in zip(spacings, half_widths)]
+    dx, dy, dz = np.meshgrid(*d, indexing='ij')
+
+    kernel = np.asarray(fun(dx, dy, dz), dtype=float)
+    if np.any(kernel < 0) or not np.sum(kernel) > 0:
+        raise ValueError("The distribution must be non-negative and not vanish everywhere")
+
+    kernel = np.flip(kernel, axis=tuple(np.flatnonzero(spacings < 0)))
+
+    return kernel/np.sum(kernel)
+
+# Kernel of a Gaussian distribution of the displacements, with standard deviation sigma (a value or one per coordinate) and truncated at `truncate` standard deviations. The coordinates that are fixed in the grid (spacing 0) are not averaged
+def gaussian_kernel(spacings, sigma, truncate=4.0):
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=float), (3,))
+    spacings = np.asarray(spacings, dtype=float)
+
+    # Decreasing coordinates (negative spacing) are averaged too
+    averaged = (spacings != 0) & (sigma > 0)
+    half_widths = [int(np.ceil(truncate*s/abs(h))) if a else 0 for s, h, a in zip(sigma, spacings, averaged)]
+
+    # The fixed coordinates get a kernel of a single point
+    scale = np.where(averaged, sigma, 1.0)
+
+    return kernel_from_function(lambda dx, dy, dz: np.exp(-((dx/scale[0])**2 + (dy/scale[1])**2 + (dz/scale[2])**2)/2), spacings, half_widths)
+
+# The indices of the grid (along an axis of n points) used for the positions lo to hi - 1 of that axis (which may be beyond its edges), extended as given by edge, and whether each position is inside the grid (the ones outside are only used with "nearest" and "reflect")
+def _edge_indices(n, lo, hi, edge):
+    i = np.arange(lo, hi)
+    inside = (i >= 0) & (i < n)
+
+    if edge == "reflect":
+        # Mirror with respect to the edges (the edge points are repeated), periodically if the margin is longer than the grid
+        m = i % (2*n)
+        return np.where(m < n, m, 2*n - 1 - m), inside
+
+    return np.clip(i, 0, n - 1), inside
+
+# Averages every component of the forces (a (nx, ny, nz, 3) array) over the displacements given by the kernel (a normalized (kx, ky, kz) array with odd dimensions, whose middle point is the zero displacement), extending the grid beyond its edges as given by edge (see edge_modes). The averaged force on a position x is the sum of kernel(d) F(x + d) over the displacements d, i.e. the correlation of the forces with the kernel (computed as the convolution with the flipped kernel).
+# The grid is processed in chunks along X (each one extended with the margin that the kernel needs), so that the memory used stays around max_bytes. The grid can only have NaN values (e.g. positions that were not evaluated) with edge="renormalize": with the other modes, they would spread over the whole chunk, so a ValueError is raised
+def average_forces(grid, kernel, edge="renormalize", max_bytes=None):
+    import scipy.signal as ss
+
+    grid = np.asarray(grid, dtype=float)
+    kernel = np.asarray(kernel, dtype=float)
+
+    if edge not in edge_modes:
+        raise ValueError("Unknown edge mode: {0}".format(edge))
+    if kernel.ndim != 3 or any(k % 2 == 0 for k in kernel.shape):
+        raise ValueError("The kernel must have an odd number of points along every coordinate")
+    if edge != "renormalize" and not np.all(np.isfinite(grid)):
+        raise ValueError("The grid has missing (NaN) values, which can only be averaged with edge=\"renormalize\"")
+
+    h = [k//2 for k in kernel.shape]
+    nx, ny, nz = grid.shape[:3]
+
+    flipped = kernel[::-1, ::-1, ::-1]
+
+    # The Y and Z indices of every chunk (with their margins) are always the same
+    iy, in_y = _edge_indices(ny, -h[1], ny + h[1], edge)
+    iz, in_z = _edge_indices(nz, -h[2], nz + h[2], edge)
+
+    if max_bytes is None:
+        max_bytes = default_memory_budget
+
+    # Number of X planes of the output per chunk
+    plane = (ny + 2*h[1])*(nz + 2*h[2])*bytes_per_point
+    chunk = max(1, int(max_bytes // plane) - 2*h[0])
+
+    out = np.zeros(grid.shape)
+
+    for start in range(0, nx, chunk):
+        stop = min(start + chunk, nx)
+
+        # The chunk with its margins: the output plane i needs the input planes i - h[0] to i + h[0]
+        ix, in_x = _edge_indices(nx, start - h[0], stop + h[0], edge)
+        block = grid[np.ix_(ix, iy, iz)]
+
+        if edge in ("renormalize", "zero"):
+            inside = in_x[:,None,None] & in_y[None,:,None] & in_z[None,None,:]
+
+            if edge == "renormalize":
+                # Convolve the forces with the missing values (outside or NaN) set to zero, and divide by the convolution of the mask of valid values
+                valid = inside & ~np.any(np.isnan(block), axis=3)
+            else:
+                valid = inside
+
+            block = np.where(valid[...,None], block, 0)
+
+        for j in range(grid.shape[3]):
+            out[start:stop,...,j] = ss.fftconvolve(block[...,j], flipped, mode='valid')
+
+        if edge == "renormalize":
+            weights = ss.fftconvolve(valid.astype(float), flipped, mode='valid')
+
+            # Positions with no valid values around them (and rounding errors of the FFT close to zero)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[start:stop] /= np.where(weights > 1e-9, weights, np.nan)[...,None]
+
+    return out
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Averages a force map over the position noise of the particle")
+    parser.add_argument("file", help="result file with a regular grid (TSV or structured .npz)")
+    parser.add_argument("--sigma", nargs="+", type=float, required=True, help="standard deviation of the displacements (one value, or one for each of X, Y and Z)")
+    parser.add_argument("--truncate", type=float, default=4.0, help="the Gaussian is truncated at this number of standard deviations")
+    parser.add_argument("--edge", choices=edge_modes, default="renormalize", help="how the grid is extended beyond its edges")
+    parser.add_argument("--memory", type=float, default=None, help="memory budget in MB (the grid is processed in chunks)")
+    parser.add_argument("--out", required=True, help="result file to save the averaged forces into")
+    args = parser.parse_args(argv)
+
+    if len(args.sigma) not in (1, 3):
+        parser.error("--sigma takes one or three values")
+
+    xs, ys, zs, grid = results.load_grid(args.file)
+    spacings = [grid_spacing(v) for v in (xs, ys, zs)]
+
+    kernel = gaussian_kernel(spacings, args.sigma, args.truncate)
+    averaged = average_forces(grid, kernel, args.edge, None if args.memory is None else args.memory*2**20)
+
+    results.save_grid(args.out, xs, ys, zs, averaged, sigma=np.broadcast_to(args.sigma, (3,)))
+
+if __name__ == "__main__":
+    main()
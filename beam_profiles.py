@@ -1,6 +1,7 @@
 # Import the necessary packages for the correct calculations
 from numpy import pi
 import numpy as np
+import scipy.special as ssp
 
 ### IMPORTANT NOTE: in your functions, always use the functions provided by numpy or compatible packages. For that, use e.g. np.sin(x), np.exp(x) etc.
 
@@ -91,4 +92,76 @@ def donut_radial(r, th, Rl, **kwargs):
     # The polarization is radial. We just make an array of appropriate dimensions here, no need to modify it
     pol = np.array([np.cos(th), np.sin(th), np.zeros(r.shape)]).transpose()
     
-    return np.hstack([I.reshape(-1,1), pol])
\ No newline at end of file
+    return np.hstack([I.reshape(-1,1), pol])
+
+### Higher-order modes and vector beams
+# The following profiles are the intensity of the Laguerre-Gauss and Hermite-Gauss modes at the lens (the phase of the mode doesn't matter, since every ray only carries power). Their parameters accept arrays: every parameter is broadcast against the others, and all the parameter sets are sampled at once, with the same rays. With K parameter sets (e.g. an array of K values of 'a'), the result is a (K, n_rays, 4) array instead of (n_rays, 4): the intensity of every beam is result[...,0] (a (K, n_rays) block) and its polarization result[...,1:]. The force integrals of optical_system.py then give the forces of all the beams at once (see OpticalSystemSimpleArbitrary.set_beam). The sweeps (run.py, jobs.py and the tools built on sweep.py) take a single beam, and reject array parameters (see sweep.check_single_beam).
+# The polarization is given by one of these arguments:
+# - 'p': fixed polarization in Jones' notation (like gaussian_fixed), a (2,) array or a (..., 2) array with one vector per parameter set
+# - 'phi': cylindrical vector beam, whose polarization at every point is cos(phi) times the radial direction plus sin(phi) times the azimuthal one: phi = 0 is a radially polarized beam, phi = pi/2 an azimuthally polarized one and the values in between mix them
+# Like in the profiles above, 'a' is the ratio between the beam waist (radius) and the radius of the lens. The modes are normalized numerically over the lens (with the quadrature given below, on all the parameter sets at once), since the closed forms of the power through the aperture get unwieldy for higher orders.
+
+# Number of nodes used for normalizing the modes: Gauss-Legendre in r and evenly spaced in th (exact for the Hermite-Gauss modes up to an order of about norm_thsteps/2)
+norm_rsteps = 64
+norm_thsteps = 64
+
+# Returns a parameter as an array that can be broadcast against the rays (one more dimension of size 1 at the end)
+def _parameter(value, dtype=float):
+    value = np.asarray(value, dtype=dtype)
+    
+    return value.reshape(value.shape + (1,))
+
+# The polarization of every ray (see above) as a (..., n_rays, 3) array
+def _polarization(th, kwargs):
+    if 'phi' in kwargs:
+        phi = _parameter(kwargs['phi'])
+        
+        # cos(phi) (cos(th), sin(th)) + sin(phi) (-sin(th), cos(th))
+        return np.stack([np.cos(th + phi), np.sin(th + phi), np.zeros(np.broadcast(th, phi).shape)], axis=-1)
+    
+    p = np.asarray(kwargs['p'])
+    p = np.concatenate([p, np.zeros(p.shape[:-1] + (1,))], axis=-1)
+    
+    return np.broadcast_to(p[...,None,:], p.shape[:-1] + (len(th), 3))
+
+# Samples the unnormalized intensity profile(r, th) on the rays and divides it by its power through the lens, and adds the polarization. profile returns an array whose last dimension is the ray (and the others are the parameter sets)
+def _sample(profile, r, th, Rl, kwargs):
+    # The power of every parameter set through the lens (of radius Rl)
+    x, w = np.polynomial.legendre.leggauss(norm_rsteps)
+    rq = Rl*(x + 1)/2
+    thq = np.linspace(0, 2*pi, norm_thsteps, endpoint=False)
+    wq = np.outer(2*pi/norm_thsteps*np.ones(norm_thsteps), Rl*w/2*rq).flatten()
+    rq, thq = np.meshgrid(rq, thq)
+    
+    P = profile(rq.flatten(), thq.flatten()) @ wq
+    I = profile(r, th)/P[...,None]
+    
+    pol = _polarization(th, kwargs)
+    shape = np.broadcast_shapes(I.shape[:-1], pol.shape[:-2])
+    
+    return np.concatenate([np.broadcast_to(I, shape + I.shape[-1:])[...,None], np.broadcast_to(pol, shape + pol.shape[-2:])], axis=-1)
+
+# Laguerre-Gauss mode LG_nl (n is the radial index and l the azimuthal one, 0 by default), whose intensity is proportional to rho^|l| L_n^|l|(rho)^2 exp(-rho), with rho = 2 (r/w)^2 and L the generalized Laguerre polynomial. LG_00 is gaussian_fixed (or gaussian_radial with phi = 0) and LG_01 is donut_fixed (or donut_radial)
+def laguerre_gauss(r, th, Rl, **kwargs):
+    w = _parameter(kwargs['a'])*Rl
+    n = _parameter(kwargs.get('n', 0), int)
+    l = np.abs(_parameter(kwargs.get('l', 0), int))
+    
+    def profile(r, th):
+        rho = 2*(r/w)**2
+        return rho**l * ssp.eval_genlaguerre(n, l, rho)**2 * np.exp(-rho)
+    
+    return _sample(profile, r, th, Rl, kwargs)
+
+# Hermite-Gauss mode HG_mn (m is the order along X and n along Y, 0 by default), whose intensity is proportional to (H_m(sqrt(2) x/w) H_n(sqrt(2) y/w))^2 exp(-2 (r/w)^2), with H the (physicists') Hermite polynomial. HG_00 is gaussian_fixed
+def hermite_gauss(r, th, Rl, **kwargs):
+    w = _parameter(kwargs['a'])*Rl
+    m = _parameter(kwargs.get('m', 0), int)
+    n = _parameter(kwargs.get('n', 0), int)
+    
+    def profile(r, th):
+        u = np.sqrt(2)*r*np.cos(th)/w
+        v = np.sqrt(2)*r*np.sin(th)/w
+        return (ssp.eval_hermite(m, u)*ssp.eval_hermite(n, v))**2 * np.exp(-2*(r/w)**2)
+    
+    return _sample(profile, r, th, Rl, kwargs)
@@ -0,0 +1,138 @@
+# Accuracy-versus-cost benchmark of the integration over the lens.
+# For each reference case of Ashkin, 1992 (uniformly-filled objective, Gaussian and donut beams, several relative indices), the force is calculated with every quadrature rule and a range of ray resolutions, and both the error and the time per particle position are recorded.
+# The error is measured against a converged value (Gauss-Legendre with a lot of rays), since the published values only have three digits. The error against the published values is reported too.
+#
+# Usage: python3 benchmark.py --tol 1e-3 [--out benchmark.tsv] [--quick]
+# It prints the Pareto front (the settings for which no other one is both faster and more accurate) and the cheapest settings whose error is below the tolerance in all the cases.
+import argparse
+import time
+
+import numpy as np
+
+import beam_profiles as bp
+import optical_system as osys
+
+# A microscope objective with NA = 1.25 (water-immersion) and a particle of rp=5e-6 (the same setup as the tests)
+f = 1e-3
+Rl = f * np.tan(np.arcsin(1.25/1.33))
+rp = 5e-6
+
+circular = np.array([1, 1j])
+linear = np.array([0, 1])
+
+# Reference cases: name, intensity/polarization function and its arguments, relative index, particle position, force component to check and published Q
+cases = [
+    ("uniform-1.2-z", bp.gaussian_fixed, {'a': 1e7, 'p': circular}, 1.2, [0, 0, 1.01*rp], 2, -0.276),
+    ("uniform-1.2-y", bp.gaussian_fixed, {'a': 1e7, 'p': circular}, 1.2, [0, 0.98*rp, 0], 1, -0.313),
+    ("uniform-1.4-z", bp.gaussian_fixed, {'a': 1e7, 'p': circular}, 1.4, [0, 0, 0.93*rp], 2, -0.282),
+    ("uniform-1.8-z", bp.gaussian_fixed, {'a': 1e7, 'p': circular}, 1.8, [0, 0, 0.88*rp], 2, -0.171),
+    ("gaussian-1.7-z", bp.gaussian_fixed, {'a': 1.7, 'p': circular}, 1.2, [0, 0, 1.01*rp], 2, -0.259),
+    ("gaussian-1.0-y", bp.gaussian_fixed, {'a': 1.0, 'p': circular}, 1.2, [0, 0.98*rp, 0], 1, -0.349),
+    ("donut-1.21-z", bp.donut_fixed, {'a': 1.21, 'p': linear}, 1.2, [0, 0, 1.00*rp], 2, -0.310),
+    ("donut-0.756-x", bp.donut_fixed, {'a': 0.756, 'p': linear}, 1.2, [0.98*rp, 0, 0], 0, -0.311),
+]
+
+# Resolutions (rsteps = thsteps) to try
+resolutions = [10, 14, 20, 28, 40, 56, 80, 113, 160, 226, 320]
+quick_resolutions = [10, 20, 40, 80]
+
+# Resolution of the converged values
+reference_resolution = 640
+
+# Calculates the force component of a case with the given rule and resolution. Returns the value and the time per evaluation (with the rays already generated, as in a sweep)
+def measure(case, rule, n, min_time=0.05):
+    name, fun, kwargs, nr, pos, i, published = case
+
+    opt = osys.OpticalSystemSimpleArbitrary(np.array(pos), rp, nr, Rl, f, fun, **kwargs)
+    opt.set_quadrature(rule)
+
+    # The first evaluation also generates the rays
+    Q = np.real(opt.integrate(n, n)[i])
+
+    repeats = 0
+    t0 = time.perf_counter()
+    while True:
+        opt.integrate(n, n)
+        repeats += 1
+        elapsed = time.perf_counter() - t0
+        if elapsed > min_time:
+            break
+
+    return Q, elapsed/repeats
+
+# Returns the indices of the points (costs, errors) that are on the Pareto front, sorted by cost
+def pareto_front(costs, errors):
+    front = []
+    best = np.inf
+
+    for k in np.lexsort((errors, costs)):
+        if errors[k] < best:
+            front.append(k)
+            best = errors[k]
+
+    return front
+
+# Returns the index of the cheapest point whose error is at most tol (or None if there is none)
+def cheapest(costs, errors, tol):
+    ok = np.flatnonzero(np.asarray(errors) <= tol)
+
+    if len(ok) == 0:
+        return None
+
+    return ok[np.argmin(np.asarray(costs)[ok])]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accuracy-versus-cost benchmark of the integration over the lens")
+    parser.add_argument("--tol", type=float, default=1e-3, help="required accuracy of Q")
+    parser.add_argument("--out", default=None, help="TSV file to save all the measurements into")
+    parser.add_argument("--quick", action="store_true", help="only try a few low resolutions")
+    args = parser.parse_args(argv)
+
+    ns = quick_resolutions if args.quick else resolutions
+
+    print("Calculating the converged values...")
+    reference = [measure(case, "gauss", reference_resolution, min_time=0)[0] for case in cases]
+
+    # One row per setting and case: rule, n, case, Q, error, error against the published value, time
+    records = []
+    # One entry per setting: rule, n, total time of all the cases, worst error
+    settings = []
+
+    for rule in osys.quadrature_rules:
+        for n in ns:
+            total = 0
+            worst = 0
+
+            for case, ref in zip(cases, reference):
+                Q, t = measure(case, rule, n)
+                records.append((rule, n, case[0], Q, abs(Q - ref), abs(Q - case[6]), t))
+
+                total += t
+                worst = max(worst, abs(Q - ref))
+
+            settings.append((rule, n, total/len(cases), worst))
+            print("{0:>9} {1:4d}x{1:<4d} {2:9.2e} s/position  max error {3:.2e}".format(rule, n, total/len(cases), worst))
+
+    if args.out is not None:
+        with open(args.out, "w") as out:
+            out.write("rule\trsteps\tthsteps\tcase\tQ\terror\terror_published\tseconds\n")
+            for rule, n, name, Q, err, err_pub, t in records:
+                out.write("{0}\t{1}\t{1}\t{2}\t{3:.6e}\t{4:.3e}\t{5:.3e}\t{6:.3e}\n".format(rule, n, name, Q, err, err_pub, t))
+
+    costs = [s[2] for s in settings]
+    errors = [s[3] for s in settings]
+
+    print("\nPareto front:")
+    for k in pareto_front(costs, errors):
+        rule, n, t, err = settings[k]
+        print("{0:>9} {1:4d}x{1:<4d} {2:9.2e} s/position  max error {3:.2e}".format(rule, n, t, err))
+
+    k = cheapest(costs, errors, args.tol)
+    if k is None:
+        print("\nNo setting reaches an error of {0:g}".format(args.tol))
+    else:
+        rule, n, t, err = settings[k]
+        print("\nCheapest setting with error <= {0:g}: quadrature = \"{1}\", rsteps = thsteps = {2} ({3:.2e} s/position)".format(args.tol, rule, n, t))
+
+if __name__ == "__main__":
+    main()
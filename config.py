@@ -2,7 +2,7 @@ import beam_profiles as bp
 import numpy as np
 
 # Miscellaneous options
-# File into which the computed data will be written
+# File into which the computed data will be written. If its name ends with ".npz", the results are saved as a structured NumPy file that keeps the grid (faster to save, load and plot) instead of TSV
 out_file = "results.tsv"
 
 ### Particle settings
@@ -30,6 +30,31 @@ rsteps = 200
 # Number of steps into which the azimuthal coordinate of the lens will be subdivided for integration
 thsteps = 200
 
+# The quadrature rule used for integrating over the lens: "rectangle" (the classic one of this program), "midpoint" or "gauss" (Gauss-Legendre in the radial coordinate). See optical_system.py for details, and benchmark.py for finding the cheapest settings for a given accuracy
+quadrature = "rectangle"
+
+# How the positions are evaluated: "serial" (one position after the other), "batched" (as many positions at once as fit in memory_budget, which saves a lot of overhead when there are few rays) or "parallel" (the positions are shared among several processes, each of which uses the batched engine)
+engine = "serial"
+
+# Number of processes used by the parallel engine (None to use all the CPUs)
+workers = None
+
+# Maximum memory (in bytes) that the ray bundle and the temporaries of the force calculation may use. With the serial engine, if the full bundle (rsteps*thsteps rays) doesn't fit, the rays are generated and integrated in blocks, which is slower but allows huge numbers of rays. Set it to None to always keep the whole bundle in memory (the batched engine then uses 256 MB per batch). The analytic Jacobian of the force (optical_system.integrate with jacobian=True) always needs the whole bundle, since it can't be streamed, and costs about three force evaluations
+memory_budget = None
+
+# How the ray data is stored during the force calculation: "rows" (an array with a row per ray) or "components" (separate contiguous arrays for the x, y and z components of all the rays, which is faster since every step becomes a plain elementwise operation). The results are the same
+ray_layout = "components"
+
+### Progress settings
+# Seconds between progress records (positions done, positions and rays per second, estimated time left and memory used) printed while sweeping. Set it to None to only print the final record
+progress_interval = 10
+
+# JSON-lines file to append the progress records to (one JSON object per line), e.g. for monitoring the throughput of production runs. None to not write any
+metrics_file = None
+
+# Number of positions evaluated at a time (the progress is reported, and a stop request with Ctrl-C or SIGTERM is honoured, between chunks: the results of the finished chunks are saved before exiting). None to choose it automatically (a single position with the serial engine and as many as fit in the memory budget with the others)
+chunk_positions = None
+
 ### Position settings
 # The range of positions (for each coordinate) on which the force will be calculated. The positions are relative to the focal point, and negative Z is closer to the lens. The positions are dimensional (i.e. measured in meters or whichever units you are using). It can be handy to set the particle radius to unity in order to have the positions in terms of it (which can be done without losing generality when all the rays are focused into a single spot).
 
@@ -47,3 +72,16 @@ ysteps = 100
 zstart = -2
 zstop = 2
 zsteps = 100
+
+### Adaptive sweep settings
+# If True, the grid above is not evaluated point by point. Instead, the box it spans is divided into adaptive_coarse cells along each varying coordinate, and the cells where the force on the midpoints (of the edges, faces and the center) differs from the one interpolated from the corners by more than adaptive_tol (in units of Q) are subdivided, up to adaptive_depth times. The results are then interpolated into the grid above and saved into out_file as usual, while the positions that were actually computed are saved into a TSV file with the same name, but with the extension replaced by ".adaptive.tsv"
+# Note that adaptive_tol should be bigger than the noise of the integration over the rays (which grows when rsteps and thsteps are reduced), otherwise the cells will be subdivided all the way down
+adaptive = False
+adaptive_coarse = 8
+adaptive_tol = 1e-3
+adaptive_depth = 4
+
+### Progressive sweep settings
+# If True, the grid above is evaluated in progressive_passes passes: the first one evaluates every 2^(progressive_passes-1)-th position along each coordinate with a fraction of the rays, and every pass halves the distance between the positions and doubles rsteps and thsteps (up to the values above), reusing the positions already evaluated with the same rays. out_file is rewritten after every pass with the positions evaluated so far (as a coarser grid), so it can be plotted (e.g. with plot2d.py) while the sweep goes on. The last pass gives the same results as a normal sweep. Can't be combined with adaptive sweeps
+progressive = False
+progressive_passes = 4
@@ -0,0 +1,222 @@
+# Trap design optimizer: searches the NA of the lens, the beam size (the 'a' argument of the beam profiles) and the beam profile that maximize a figure of merit of the trap, subject to constraints on the others.
+# The figures of merit are calculated from the force on the beam axis and close to it (see trap_metrics):
+# - axial_q: the maximum restoring Q against the beam propagation (usually the weakest direction of a single-beam trap)
+# - transverse_stiffness: the transverse stiffness (-dQx/dx) at the axial equilibrium
+# - trap_depth: the depth of the axial trap (integral of the restoring Q from the equilibrium until it vanishes, in units of Q times the particle radius)
+#
+# The search evaluates a grid of candidates for every profile and then refines the grid around the best one (a few times). All the candidates of a grid are evaluated at once, in parallel, and the candidates with the same NA are evaluated by the same process, which reuses the ray bundle (it only depends on the NA). Every evaluated design is cached (optionally in a file, so that the next runs with the same settings reuse it, see settings_hash).
+#
+# Usage example: python3 design.py --objective transverse_stiffness --NA 0.6 0.95 --a 0.5 2 --profiles gaussian_fixed donut_fixed --constraint axial_q 0.1 inf
+# All the other settings (particle, rays, polarization...) are taken from "config.py".
+import argparse
+import json
+import os
+
+import numpy as np
+
+import beam_profiles as bp
+import sweep
+
+metric_names = ("axial_q", "transverse_stiffness", "trap_depth")
+
+# The settings (besides the searched ones: the NA, the profile and the beam size) that the figures of merit depend on
+design_settings = ("radius", "nr", "int_pol_arguments", "rsteps", "thsteps", "quadrature")
+
+# Returns a hash (a hex string, see shards.config_hash) of the settings of the configuration cfg and the axial positions zs that the figures of merit depend on. The cached designs are only reused with the same hash
+def settings_hash(cfg, zs):
+    import shards
+
+    cfg = sweep.configure(cfg, int_pol_arguments={k: v for k, v in cfg.int_pol_arguments.items() if k != "a"})
+
+    return shards.config_hash(cfg, design_settings, {"zs": np.asarray(zs, dtype=float)})
+
+# Calculates the figures of merit of the system opt (see the description above) by sampling the force on the beam axis at the positions zs (relative to the focus, in the same units as the particle radius)
+def trap_metrics(opt, cfg, zs):
+    import scipy.optimize as so
+
+    budget = sweep.default_memory_budget if cfg.memory_budget is None else cfg.memory_budget
+
+    def forces(positions):
+        return opt.integrate_positions(positions, cfg.rsteps, cfg.thsteps, budget)
+
+    Fz = forces(np.array([[0, 0, z] for z in zs]))[:,2]
+
+    metrics = {"axial_q": -np.min(Fz), "transverse_stiffness": np.nan, "trap_depth": 0.0, "equilibrium": np.nan}
+
+    # The stable axial equilibrium, refined between the samples around it
+    k = sweep.axial_sign_change(Fz)
+    if k is None:
+        return metrics
+
+    z_eq = so.brentq(lambda z: forces(np.array([[0, 0, z]]))[0,2], zs[k], zs[k+1], xtol=1e-6*cfg.radius)
+    metrics["equilibrium"] = z_eq
+
+    # Transverse stiffness by central differences
+    h = 1e-2*cfg.radius
+    Fx = forces(np.array([[h, 0, z_eq], [-h, 0, z_eq]]))[:,0]
+    metrics["transverse_stiffness"] = -(Fx[0] - Fx[1])/(2*h)
+
+    # Depth: integrate the restoring force (-Fz) from the equilibrium until it stops being restoring
+    z = np.concatenate([[z_eq], zs[k+1:]])
+    F = np.concatenate([[0], -Fz[k+1:]])
+    end = np.flatnonzero(F[1:] <= 0)
+    n = len(F) if len(end) == 0 else end[0] + 1
+    metrics["trap_depth"] = np.sum((F[1:n] + F[:n-1])*np.diff(z[:n]))/2
+
+    return metrics
+
+# Evaluates all the designs (profile, a) with the same NA, reusing the rays of a single system (runs in a worker process)
+def _evaluate_group(args):
+    cfg, NA, designs, zs = args
+
+    cfg = sweep.configure(cfg, NA=NA)
+    opt = sweep.make_system(cfg)
+
+    out = []
+    for profile, a in designs:
+        kwargs = dict(cfg.int_pol_arguments, a=a)
+        opt.set_beam(getattr(bp, profile), **kwargs)
+        out.append(trap_metrics(opt, cfg, zs))
+
+    return out
+
+class DesignSearch(object):
+    # base is the configuration (usually, the config module) that provides all the settings that are not searched. zs are the axial positions used for calculating the figures of merit
+    def __init__(self, base, zs, workers=None, cache_file=None):
+        self._cfg = sweep.configure(base)
+        self._zs = np.asarray(zs, dtype=float)
+        self._workers = sweep.worker_count(self._cfg) if workers is None else workers
+
+        # Evaluated designs, indexed by (profile, NA, a) (rounded, so that designs that are numerically the same are not evaluated twice)
+        self._cache = {}
+        self._cache_file = cache_file
+        self._hash = settings_hash(self._cfg, self._zs)
+
+        # The entries of the cache file evaluated with other settings, which are kept in the file but not used
+        self._other_entries = []
+
+        # Number of designs actually evaluated (i.e. not found in the cache)
+        self.evaluations = 0
+
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file) as f:
+                for entry in json.load(f):
+                    if entry.get("settings") == self._hash:
+                        self._cache[(entry["profile"], entry["NA"], entry["a"])] = entry["metrics"]
+                    else:
+                        self._other_entries.append(entry)
+
+    @staticmethod
+    def _key(profile, NA, a):
+        return (profile, round(float(NA), 9), round(float(a), 9))
+
+    # Returns the figures of merit of all the designs (a list of (profile, NA, a) tuples), evaluating the ones that are not cached
+    def evaluate(self, designs):
+        missing = sorted(set(self._key(*d) for d in designs) - set(self._cache))
+
+        # Group the missing designs by NA (every group is evaluated by a single process with the same rays)
+        groups = {}
+        for profile, NA, a in missing:
+            groups.setdefault(NA, []).append((profile, a))
+
+        self.evaluations += len(missing)
+
+        tasks = [(self._cfg, NA, group, self._zs) for NA, group in groups.items()]
+        for task, metrics in zip(tasks, sweep.parallel_map(_evaluate_group, tasks, self._workers)):
+            for (profile, a), m in zip(task[2], metrics):
+                self._cache[(profile, task[1], a)] = {k: float(v) for k, v in m.items()}
+
+        if missing and self._cache_file is not None:
+            self.save_cache()
+
+        return [self._cache[self._key(*d)] for d in designs]
+
+    def save_cache(self):
+        entries = self._other_entries + [{"profile": p, "NA": NA, "a": a, "settings": self._hash, "metrics": m} for (p, NA, a), m in self._cache.items()]
+
+        with open(self._cache_file, "w") as f:
+            json.dump(entries, f)
+
+    # The score of a design: the objective if all the constraints (a dict of metric -> (min, max)) are met, otherwise -inf
+    @staticmethod
+    def score(metrics, objective, constraints):
+        for name, (lo, hi) in constraints.items():
+            if not (lo <= metrics[name] <= hi):
+                return -np.inf
+
+        value = metrics[objective]
+
+        return -np.inf if np.isnan(value) else value
+
+    # Searches the best design. NA_range and a_range are (min, max) pairs, profiles is a list of names of beam_profiles.py. Every level evaluates a grid of points x points candidates per profile, and the next level refines the grid around the best candidate of each profile.
+    # Returns a list of (score, profile, NA, a, metrics) of all the evaluated designs, best first
+    def run(self, objective, constraints, NA_range, a_range, profiles, points=5, levels=3):
+        if objective not in metric_names:
+            raise ValueError("Unknown objective: {0}".format(objective))
+
+        boxes = {p: (tuple(NA_range), tuple(a_range)) for p in profiles}
+        evaluated = {}
+
+        for level in range(levels):
+            designs = []
+            for p, ((NA_lo, NA_hi), (a_lo, a_hi)) in boxes.items():
+                for NA in np.linspace(NA_lo, NA_hi, points):
+                    for a in np.linspace(a_lo, a_hi, points):
+                        designs.append(self._key(p, NA, a))
+
+            for d, m in zip(designs, self.evaluate(designs)):
+                evaluated[d] = m
+
+            # Shrink the box of every profile around its best design (one grid step to each side, without leaving the original ranges)
+            for p, ((NA_lo, NA_hi), (a_lo, a_hi)) in boxes.items():
+                best = max((d for d in evaluated if d[0] == p), key=lambda d: self.score(evaluated[d], objective, constraints))
+                dNA = (NA_hi - NA_lo)/(points - 1)
+                da = (a_hi - a_lo)/(points - 1)
+
+                boxes[p] = ((max(NA_range[0], best[1] - dNA), min(NA_range[1], best[1] + dNA)),
+                            (max(a_range[0], best[2] - da), min(a_range[1], best[2] + da)))
+
+        ranking = [(self.score(m, objective, constraints), d[0], d[1], d[2], m) for d, m in evaluated.items()]
+        ranking.sort(key=lambda r: -r[0])
+
+        return ranking
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trap design optimizer")
+    parser.add_argument("--objective", choices=metric_names, default="axial_q", help="figure of merit to maximize")
+    parser.add_argument("--constraint", nargs=3, action="append", default=[], metavar=("METRIC", "MIN", "MAX"), help="keep a figure of merit between MIN and MAX (can be repeated; use inf for no limit)")
+    parser.add_argument("--NA", nargs=2, type=float, default=[0.6, 0.95], metavar=("MIN", "MAX"))
+    parser.add_argument("--a", nargs=2, type=float, default=[0.5, 2.0], metavar=("MIN", "MAX"), help="range of beam sizes relative to the lens radius")
+    parser.add_argument("--profiles", nargs="+", default=["gaussian_fixed"], help="names of the beam profiles (in beam_profiles.py) to consider")
+    parser.add_argument("--points", type=int, default=5, help="candidates along each coordinate of every grid")
+    parser.add_argument("--levels", type=int, default=3, help="number of grid refinements")
+    parser.add_argument("--zrange", nargs=3, type=float, default=[-1.5, 2.0, 36], metavar=("START", "STOP", "STEPS"), help="axial positions (in particle radii) used for calculating the figures of merit")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: the workers setting of config.py)")
+    parser.add_argument("--cache", default=None, help="JSON file to cache the evaluated designs in")
+    parser.add_argument("--out", default=None, help="TSV file to save all the evaluated designs into")
+    args = parser.parse_args(argv)
+
+    import config
+
+    for name, lo, hi in args.constraint:
+        if name not in metric_names:
+            parser.error("unknown figure of merit: {0}".format(name))
+    constraints = {name: (float(lo), float(hi)) for name, lo, hi in args.constraint}
+
+    zs = config.radius*np.linspace(args.zrange[0], args.zrange[1], int(args.zrange[2]))
+
+    search = DesignSearch(config, zs, workers=args.workers, cache_file=args.cache)
+    ranking = search.run(args.objective, constraints, args.NA, args.a, args.profiles, args.points, args.levels)
+
+    header = "score\tprofile\tNA\ta\t" + "\t".join(metric_names) + "\tequilibrium"
+    lines = ["{0:.6g}\t{1}\t{2:.6g}\t{3:.6g}\t".format(*r[:4]) + "\t".join("{0:.6g}".format(r[4][k]) for k in metric_names + ("equilibrium",)) for r in ranking]
+
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            f.write(header + "\n" + "\n".join(lines) + "\n")
+
+    print(header)
+    print("\n".join(lines[:10]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# Batch job runner: runs many configurations (e.g. the variants of a parameter study) in a single process, instead of a copy of "config.py" and a new interpreter for every one of them.
+# The jobs are ordered so that the ones with the same optics (particle radius, NA, quadrature, ray layout and number of rays) run one after the other and share the same system and ray bundle: only the beam (when it changes) and the particle index are updated between them.
+#
+# The job file is JSON:
+#
+#     {
+#         "defaults": {"rsteps": 100, "thsteps": 100, "zstart": -2, "zstop": 2, "zsteps": 50, "engine": "batched"},
+#         "jobs": [
+#             {"name": "gaussian", "out_file": "gaussian.npz", "NA": 0.9, "int_pol_arguments": {"a": 1.0, "p": [1, "1j"]}},
+#             {"name": "donut", "out_file": "donut.npz", "NA": 0.9, "int_pol_function": "donut_fixed", "int_pol_arguments": {"a": 1.0, "p": [1, "1j"]}}
+#         ]
+#     }
+#
+# Every job overrides the defaults, which override "config.py". Any setting of "config.py" can be given (the intensity/polarization function by its name in beam_profiles.py), and every job needs its own out_file. Lists become arrays and complex numbers are written as strings, like in the requests of service.py.
+#
+# Usage example: python3 jobs.py study.json
+# Ctrl-C (or SIGTERM) stops after the positions being evaluated: the results of the current job obtained so far are saved, and the remaining jobs are not run
+import argparse
+import json
+import sys
+import time
+
+# Reads the job file and returns the settings of every job (the defaults updated with the ones of the job), in the order of the file. The name of a job defaults to its number. Raises ValueError if the file is not valid
+def load_jobs(path):
+    with open(path) as f:
+        data = json.load(f)
+
+    if isinstance(data, list):
+        data = {"jobs": data}
+    if not isinstance(data, dict) or not isinstance(data.get("jobs"), list):
+        raise ValueError("The job file must have a list of jobs")
+
+    defaults = data.get("defaults", {})
+    jobs = []
+    out_files = set()
+
+    for i, job in enumerate(data["jobs"]):
+        if not isinstance(job, dict):
+            raise ValueError("Job {0} is not an object".format(i))
+
+        settings = dict(defaults)
+        settings.update(job)
+        settings.setdefault("name", str(i))
+
+        if "out_file" not in job:
+            raise ValueError("Job {0} has no out_file".format(settings["name"]))
+        if settings["out_file"] in out_files:
+            raise ValueError("More than one job saves into {0}".format(settings["out_file"]))
+        out_files.add(settings["out_file"])
+
+        jobs.append(settings)
+
+    return jobs
+
+# Makes the configuration of every job (see load_jobs) from the base one (usually, the config module). Raises ValueError if a job has a setting that the base doesn't have (e.g. a misspelled one), or several beams at once (see sweep.check_single_beam)
+def make_configs(base, jobs):
+    import service
+    import sweep
+
+    cfgs = []
+    for job in jobs:
+        settings = service.decode_settings({k: v for k, v in job.items() if k != "name"})
+
+        unknown = sorted(k for k in settings if not hasattr(base, k))
+        if unknown:
+            raise ValueError("Job {0} has unknown settings: {1}".format(job["name"], ", ".join(unknown)))
+
+        cfg = sweep.configure(base, **settings)
+        cfg.name = job["name"]
+
+        # The systems of the jobs after the first of a group are not made with sweep.make_system (only their beam is changed)
+        sweep.check_single_beam(cfg)
+        cfgs.append(cfg)
+
+    return cfgs
+
+# The settings that the ray bundle depends on: jobs with the same ones can share a system (the focal distance, and so the lens radius, depend on the particle radius, see sweep.py)
+def optics_key(cfg):
+    return (cfg.radius, cfg.NA, cfg.quadrature, cfg.ray_layout, cfg.rsteps, cfg.thsteps)
+
+# The beam of a configuration (the intensity/polarization function and its arguments), as a string that can be compared
+def beam_key(cfg):
+    import service
+
+    return json.dumps([cfg.int_pol_function.__module__, cfg.int_pol_function.__name__, service.encode_value(cfg.int_pol_arguments)], sort_keys=True)
+
+# Returns the order in which the jobs (their configurations) are run: grouped by optics and, inside every group, by beam (otherwise, in the order of the file)
+def order_jobs(cfgs):
+    return sorted(range(len(cfgs)), key=lambda i: (optics_key(cfgs[i]), beam_key(cfgs[i])))
+
+class JobRunner(object):
+    # stream is where a line is printed after every job (None to print nothing)
+    def __init__(self, stream=sys.stderr):
+        self._stream = stream
+
+        # The system of the last job, and the optics and beam it was set up for
+        self._opt = None
+        self._optics = None
+        self._beam = None
+
+        # Number of systems built and of beams set so far
+        self.systems = 0
+        self.beams = 0
+
+    # Returns the system for the configuration cfg, reusing the one of the previous job if the optics are the same
+    def system(self, cfg):
+        import sweep
+
+        optics = optics_key(cfg)
+        beam = beam_key(cfg)
+
+        if optics != self._optics:
+            self._opt = sweep.make_system(cfg)
+            self._optics = optics
+            self.systems += 1
+            self.beams += 1
+        elif beam != self._beam:
+            self._opt.set_beam(cfg.int_pol_function, **cfg.int_pol_arguments)
+            self.beams += 1
+
+        self._beam = beam
+        self._opt.set_particle_index(cfg.nr)
+
+        return self._opt
+
+    # Runs the jobs (their configurations) in the best order (see order_jobs). stop is a progress.GracefulStop (or None). If keep_going is True, a job that fails is reported and the next ones are run anyway.
+    # Returns the names of the jobs that failed, and the ones that were not run (or not completed) because the run was stopped
+    def run(self, cfgs, stop=None, keep_going=False):
+        import run
+
+        order = order_jobs(cfgs)
+        failed = []
+
+        for n, i in enumerate(order):
+            cfg = cfgs[i]
+            start = time.perf_counter()
+
+            try:
+                completed = run.run(cfg, self.system(cfg), stop)
+            except Exception as e:
+                if not keep_going:
+                    raise
+
+                # The system may be left in any state
+                self._optics = None
+                failed.append(cfg.name)
+                self._print("Job {0}/{1} ({2}) failed: {3}".format(n + 1, len(cfgs), cfg.name, e))
+                continue
+
+            if not completed:
+                return failed, [cfgs[j].name for j in order[n:]]
+
+            self._print("Job {0}/{1} ({2}) saved into {3} in {4:.3g} s".format(n + 1, len(cfgs), cfg.name, cfg.out_file, time.perf_counter() - start))
+
+        return failed, []
+
+    def _print(self, line):
+        if self._stream is not None:
+            self._stream.write(line + "\n")
+            self._stream.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs many configurations (given by a JSON job file) in a single process")
+    parser.add_argument("file", help="JSON job file")
+    parser.add_argument("--list", action="store_true", help="don't calculate anything: print the jobs in the order they would run")
+    parser.add_argument("--keep-going", action="store_true", help="run the remaining jobs when one fails")
+    args = parser.parse_args(argv)
+
+    # Nothing heavy is imported until the job file is known to be valid
+    try:
+        jobs = load_jobs(args.file)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    import config
+    import progress
+
+    try:
+        cfgs = make_configs(config, jobs)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.list:
+        for i in order_jobs(cfgs):
+            cfg = cfgs[i]
+            print("{0}\t{1}\tradius={2} NA={3} rays={4}x{5} {6}".format(cfg.name, cfg.out_file, cfg.radius, cfg.NA, cfg.rsteps, cfg.thsteps, cfg.int_pol_function.__name__))
+        return
+
+    runner = JobRunner()
+
+    with progress.GracefulStop() as stop:
+        failed, remaining = runner.run(cfgs, stop, args.keep_going)
+
+    sys.stderr.write("{0} jobs run with {1} systems ({2} beams)\n".format(len(cfgs) - len(remaining), runner.systems, runner.beams))
+
+    if remaining:
+        sys.stderr.write("Stopped: not completed: {0}\n".format(", ".join(remaining)))
+        sys.exit(128 + stop.requested)
+    if failed:
+        sys.stderr.write("Failed: {0}\n".format(", ".join(failed)))
+        sys.exit(1)
+
+# The parallel engine starts new processes, which (on some systems) import this file again: the jobs must only run in the main one
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,4 @@
 import numpy as np
-import numpy.linalg as npl
-
-import scipy.integrate as si
 
 # Used for profiling code
 #import line_profiler
@@ -14,6 +11,26 @@ def dot_rows(a, b):
 def normalize(a):
     return a / np.sqrt(np.einsum('ij,ij->i', a, np.conj(a))).reshape(-1,1)
 
+# Peak memory (in bytes) used per ray by the ray bundle and all the temporaries of the force calculation, used to size the blocks and batches of rays. It's a conservative round figure: tracemalloc measures up to ~490 bytes per ray while the bundle is generated (and ~310 with the components layout, ~380 with the rows one, once it's cached) with complex polarizations, for any quadrature rule. The Jacobian doubles it. See TestMemoryPerRay in tests/test_system.py
+bytes_per_ray = 512
+
+# Adds x to the running sum s using Neumaier's compensated summation, where c is the running compensation (the lost low-order bits). Works elementwise on arrays, so a whole force vector can be accumulated at once
+def compensated_add(s, c, x):
+    t = s + x
+    c = c + np.where(np.abs(s) >= np.abs(x), (s - t) + x, (x - t) + s)
+    
+    return t, c
+
+# The quadrature rules that can be used for integrating over the lens (see OpticalSystemSimple._quadrature)
+quadrature_rules = ("rectangle", "midpoint", "gauss")
+
+# The layouts in which the ray data can be stored (see OpticalSystem.set_ray_layout)
+ray_layouts = ("rows", "components")
+
+# Adds dimensions of size 1 after the first one of an array of components (see OpticalSystem._ray_force_components) until it has ndim dimensions, so that its other dimensions are aligned with the last ones of the arrays it's broadcast against
+def _expand(x, ndim):
+    return x.reshape(x.shape[:1] + (1,)*(ndim - x.ndim) + x.shape[1:])
+
 class OpticalSystem(object):
     def __init__(self, c, Rp, nr):
         # Particle properties
@@ -28,6 +45,16 @@ class OpticalSystem(object):
         # Flag to indicate that the ray directions and origins are up-to-date with the current system configuration (to avoid calculating them multiple times)
         self._rays_updated = False
         
+        self._ray_layout = "rows"
+        
+    # Sets how the ray data (origins, directions and polarizations) is stored: "rows" (an (N,3) array with a row per ray) or "components" (a (3,N) array, i.e. three contiguous arrays with the x, y and z components of all the rays). With "components", the force calculation is done with elementwise operations on whole arrays instead of products of short rows, which is faster (see _ray_force_components). The forces returned by the integrals don't depend on the layout
+    def set_ray_layout(self, layout):
+        if layout in ray_layouts:
+            self._ray_layout = layout
+            self._rays_updated = False
+        else:
+            raise ValueError("Unknown ray layout: {0}".format(layout))
+        
     def set_particle_radius(self, Rp):
         # Make sure that the sphere radius is not zero or negative
         if Rp <= 0:
@@ -83,31 +110,17 @@ class OpticalSystem(object):
         
         # Calculate the discriminant (to see whether there are any solutions)
         
-        # The dot products between ln's and oc's because it will be used a lot later
-        ln_dot_oc = dot_rows(ln, oc)
-        
-        # Norms squared of oc's (because this operation is more efficient)
-        oc_dot_oc = dot_rows(oc, oc)
+        # The component of oc that is perpendicular to the line (its norm is the distance between the line and the center of the sphere)
+        g = oc - dot_rows(oc, ln).reshape(-1,1)*ln
         
-        D = ln_dot_oc**2 - oc_dot_oc + self._Rp**2
+        # The discriminant is R^2 minus the squared distance. Note that this is the same as (ln.oc)^2 - oc.oc + R^2, but without subtracting big numbers from each other (the lens is far away from the sphere), which would lose a lot of precision close to normal incidence
+        D = self._Rp**2 - dot_rows(g, g)
         
         # Discriminant values below zero indicate no intersection, which we will denote by NaN
         D[D < 0] = np.nan
         
-        # For convenience, calculate the square root of the determinants, as this will be used later a couple of times
-        sqrtD = np.sqrt(D)
-        
-        # The distance along the line where an intersection occurs (doesn't matter which since this is a sphere)
-        d = -ln_dot_oc + sqrtD
-        
-        # The points at which the intersections occur is x:
-        x = self._o + d.reshape(-1,1)*ln
-        
-        # The vector that points from the center of the sphere to the intersection is r:
-        r = x - self._c
-        
-        # To find the angle of intersecting ray with the normal to the surface, first find the cosine of that angle (absolute value of it)
-        c_angles = np.abs(dot_rows(ln, r)/self._Rp)
+        # The cosine of the angle of the intersecting ray with the normal to the surface (absolute value of it) is the projection of the line director on the radius at the intersection point (ln.r), which is the square root of the discriminant
+        c_angles = np.sqrt(D)/self._Rp
         
         # Sometimes due to floating-point errors, the value will be slightly higher than 1. The following corrects it:
         # We turn off the error reporting since some of the values are deliberately NaN
@@ -119,7 +132,19 @@ class OpticalSystem(object):
     
     # This function calculates the normalized force (i.e. actual force multiplied by c/(n_1 P)) of a single ray described by a line whose origin is o and whose direction of propagation is l. The sphere of radius R has its center in c and has refractive index nr.
     # Important note: the polarization p is a Jones' vector specified in the lab's coordinate system (e.g. before entering the lens, so that it only has XY components). This vector can be complex. For example, for circular polarization this vector would be (1,i,0), while for linear polarization it is completely real. Its normalization is not important as it is normalized in the code.
-    def _ray_force(self, p):
+    # If weights (one per ray) are given, the weighted sum of the derivatives of the forces with respect to the center of the sphere is also returned (see _ray_force_components), as a 3x3 matrix
+    def _ray_force(self, p, weights=None):
+        if self._ray_layout == "components":
+            # With several beams (see OpticalSystemSimpleArbitrary.set_beam), the rays are the same for all of them
+            o, l, c = (_expand(x, p.ndim) for x in (self._o, self._l, np.reshape(self._c, (-1, 3)).transpose()))
+            
+            return self._ray_force_components(o, l, c, p, weights)
+        
+        if weights is not None:
+            # The derivatives are only implemented with components (the forces are returned as rows, like in this layout)
+            F, J = self._ray_force_components(self._o.transpose(), self._l.transpose(), np.reshape(self._c, (-1, 3)).transpose(), p.transpose(), weights)
+            return F.transpose(), J
+        
         # Calculate the incidence angle first. NaN values will be passed because they will be filtered later
         th = self._intersection_angle()
         
@@ -185,6 +210,147 @@ class OpticalSystem(object):
         F[np.isnan(F)] = 0
         
         return F
+    
+    # The same as _ray_force, but with the ray data stored as components: o, l, c and p are (3,...) arrays whose first index is the component (x, y or z), and the rest of the dimensions are broadcast against each other (e.g. the rays of a bundle against several particle centers). Returns the forces as a (3,...) array.
+    # Every step is a sum of products of the component arrays, so there are no short rows to reduce and no reshapes for broadcasting
+    # If weights are given (an array that is broadcast against the rays, whose last dimension is the ray), the weighted sum over the rays of the derivatives of the forces with respect to the center of the sphere is also returned, as a (...,3,3) array J where J[...,i,j] is the derivative of the component i of the force with respect to the coordinate j of the center (see _ray_force_jacobian)
+    def _ray_force_components(self, o, l, c, p, weights=None):
+        # The vector from the center of the sphere to the origin of the ray and its component perpendicular to the ray (Gram-Schmidt). The norm of the latter is the distance between the ray and the center, which gives the incidence angle (see _intersection_angle), and its direction is the direction of the gradient force (see _ray_force)
+        a = o - c
+        al = a[0]*l[0] + a[1]*l[1] + a[2]*l[2]
+        g = a - al*l
+        g2 = g[0]**2 + g[1]**2 + g[2]**2
+        
+        # Discriminant values below zero indicate no intersection, which we will denote by NaN
+        D = self._Rp**2 - g2
+        D[D < 0] = np.nan
+        
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sqrt_D = np.sqrt(D)
+            c_angles = sqrt_D/self._Rp
+            c_angles[(c_angles > 1) & (c_angles < 1+1e-8)] = 1
+            th = np.arccos(c_angles)
+            
+            # The rays that pass through the center have no gradient force (see _ray_force)
+            dist = np.sqrt(g2)
+            dir_grad = g/dist
+        dir_grad[np.isnan(dir_grad)] = 0
+        
+        r = self._snell(th)
+        
+        # The fraction of the power in the incidence plane (see _ray_force)
+        pn = np.abs(p[0])**2 + np.abs(p[1])**2 + np.abs(p[2])**2
+        Pp = (np.abs(p[0]*dir_grad[0] + p[1]*dir_grad[1] + p[2]*dir_grad[2])**2 + np.abs(p[0]*l[0] + p[1]*l[1] + p[2]*l[2])**2)/pn
+        Pp[(Pp > 1) & (Pp < 1+1e-7)] = 1
+        
+        T, R = self._fresnel(th, r, Pp)
+        
+        th2 = 2*th
+        r2 = 2*r
+        Rsin2th = R*np.sin(th2)
+        Rcos2th = R*np.cos(th2)
+        denominator = (1 + R**2 + 2*R*np.cos(r2))
+        th2_r2 = th2-r2
+        Tsq = T**2
+        
+        Fs = 1 + Rcos2th - (Tsq * (np.cos(th2_r2) + Rcos2th)) / denominator
+        Fg = Rsin2th - (Tsq * (np.sin(th2_r2) + Rsin2th)) / denominator
+        
+        F = Fs*l - Fg*dir_grad
+        F[np.isnan(F)] = 0
+        
+        if weights is None:
+            return F
+        
+        # The derivatives are calculated from the same intermediate values
+        J = self._ray_force_jacobian(weights, l, p, dist, sqrt_D, dir_grad, pn, Pp, T, R, Fg)
+        
+        return F, J
+    
+    # Calculates the weighted sum of the derivatives of the force of every ray with respect to the center of the sphere c (see _ray_force_components for the arguments and the result), by the chain rule through the geometry of the intersection:
+    # - the component of the vector from the center to the ray that is perpendicular to the ray is g = P(o - c), with P = I - l l^T, so dg/dc = -P. Its norm is the distance between the ray and the center, Rp sin(th), so the gradient of the incidence angle is -g^/sqrt(D), and the derivative of the direction of the gradient force g^ is -(P - g^ g^^T)/|g|
+    # - the refraction angle changes as dr/dth = cos(th)/(nr cos(r)) (Snell's law)
+    # - Pp only changes through g^ (with v = Re(conj(p.g^) p), its gradient is 2 (dg^/dc)^T v/|p|^2)
+    # - the reflectivity R changes through the angles and Pp, and Fs and Fg through the angles and R
+    # The force is F = Fs l - Fg g^, so dF/dc = l grad(Fs)^T - g^ grad(Fg)^T - Fg dg^/dc.
+    # dist is |g| and sqrt_D is sqrt(D). The sines and cosines of the angles are found algebraically from them (no trigonometric functions are evaluated), and the matrices of the rays are never built: the weighted sums of the products of their factors are taken directly
+    def _ray_force_jacobian(self, weights, l, p, dist, sqrt_D, dir_grad, pn, Pp, T, R, Fg):
+        nr = self._nr
+        
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # The angles
+            sinth = dist/self._Rp
+            costh = sqrt_D/self._Rp
+            sinr = sinth/nr
+            cosr = np.sqrt(1 - sinr**2)
+            
+            sin2th, cos2th = 2*sinth*costh, 1 - 2*sinth**2
+            sin2r, cos2r = 2*sinr*cosr, 1 - 2*sinr**2
+            sin2th_2r = sin2th*cos2r - cos2th*sin2r
+            cos2th_2r = cos2th*cos2r + sin2th*sin2r
+            
+            # Gradient of the incidence angle and derivative of the refraction angle
+            grad_th = -dir_grad/sqrt_D
+            dr = costh/(nr*cosr)
+            
+            # The matrix P - g^ g^^T (projection onto the direction perpendicular to both the ray and g^) applied to v gives the gradient of Pp
+            pg = p[0]*dir_grad[0] + p[1]*dir_grad[1] + p[2]*dir_grad[2]
+            v = np.real(np.conj(pg)*p)
+            vl = v[0]*l[0] + v[1]*l[1] + v[2]*l[2]
+            vg = v[0]*dir_grad[0] + v[1]*dir_grad[1] + v[2]*dir_grad[2]
+            grad_Pp = -2/(pn*dist)*(v - vl*l - vg*dir_grad)
+            
+            # Reflectivities of both polarizations (see _fresnel) and their derivatives with respect to th (including the change of r)
+            us, vs = costh - nr*cosr, costh + nr*cosr
+            dus, dvs = -sinth + nr*sinr*dr, -sinth - nr*sinr*dr
+            Rs = (us/vs)**2
+            dRs = 2*us*(dus*vs - us*dvs)/vs**3
+            
+            up, vp = cosr - nr*costh, cosr + nr*costh
+            dup, dvp = -sinr*dr + nr*sinth, -sinr*dr - nr*sinth
+            Rpar = (up/vp)**2
+            dRp = 2*up*(dup*vp - up*dvp)/vp**3
+            
+            dR_th = (1 - Pp)*dRs + Pp*dRp
+            dR_Pp = Rpar - Rs
+            
+            # Partial derivatives of Fs and Fg with respect to th (including the change of r) and R (note that dT/dR = -1)
+            A = cos2th_2r + R*cos2th
+            B = sin2th_2r + R*sin2th
+            denominator = 1 + R**2 + 2*R*cos2r
+            Tsq = T**2
+            
+            dA_th = -sin2th_2r*(2 - 2*dr) - 2*R*sin2th
+            dB_th = cos2th_2r*(2 - 2*dr) + 2*R*cos2th
+            dden_th = -4*R*sin2r*dr
+            dden_R = 2*R + 2*cos2r
+            
+            dFs_th = -2*R*sin2th - Tsq*(dA_th*denominator - A*dden_th)/denominator**2
+            dFg_th = 2*R*cos2th - Tsq*(dB_th*denominator - B*dden_th)/denominator**2
+            dFs_R = cos2th - (-2*T*A + Tsq*cos2th)/denominator + Tsq*A*dden_R/denominator**2
+            dFg_R = sin2th - (-2*T*B + Tsq*sin2th)/denominator + Tsq*B*dden_R/denominator**2
+            
+            # Gradients of Fs and Fg
+            grad_Fs = (dFs_th + dFs_R*dR_th)*grad_th + dFs_R*dR_Pp*grad_Pp
+            grad_Fg = (dFg_th + dFg_R*dR_th)*grad_th + dFg_R*dR_Pp*grad_Pp
+            
+            q = Fg/dist
+        
+        # The rays that don't hit the sphere don't contribute, and neither do the ones that pass through its center (whose derivatives are undefined, but bounded)
+        for x in (grad_Fs, grad_Fg, q):
+            x[~np.isfinite(x)] = 0
+        
+        # And finally, the sum of the derivatives of the forces: l grad(Fs)^T - g^ grad(Fg)^T + (Fg/|g|)(I - l l^T - g^ g^^T), as a single product of the left and right factors of all the terms (concatenated along the rays)
+        shape = (3,) + np.broadcast(weights, q, l[0]).shape
+        wq = weights*q
+        
+        left = np.concatenate([np.broadcast_to(x, shape) for x in (weights*l, -weights*dir_grad, -wq*l, -wq*dir_grad)], axis=-1)
+        right = np.concatenate([np.broadcast_to(grad_Fs, shape), np.broadcast_to(grad_Fg, shape), np.broadcast_to(l, shape), np.broadcast_to(dir_grad, shape)], axis=-1)
+        
+        J = np.moveaxis(left, 0, -2) @ np.moveaxis(right, 0, -1)
+        J += np.sum(wq, axis=-1)[...,None,None]*np.eye(3)
+        
+        return J
   
 # An optical system where all the rays are focused into a single spot (most common arrangement)  
 class OpticalSystemSimple(OpticalSystem):
@@ -196,6 +362,14 @@ class OpticalSystemSimple(OpticalSystem):
         self.set_focal_distance(f)
         self.set_lens_radius(Rl)
         
+        # The integration settings for which the rays were generated
+        self._bundle_key = None
+        
+        # The quadrature settings for which the nodes and weights were calculated
+        self._quadrature_key = None
+        
+        self.set_quadrature("rectangle")
+        
         self._c = np.array([np.array([0, 0, f]) + c])
         
     def set_focal_distance(self, f):
@@ -212,6 +386,14 @@ class OpticalSystemSimple(OpticalSystem):
         else:
             raise ValueError("Invalid lens radius: {0}".format(Rl))
         
+    # Sets the quadrature rule used for integrating over the lens (see _quadrature)
+    def set_quadrature(self, rule):
+        if rule in quadrature_rules:
+            self._quadrature_rule = rule
+            self._rays_updated = False
+        else:
+            raise ValueError("Unknown quadrature rule: {0}".format(rule))
+        
     # Sets the position of the particle relative to the focal spot
     def set_particle_center(self, c):
         self._c = np.array([np.array([0, 0, self._f]) + c])
@@ -221,11 +403,16 @@ class OpticalSystemSimple(OpticalSystem):
         if not self._rays_updated:
             n_rays = len(r)
             
-            self._o = np.array([r*np.cos(th), r*np.sin(th), np.zeros(n_rays)]).transpose()
-            self._l = np.tile(np.array([0, 0, self._f]), (n_rays, 1)) - self._o
-            
-            # Normalize the rays's directions
-            self._l = normalize(self._l)      
+            if self._ray_layout == "components":
+                self._o = np.array([r*np.cos(th), r*np.sin(th), np.zeros(n_rays)])
+                self._l = np.array([[0], [0], [self._f]]) - self._o
+                self._l /= np.sqrt(self._l[0]**2 + self._l[1]**2 + self._l[2]**2)
+            else:
+                self._o = np.array([r*np.cos(th), r*np.sin(th), np.zeros(n_rays)]).transpose()
+                self._l = np.tile(np.array([0, 0, self._f]), (n_rays, 1)) - self._o
+                
+                # Normalize the rays's directions
+                self._l = normalize(self._l)      
             
             # Let know that the rays have been updated 
             self._rays_updated = True        
@@ -236,53 +423,252 @@ class OpticalSystemSimple(OpticalSystem):
     def _total_ray_force(self, rs, ths):
         _gen_rays(rs, ths)
     
-    # Integrates all the rays, dividing the lens radius by rsteps and the polar angle (2pi) into thsteps
-    def integrate(self, rsteps, thsteps):
-        rrange = np.linspace(0, self._Rl, rsteps)
+    # Sums the forces of the rays (as returned by _total_ray_force, in the current ray layout) with the weights w. With several beams, returns a (..., 3) array with the force of every beam
+    def _weighted_sum(self, w, forces):
+        if self._ray_layout == "components":
+            return np.moveaxis(forces @ w, 0, -1)
+        
+        return w @ forces
+    
+    # Returns the nodes and the weights of the quadrature rule used for integrating over the lens: first for the radial coordinate (dividing the lens radius into rsteps) and then for the polar angle (dividing 2pi into thsteps). The rules are:
+    # - "rectangle": rsteps evenly-spaced radii including both the center and the edge of the lens, all with the same weight (this is how the program has always integrated, though it slightly overestimates the integral)
+    # - "midpoint": the radii are the midpoints of rsteps equal rings
+    # - "gauss": the radii are the nodes of Gauss-Legendre quadrature of order rsteps
+    # For the last two rules, the polar angle is divided evenly with equal weights (which is the trapezoidal rule on a ring, very accurate for periodic functions)
+    def _quadrature(self, rsteps, thsteps):
+        # The nodes are only calculated again if the settings changed (computing Gauss-Legendre nodes is not cheap)
+        key = (rsteps, thsteps, self._quadrature_rule, self._Rl)
+        if key != self._quadrature_key:
+            self._quadrature_nodes = self._quadrature_nodes_weights(rsteps, thsteps)
+            self._quadrature_key = key
+        
+        return self._quadrature_nodes
+    
+    # Calculates the nodes and the weights of the current quadrature rule (see _quadrature)
+    def _quadrature_nodes_weights(self, rsteps, thsteps):
+        rule = self._quadrature_rule
         
         # The endpoint is excluded since we are on a ring (0 to 2pi)
         thrange = np.linspace(0, 2*np.pi, thsteps, endpoint=False)
         
+        if rule == "rectangle":
+            rrange = np.linspace(0, self._Rl, rsteps)
+            
+            dr = self._Rl/(rsteps-1)
+            dth = 2*np.pi/(thsteps-1)
+            
+            return rrange, dr*np.ones(rsteps), thrange, dth*np.ones(thsteps)
+        
+        wth = 2*np.pi/thsteps*np.ones(thsteps)
+        
+        if rule == "midpoint":
+            dr = self._Rl/rsteps
+            
+            return (np.arange(rsteps) + 0.5)*dr, dr*np.ones(rsteps), thrange, wth
+        else:
+            # Gauss-Legendre nodes and weights are given for [-1,1]
+            x, w = np.polynomial.legendre.leggauss(rsteps)
+            
+            return self._Rl*(x + 1)/2, self._Rl*w/2, thrange, wth
+    
+    # Makes sure that the cached rays correspond to the given integration settings (otherwise, they will be generated again)
+    def _select_bundle(self, key):
+        key = key + (self._quadrature_rule,)
+        if key != self._bundle_key:
+            self._rays_updated = False
+            self._bundle_key = key
+    
+    # Integrates all the rays, dividing the lens radius by rsteps and the polar angle (2pi) into thsteps
+    # If jacobian is True, returns the force and its derivatives with respect to the position of the particle (a 3x3 matrix whose element i,j is the derivative of the component i of the force with respect to the coordinate j), calculated analytically in the same pass (see OpticalSystem._ray_force_jacobian). The stiffness matrix of the trap is minus this matrix.
+    # The pass with the Jacobian costs about three force evaluations (half of the six of central differences, but not the one or two of a plain pass) and keeps the whole bundle in memory: integrate_streaming can't compute it
+    def integrate(self, rsteps, thsteps, jacobian=False):
+        self._select_bundle((rsteps, thsteps))
+        rrange, wr, thrange, wth = self._quadrature(rsteps, thsteps)
+        
         # Create the values on which the function will be evaluated
         rs,ths = np.meshgrid(rrange, thrange)
         rs = rs.flatten()
         ths = ths.flatten()
         
-        dr = self._Rl/(rsteps-1)
-        dth = 2*np.pi/(thsteps-1)
+        # The weight of every ray (in the same order as the rays)
+        w = np.outer(wth, wr).flatten()
+        
+        if jacobian:
+            forces, J = self._total_ray_force(rs, ths, w)
+            
+            return self._weighted_sum(w, forces), J
         
         forces = self._total_ray_force(rs, ths)
-        Ft = dr*dth*np.sum(forces, axis=0)
+        Ft = self._weighted_sum(w, forces)
         
         return Ft
     
+    # Same as integrate, but the rays are generated lazily and integrated in blocks so that the memory used never exceeds (approximately) max_bytes. The partial sums of the blocks are accumulated with compensated summation so that the precision doesn't degrade with the number of blocks.
+    # Note that the rays can't be cached between calls in this case, so if the whole bundle fits in max_bytes, the usual (cached) integration is used instead
+    def integrate_streaming(self, rsteps, thsteps, max_bytes):
+        n_rays = rsteps*thsteps
+        if n_rays*bytes_per_ray <= max_bytes:
+            return self.integrate(rsteps, thsteps)
+        
+        rrange, wr, thrange, wth = self._quadrature(rsteps, thsteps)
+        
+        # Number of rays in each block (at least one, otherwise we would never finish)
+        block = max(1, int(max_bytes // bytes_per_ray))
+        
+        Ft = np.zeros(3)
+        comp = np.zeros(3)
+        
+        for start in range(0, n_rays, block):
+            # Indices of the rays of this block in the flattened (th, r) grid, which is the same order as in integrate
+            idx = np.arange(start, min(start + block, n_rays))
+            ir = idx % rsteps
+            ith = idx // rsteps
+            
+            # The rays of the previous block are not valid anymore
+            self._rays_updated = False
+            forces = self._total_ray_force(rrange[ir], thrange[ith])
+            
+            Ft, comp = compensated_add(Ft, comp, self._weighted_sum(wth[ith]*wr[ir], forces))
+        
+        # Make sure that the rays of the last block are not mistaken for the full bundle later
+        self._rays_updated = False
+        
+        return Ft + comp
+    
 # A system where the intensity on the lens and polarization (spatial) are arbitrary and all the rays are focused into a single spot
 class OpticalSystemSimpleArbitrary(OpticalSystemSimple):
     # Ifun is the intensity function that takes the (r, th) coordinates on the lens, the radius of lens and a number of optional keyword parameters. Note that this function must be normalized, i.e. its integral over all the lens must be equal to 1. Otherwise, incorrect results for the force will be calculated.
     # pfun is the intensity function that takes the (r, th) coordinates on the lens, the radius of lens and a number of optional keyword parameters.
     def __init__(self, c, Rp, nr, Rl, f, Ipfun, **Ikw):
-        self._Ipfun = Ipfun
-        self._Ikw = Ikw
+        self.set_beam(Ipfun, **Ikw)
         
         # We set the polarization of the underlying class to an arbitrary vector since it's going to be recalculated after anyway
         super().__init__(c, Rp, nr, Rl, f, np.array([1,0,0]))
-                
-    # Returns the total force by single rays (multiplied by r for polar integration)
-    def _total_ray_force(self, r, th):
-        n_rays = len(r)
         
+    # Changes the intensity/polarization function (and its arguments). The rays themselves (origins and directions) don't depend on it, so they are kept.
+    # The function may return several beams at once (an (..., n_rays, 4) array, e.g. the profiles of beam_profiles.py with array parameters). Then, the integrals return the force of every beam (e.g. a (K,3) array for K beams), and the geometry of the rays is calculated only once for all of them. This needs the "components" ray layout
+    def set_beam(self, Ipfun, **Ikw):
+        self._Ipfun = Ipfun
+        self._Ikw = Ikw
+        
+        # Flag to indicate that the intensity and polarization of the rays are up-to-date
+        self._beam_updated = False
+                
+    # Generates the rays, and the polarization vectors and intensity for each ray (if this has not been done before)
+    def _update_rays(self, r, th):
         if not self._rays_updated:
             self._gen_rays(r, th)
-            
-            # Generate the polarization vectors and intensity for each ray (if this has not been done before)
-            int_pol = self._Ipfun(r, th, self._Rl, **self._Ikw)
-            self._p = int_pol[:,1:]
-            self._I = int_pol[:,0]
+            self._beam_updated = False
             
             # Let know that the rays have been updated 
             self._rays_updated = True
         
-        F = self._ray_force(self._p)
+        if not self._beam_updated:
+            int_pol = self._Ipfun(r, th, self._Rl, **self._Ikw)
+            self._p = int_pol[...,1:]
+            self._I = int_pol[...,0]
+            
+            if self._ray_layout == "components":
+                self._p = np.ascontiguousarray(np.moveaxis(self._p, -1, 0))
+            elif int_pol.ndim > 2:
+                raise ValueError("Several beams at once need the components ray layout")
+            
+            self._beam_updated = True
+    
+    # Returns the total force by single rays (multiplied by r for polar integration)
+    # If weights (of the integration, one per ray) are given, also returns the weighted sum of the derivatives of the forces with respect to the particle center (see OpticalSystem._ray_force)
+    def _total_ray_force(self, r, th, weights=None):
+        self._update_rays(r, th)
+        
+        if weights is not None:
+            F, J = self._ray_force(self._p, weights*r*np.real(self._I))
+        else:
+            F = self._ray_force(self._p)
     
         # The factor in parentheses is to have unit power and allow polar integration (that's why we multiply by r)
-        return (r*self._I).reshape(-1,1)*F
\ No newline at end of file
+        if self._ray_layout == "components":
+            F = (r*self._I)*F
+        else:
+            F = (r*self._I).reshape(-1,1)*F
+        
+        if weights is not None:
+            return F, J
+        
+        return F
+    
+    # Integrates all the rays (like integrate) for many particle positions at once. Every row of cs is a position relative to the focal spot (like in set_particle_center). Returns the forces as an (M,3) array (and, if jacobian is True, their derivatives with respect to the positions as an (M,3,3) array, see integrate; a batch then holds half as many positions). With several beams (see set_beam), the forces of every beam are returned for every position, e.g. as an (M,K,3) array for K beams.
+    # The ray bundle is generated only once and the positions are evaluated in batches (as a single, bigger, bundle each) of as many positions as fit in max_bytes (all at once if max_bytes is None)
+    def integrate_positions(self, cs, rsteps, thsteps, max_bytes=None, jacobian=False):
+        cs = np.asarray(cs, dtype=float).reshape(-1, 3)
+        
+        self._select_bundle((rsteps, thsteps))
+        rrange, wr, thrange, wth = self._quadrature(rsteps, thsteps)
+        
+        rs,ths = np.meshgrid(rrange, thrange)
+        rs = rs.flatten()
+        ths = ths.flatten()
+        n_rays = len(rs)
+        
+        self._update_rays(rs, ths)
+        
+        # The weight of every ray, including the intensity and the r factor of polar integration (one row per beam if there are several)
+        w = np.outer(wth, wr).flatten()*rs*np.real(self._I)
+        beams = self._I.shape[:-1]
+        
+        if max_bytes is None:
+            batch = len(cs)
+        else:
+            # The derivatives take about as much memory again
+            batch = max(1, int(max_bytes // ((2 if jacobian else 1)*bytes_per_ray*n_rays*int(np.prod(beams)))))
+        
+        if self._ray_layout == "components" or jacobian:
+            # The bundle is broadcast against the centers of the batch (the components are indexed by (position, ray)), so it doesn't have to be repeated
+            if self._ray_layout == "components":
+                o, l, p = self._o, self._l, self._p
+            else:
+                o, l, p = self._o.transpose(), self._l.transpose(), self._p.transpose()
+            
+            # The dimensions are (component, beams..., position, ray)
+            p = p[...,None,:]
+            o = _expand(o[:,None,:], p.ndim)
+            l = _expand(l[:,None,:], p.ndim)
+            w = w[...,None,:]
+            Ft = np.zeros((len(cs),) + beams + (3,))
+            Jt = np.zeros((len(cs),) + beams + (3, 3))
+            
+            for start in range(0, len(cs), batch):
+                centers = _expand(cs[start:start + batch].transpose()[:,:,None], p.ndim) + np.array([0, 0, self._f]).reshape((3,) + (1,)*(p.ndim - 1))
+                k = centers.shape[-2]
+                
+                if jacobian:
+                    F, J = self._ray_force_components(o, l, centers, p, w)
+                    Jt[start:start + k] = np.moveaxis(J, -3, 0)
+                else:
+                    F = self._ray_force_components(o, l, centers, p)
+                
+                Ft[start:start + k] = np.moveaxis(np.einsum('j...n,...n->...j', np.real(F), w), -2, 0)
+            
+            if jacobian:
+                return Ft, Jt
+            
+            return Ft
+        
+        # The bundle of a batch is the bundle of a single position repeated for every position of the batch, so the original one has to be restored afterwards
+        o, l, c = self._o, self._l, self._c
+        Ft = np.zeros((len(cs), 3))
+        
+        try:
+            for start in range(0, len(cs), batch):
+                centers = cs[start:start + batch] + np.array([0, 0, self._f])
+                k = len(centers)
+                
+                self._o = np.tile(o, (k, 1))
+                self._l = np.tile(l, (k, 1))
+                self._c = np.repeat(centers, n_rays, axis=0)
+                
+                F = self._ray_force(np.tile(self._p, (k, 1))).reshape(k, n_rays, 3)
+                Ft[start:start + k] = np.einsum('n,knj->kj', w, np.real(F))
+        finally:
+            self._o, self._l, self._c = o, l, c
+        
+        return Ft
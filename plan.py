@@ -0,0 +1,216 @@
+# Cost model of a sweep: estimates how long a configuration will take and how much memory it will need before running it (python3 run.py --plan).
+# The runtime is extrapolated from a short calibration on this machine (rays per second of the configured engine), and the memory from the (conservative) memory per ray of the force calculation (optical_system.bytes_per_ray).
+import os
+import time
+
+import numpy as np
+
+import optical_system as osys
+import sweep
+
+# Memory used by every process before doing anything (the interpreter, NumPy and SciPy)
+process_overhead = 80*2**20
+
+# Bytes per position kept for the whole sweep (positions, forces and the output array)
+bytes_per_position = 3*8*4
+
+# Number of rays above which the calibration is done with a smaller bundle (and extrapolated linearly)
+max_calibration_rays = 250000
+
+# Returns the total and the available memory of the machine in bytes (None if they can't be found)
+def machine_memory():
+    try:
+        info = {}
+        with open("/proc/meminfo") as f:
+            for line in f:
+                name, value = line.split(":")
+                info[name] = int(value.split()[0])*1024
+
+        return info["MemTotal"], info.get("MemAvailable", info["MemFree"])
+    except (OSError, KeyError, ValueError):
+        pass
+
+    try:
+        total = os.sysconf("SC_PAGE_SIZE")*os.sysconf("SC_PHYS_PAGES")
+        return total, total
+    except (AttributeError, ValueError, OSError):
+        return None, None
+
+# Number of CPUs this process can use
+def machine_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+# Number of positions that the sweep will evaluate. For adaptive sweeps, returns the minimum and the maximum (if every cell is subdivided all the way down)
+def position_count(cfg):
+    xs, ys, zs = sweep.grid_axes(cfg)
+
+    if not cfg.adaptive:
+        n = len(xs)*len(ys)*len(zs)
+        return n, n
+
+    # At least the coarse lattice and the points that check its cells are evaluated
+    d = sum(1 for n in (len(xs), len(ys), len(zs)) if n > 1)
+    lo = ((2 if cfg.adaptive_depth > 0 else 1)*cfg.adaptive_coarse + 1)**d
+    hi = (cfg.adaptive_coarse*2**cfg.adaptive_depth + 1)**d
+
+    return lo, hi
+
+# Estimates the peak memory (in bytes) of a sweep of n_positions positions with n_rays rays each, for the given engine ("streaming" is the serial engine with a memory budget smaller than the ray bundle)
+def peak_memory(engine, n_rays, n_positions, memory_budget, workers):
+    bundle = n_rays*osys.bytes_per_ray
+    base = process_overhead + n_positions*bytes_per_position
+    budget = sweep.default_memory_budget if memory_budget is None else memory_budget
+
+    if engine == "serial":
+        return base + bundle
+    elif engine == "streaming":
+        # Blocks of rays (of at least one ray)
+        return base + min(bundle, max(budget, osys.bytes_per_ray))
+
+    # A batch has at least one position, even if it doesn't fit in the budget
+    batch = min(n_positions, max(1, budget // max(bundle, 1)))
+
+    if engine == "batched":
+        return base + batch*bundle
+    elif engine == "parallel":
+        # Every process gets an interleaved share of the positions
+        batch = min(batch, -(-n_positions // workers))
+        return base + workers*(process_overhead + batch*bundle)
+    else:
+        raise ValueError("Unknown engine: {0}".format(engine))
+
+# The name of the engine (as used by peak_memory) that the configuration selects
+def selected_engine(cfg):
+    if cfg.engine == "serial" and cfg.memory_budget is not None and cfg.rsteps*cfg.thsteps*osys.bytes_per_ray > cfg.memory_budget:
+        return "streaming"
+
+    return cfg.engine
+
+# The configuration used to calibrate cfg. Very big bundles are calibrated with fewer rays, and the memory budget is scaled by the same factor, so that the engine splits the bundle (streaming) or the positions (batched) the same way it will do in the sweep.
+# The parallel engine is calibrated with a single process (see make_plan)
+def calibration_config(cfg):
+    rays = cfg.rsteps*cfg.thsteps
+
+    if rays > max_calibration_rays:
+        scale = np.sqrt(max_calibration_rays/rays)
+        cfg = sweep.configure(cfg, rsteps=max(2, int(cfg.rsteps*scale)), thsteps=max(2, int(cfg.thsteps*scale)))
+
+        if cfg.memory_budget is not None:
+            cfg = sweep.configure(cfg, memory_budget=max(1, int(cfg.memory_budget*cfg.rsteps*cfg.thsteps/rays)))
+
+    if cfg.engine == "parallel":
+        cfg = sweep.configure(cfg, engine="batched")
+
+    return cfg
+
+# Measures the speed (rays per second) of the configured engine on this machine, with a few positions near the focus
+def calibrate(cfg, positions=8, min_time=0.5):
+    cfg = calibration_config(cfg)
+    rays = cfg.rsteps*cfg.thsteps
+
+    opt = sweep.make_system(cfg)
+    pos = cfg.radius*np.array([[0.1*i, 0, 0.5 - 0.1*i] for i in range(positions)])
+
+    # The first evaluation also generates the rays
+    sweep.compute_forces(opt, pos[:1], cfg)
+
+    done = 0
+    t0 = time.perf_counter()
+    while True:
+        sweep.compute_forces(opt, pos, cfg)
+        done += len(pos)
+        elapsed = time.perf_counter() - t0
+        if elapsed > min_time:
+            break
+
+    return done*rays/elapsed
+
+def _format_bytes(n):
+    for unit in ("B", "kB", "MB", "GB", "TB"):
+        if n < 1024 or unit == "TB":
+            return "{0:.1f} {1}".format(n, unit)
+        n /= 1024
+
+def _format_time(s):
+    if s < 120:
+        return "{0:.1f} s".format(s)
+    if s < 7200:
+        return "{0:.1f} min".format(s/60)
+    if s < 172800:
+        return "{0:.1f} h".format(s/3600)
+    return "{0:.1f} days".format(s/86400)
+
+# Makes the plan of a sweep. Returns a dict with the estimates and suggestions
+def make_plan(cfg, calibration=True):
+    total_mem, available = machine_memory()
+    cpus = machine_cpus()
+    workers = min(sweep.worker_count(cfg), cpus) if cfg.engine == "parallel" else 1
+
+    n_rays = cfg.rsteps*cfg.thsteps
+    pos_lo, pos_hi = position_count(cfg)
+
+    plan = {
+        "engine": selected_engine(cfg),
+        "positions": (pos_lo, pos_hi),
+        "rays": n_rays,
+        "cpus": cpus,
+        "workers": workers,
+        "memory_total": total_mem,
+        "memory_available": available,
+        "peak_memory": {e: peak_memory(e, n_rays, pos_hi, cfg.memory_budget, min(sweep.worker_count(cfg), cpus)) for e in ("serial", "streaming", "batched", "parallel")},
+    }
+
+    # The speed of the parallel engine is the one of a single process times the number of processes: perfect scaling, so it's an upper bound (and the runtime a lower bound)
+    if calibration:
+        rate = calibrate(cfg)*workers
+        plan["rays_per_second"] = rate
+        plan["linear_scaling"] = workers > 1
+        plan["runtime"] = (pos_lo*n_rays/rate, pos_hi*n_rays/rate)
+
+    # Suggestions: the number of processes whose bundles fit in the available memory (leaving a margin), and the memory budget of each of them (enough for its share of the positions, but at most what's left for it)
+    if available is not None:
+        usable = 0.8*available - pos_hi*bytes_per_position
+        bundle = n_rays*osys.bytes_per_ray
+
+        suggested = int(max(1, min(cpus, usable // (process_overhead + bundle))))
+        share = -(-pos_hi // suggested)
+        per_worker = max(usable/suggested - process_overhead, osys.bytes_per_ray)
+
+        plan["suggested_workers"] = suggested
+        plan["suggested_memory_budget"] = int(min(per_worker, share*bundle))
+        plan["suggested_batch"] = int(max(1, plan["suggested_memory_budget"] // bundle))
+
+    return plan
+
+# Prints a plan in a human-readable form
+def print_plan(plan):
+    lo, hi = plan["positions"]
+    print("Positions:           {0}".format(lo if lo == hi else "{0} to {1} (adaptive)".format(lo, hi)))
+    print("Rays per position:   {0}".format(plan["rays"]))
+    print("Ray evaluations:     {0:.3g}".format(hi*plan["rays"]))
+    print("Engine:              {0} ({1} process{2})".format(plan["engine"], plan["workers"], "es" if plan["workers"] > 1 else ""))
+
+    if "runtime" in plan:
+        t_lo, t_hi = plan["runtime"]
+        bound = plan.get("linear_scaling", False)
+        print("Speed:               {0:.3g} rays/s{1}".format(plan["rays_per_second"], " (at most: one process times {0})".format(plan["workers"]) if bound else ""))
+        print("Estimated runtime:   {0}{1}".format(_format_time(t_hi) if lo == hi else "{0} to {1}".format(_format_time(t_lo), _format_time(t_hi)), " (at least)" if bound else ""))
+
+    print("Machine:             {0} CPUs, {1} available of {2}".format(plan["cpus"],
+          _format_bytes(plan["memory_available"]) if plan["memory_available"] else "?",
+          _format_bytes(plan["memory_total"]) if plan["memory_total"] else "?"))
+
+    print("Estimated peak memory:")
+    for engine, mem in plan["peak_memory"].items():
+        warning = ""
+        if plan["memory_available"] is not None and mem > plan["memory_available"]:
+            warning = "  (does NOT fit)"
+        print("  {0:<10} {1}{2}{3}".format(engine, _format_bytes(mem), "  <- selected" if engine == plan["engine"] else "", warning))
+
+    if "suggested_workers" in plan:
+        print("Suggestions:         workers = {0}, memory_budget = {1} ({2}, i.e. {3} position{4} per batch)".format(
+              plan["suggested_workers"], plan["suggested_memory_budget"], _format_bytes(plan["suggested_memory_budget"]),
+              plan["suggested_batch"], "s" if plan["suggested_batch"] > 1 else ""))
@@ -1,71 +1,157 @@
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.pyplot import cm
-
-import scipy.interpolate as interpol
-
-values = np.loadtxt("2d-na068-linear-a1.tsv")
-
-# Coordinates
-xx = values[:,0].flatten()
-zz = values[:,2].flatten()
-
-# Forces
-ux = values[:,3].flatten()
-uz = values[:,5].flatten()
-
-# Add the counter-propagating beams
-
-# Add the negative x coordinates (for a symmetric plot)
-xx = np.hstack([xx, -xx])
-zz = np.hstack([zz, zz])
-
-ux = np.hstack([ux, -ux])
-uz = np.hstack([uz, uz])
-
-#norms = np.sqrt(uz**2 + ux**2)
-
-#ux = 15*ux/norms
-#uz = 15*uz/norms
+# Plots a 2D slice of a force map as streamlines (or arrows).
+# Usage: python3 plot2d.py results.tsv --plane zx --mirror --out 2d.png
+# Results on a regular grid (which is what run.py produces) are reshaped directly and resampled with splines for plotting. Only scattered results (e.g. the positions computed by an adaptive sweep) need a triangulation.
+import argparse
 
-### Only take every nth row
-#n = 4
-
-#plt.quiver(zz[::n], xx[::n], uz[::n], ux[::n], norms[::n], cmap=cm.seismic, scale=400)
-#plt.colorbar()
-#plt.show()
-
-#coords = np.vstack([zz,xx]).transpose()
-#vals = np.vstack([uz,ux]).transpose()
-
-zi = np.linspace(zz.min(), zz.max(), 100)
-xi = np.linspace(xx.min(), xx.max(), 100)
-
-ipts_z, ipts_x = np.meshgrid(zi, xi)
-
-ux_int = interpol.griddata((zz, xx), ux, (ipts_z, ipts_x), method='cubic').reshape(len(xi), len(zi))
-uz_int = interpol.griddata((zz, xx), uz, (ipts_z, ipts_x), method='cubic').reshape(len(xi), len(zi))
-
-# Enable counter-propagating setup
-#uz_int = 0.5*(uz_int - uz_int[:,::-1])
-
-speed = np.sqrt(ux_int**2 + uz_int**2)
-lw = 5*speed/speed.max()
-
-fig = plt.figure(figsize=(7*(4/3), 7))
-plt.streamplot(ipts_z, ipts_x, uz_int, ux_int,          # data
-               color=speed,         # array that determines the colour
-               cmap=cm.cool,        # colour map
-               linewidth=lw,         # line thickness
-               arrowstyle='->',     # arrow style
-               arrowsize=1.5)       # arrow size
-
-#plt.colorbar()                      # add colour bar on the right
+import numpy as np
 
-plt.title('Fuerzas en pinzas unipropagantes')
-plt.xlabel("Z")
-plt.ylabel("X")
-plt.xlim([zi.min(), zi.max()])
-plt.ylim([xi.min(), xi.max()])
-plt.savefig("2d-solo.png", bbox_inches="tight", transparent=True)
-plt.show()
\ No newline at end of file
+import results
+
+axis_names = "xyz"
+
+# Extracts the plane (h, v) of the grid at the value of the remaining coordinate closest to `at` (or the first one if `at` is None). Returns the values of the h and v coordinates and the h and v components of the force as (nh, nv) arrays
+def grid_slice(xs, ys, zs, grid, h, v, at=None):
+    axes = [xs, ys, zs]
+    w = 3 - h - v
+
+    k = 0 if at is None else np.argmin(np.abs(axes[w] - at))
+    plane = np.take(grid, k, axis=w)
+
+    # After removing the fixed coordinate, the remaining ones keep their order
+    if h > v:
+        plane = plane.transpose(1, 0, 2)
+
+    return axes[h], axes[v], plane[...,h], plane[...,v]
+
+# Same as grid_slice, but for scattered positions (the force is triangulated and linearly interpolated into a grid of n x n points)
+def scattered_slice(positions, forces, h, v, at=None, n=100):
+    import scipy.interpolate as interpol
+
+    w = 3 - h - v
+    values = np.unique(positions[:,w])
+    k = values[0] if at is None else values[np.argmin(np.abs(values - at))]
+    sel = positions[:,w] == k
+
+    hs = np.linspace(positions[sel,h].min(), positions[sel,h].max(), n)
+    vs = np.linspace(positions[sel,v].min(), positions[sel,v].max(), n)
+    hh, vv = np.meshgrid(hs, vs, indexing='ij')
+
+    pts = (positions[sel,h], positions[sel,v])
+    fh = interpol.griddata(pts, forces[sel,h], (hh, vv), method='linear')
+    fv = interpol.griddata(pts, forces[sel,v], (hh, vv), method='linear')
+
+    return hs, vs, fh, fv
+
+# Adds the mirror image of the plane with respect to v = 0 (for a symmetric plot when only v >= 0 was computed). The v component of the force changes its sign. Raises ValueError if some v < 0 (the image would overlap the plane)
+def mirror(hs, vs, fh, fv):
+    if vs.min() < 0:
+        raise ValueError("can't mirror results with negative values of the vertical coordinate")
+
+    keep = vs > 0
+
+    vs = np.concatenate([-vs[keep][::-1], vs])
+    fh = np.concatenate([fh[:,keep][:,::-1], fh], axis=1)
+    fv = np.concatenate([-fv[:,keep][:,::-1], fv], axis=1)
+
+    return hs, vs, fh, fv
+
+# Resamples the plane into an evenly-spaced grid with at most n points along each coordinate (more points can't be seen anyway and just slow down plotting)
+def resample(hs, vs, fh, fv, n):
+    import scipy.interpolate as interpol
+
+    hi = np.linspace(hs.min(), hs.max(), min(n, len(hs)))
+    vi = np.linspace(vs.min(), vs.max(), min(n, len(vs)))
+
+    out = []
+    for F in (fh, fv):
+        # Cubic splines, unless there are too few points for them
+        spline = interpol.RectBivariateSpline(hs, vs, F, kx=min(3, len(hs) - 1), ky=min(3, len(vs) - 1))
+        out.append(spline(hi, vi))
+
+    return hi, vi, out[0], out[1]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plots a 2D slice of a force map")
+    parser.add_argument("file", help="result file (TSV or structured .npz)")
+    parser.add_argument("--plane", default="zx", help="horizontal and vertical coordinates of the plot (default: zx)")
+    parser.add_argument("--at", type=float, default=None, help="value of the remaining coordinate (the closest one is used; default: the first one)")
+    parser.add_argument("--mirror", action="store_true", help="add the mirror image with respect to the horizontal axis")
+    parser.add_argument("--style", choices=["stream", "quiver"], default="stream", help="streamlines or arrows")
+    parser.add_argument("--resolution", type=int, default=100, help="maximum number of points along each coordinate of the plot")
+    parser.add_argument("--title", default="")
+    parser.add_argument("--out", default=None, help="image file to save the plot into")
+    parser.add_argument("--show", action="store_true", help="show the plot in a window")
+    args = parser.parse_args(argv)
+
+    if len(args.plane) != 2 or args.plane[0] == args.plane[1] or not set(args.plane) <= set(axis_names):
+        parser.error("invalid plane: {0}".format(args.plane))
+
+    h = axis_names.index(args.plane[0])
+    v = axis_names.index(args.plane[1])
+
+    try:
+        grid = results.load_grid(args.file)
+    except ValueError:
+        # Not a regular grid
+        grid = None
+
+    if grid is not None:
+        hs, vs, fh, fv = grid_slice(*grid, h, v, args.at)
+        if len(hs) < 2 or len(vs) < 2:
+            parser.error("the results don't vary along the plane {0}".format(args.plane))
+        if args.mirror:
+            try:
+                hs, vs, fh, fv = mirror(hs, vs, fh, fv)
+            except ValueError as e:
+                parser.error(str(e))
+        hs, vs, fh, fv = resample(hs, vs, fh, fv, args.resolution)
+    else:
+        positions, forces = results.load_scattered(args.file)
+        hs, vs, fh, fv = scattered_slice(positions, forces, h, v, args.at, args.resolution)
+        if args.mirror:
+            try:
+                hs, vs, fh, fv = mirror(hs, vs, fh, fv)
+            except ValueError as e:
+                parser.error(str(e))
+
+    import matplotlib
+    if not args.show:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.pyplot import cm
+
+    # The plotting functions want the vertical coordinate first
+    fh = fh.transpose()
+    fv = fv.transpose()
+
+    speed = np.sqrt(fh**2 + fv**2)
+
+    plt.figure(figsize=(7*(4/3), 7))
+
+    if args.style == "stream":
+        plt.streamplot(hs, vs, fh, fv,
+                       color=speed,                                 # array that determines the colour
+                       cmap=cm.cool,                                # colour map
+                       linewidth=5*speed/np.nanmax(speed),          # line thickness
+                       arrowstyle='->',                             # arrow style
+                       arrowsize=1.5)                               # arrow size
+    else:
+        # At most ~30 arrows along each coordinate
+        sh = max(1, len(hs)//30)
+        sv = max(1, len(vs)//30)
+        plt.quiver(hs[::sh], vs[::sv], fh[::sv,::sh], fv[::sv,::sh], speed[::sv,::sh], cmap=cm.cool)
+        plt.colorbar()
+
+    plt.title(args.title)
+    plt.xlabel(args.plane[0].upper())
+    plt.ylabel(args.plane[1].upper())
+    plt.xlim([hs.min(), hs.max()])
+    plt.ylim([vs.min(), vs.max()])
+
+    if args.out is not None:
+        plt.savefig(args.out, bbox_inches="tight", transparent=True)
+    if args.show:
+        plt.show()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# Progress telemetry and graceful cancellation of long sweeps.
+# ProgressReporter prints a line every few seconds with the number of positions done, the throughput (positions and rays per second), the estimated time left and the memory used, and optionally appends the same records to a JSON-lines metrics file (one JSON object per line, see ProgressReporter.record for the fields).
+# GracefulStop catches SIGINT (Ctrl-C) and SIGTERM: the sweep finishes the chunk of positions it is evaluating, saves what it has, and exits. A second signal stops immediately.
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+# Returns the current and the peak memory (resident set size) of this process in bytes (None if they can't be found)
+def memory_usage():
+    current = None
+    peak = None
+
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        import resource
+        # Kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*(1 if sys.platform == "darwin" else 1024)
+    except (ImportError, OSError):
+        pass
+
+    return current, peak
+
+class ProgressReporter(object):
+    # total is the number of positions to evaluate (None if it's not known beforehand, as in adaptive sweeps) and rays the number of rays per position. A record is emitted at most every `interval` seconds (never if it's None) to the stream and to metrics_file (if given)
+    def __init__(self, total, rays, interval=10.0, metrics_file=None, stream=sys.stderr):
+        self._total = total
+        self._rays = rays
+        self._interval = interval
+        self._stream = stream
+        self._metrics = open(metrics_file, "a") if metrics_file is not None else None
+
+        self._start = time.perf_counter()
+        self._last = self._start
+
+        self.done = 0
+
+    # Returns a record of the current progress
+    def record(self, event="progress"):
+        elapsed = time.perf_counter() - self._start
+        rate = self.done/elapsed if elapsed > 0 else 0.0
+        current, peak = memory_usage()
+
+        eta = None
+        if self._total is not None and rate > 0:
+            eta = (self._total - self.done)/rate
+
+        return {"event": event, "time": time.time(), "elapsed": elapsed, "done": self.done, "total": self._total,
+                "positions_per_second": rate, "rays_per_second": rate*self._rays, "eta": eta,
+                "memory": current, "peak_memory": peak}
+
+    # Prints and saves a record
+    def emit(self, event="progress"):
+        r = self.record(event)
+        self._last = time.perf_counter()
+
+        if self._stream is not None:
+            total = "" if r["total"] is None else "/{0} ({1:.1f}%)".format(r["total"], 100*r["done"]/max(r["total"], 1))
+            eta = "" if r["eta"] is None else ", ETA {0:.0f} s".format(r["eta"])
+            memory = "" if r["memory"] is None else ", {0:.0f} MB".format(r["memory"]/2**20)
+
+            self._stream.write("[{0}] {1}{2} positions, {3:.3g} positions/s, {4:.3g} rays/s{5}{6}\n".format(
+                               event, r["done"], total, r["positions_per_second"], r["rays_per_second"], eta, memory))
+            self._stream.flush()
+
+        if self._metrics is not None:
+            self._metrics.write(json.dumps(r) + "\n")
+            self._metrics.flush()
+
+        return r
+
+    # Counts n more evaluated positions, and emits a record if it's time to
+    def update(self, n):
+        self.done += n
+
+        if self._interval is not None and time.perf_counter() - self._last >= self._interval:
+            self.emit()
+
+    # Emits the final record ("finished" or "interrupted") and closes the metrics file
+    def close(self, event="finished"):
+        self.emit(event)
+
+        if self._metrics is not None:
+            self._metrics.close()
+            self._metrics = None
+
+# Raised by the evaluation of an adaptive sweep when it's stopped, with the positions that were evaluated before stopping and the forces on them
+class Interrupted(Exception):
+    def __init__(self, positions, forces):
+        super().__init__("interrupted after {0} positions".format(len(positions)))
+        self.positions = positions
+        self.forces = forces
+
+# Context manager that turns SIGINT and SIGTERM into a request to stop (the `requested` attribute holds the number of the signal, or None). The previous handlers are restored on exit.
+# Signal handlers can only be installed by the main thread: in other threads, nothing is installed and the sweep can't be stopped with signals
+class GracefulStop(object):
+    signals = (signal.SIGINT, signal.SIGTERM)
+
+    def __init__(self):
+        self.requested = None
+        self._previous = {}
+
+    def _handler(self, signum, frame):
+        if self.requested is not None:
+            # Second signal: give up on stopping gracefully
+            raise KeyboardInterrupt
+
+        self.requested = signum
+        sys.stderr.write("Stopping after the current chunk of positions (send the signal again to stop immediately)\n")
+
+    def __enter__(self):
+        if threading.current_thread() is threading.main_thread():
+            for s in self.signals:
+                self._previous[s] = signal.signal(s, self._handler)
+
+        return self
+
+    def __exit__(self, *exc):
+        for s, handler in self._previous.items():
+            signal.signal(s, handler)
+        self._previous = {}
+
+        return False
@@ -0,0 +1,75 @@
+# Progressive sweeps: the grid is first evaluated on a coarse subgrid (every few positions along each coordinate) with few rays, and then the subgrid and the number of rays are refined pass after pass until the full grid is evaluated with the full number of rays. The results of every pass are published (e.g. written into the result file, which plot2d.py can load at any time), so the shape of the force map can be seen within seconds.
+# The positions evaluated by a pass are reused by the next ones if they were evaluated with the same number of rays. The number of rays reaches the full one a pass before the positions do, so the last pass (which is the most expensive one) reuses the positions of the previous one.
+import numpy as np
+
+# The smallest number of steps (in r and in theta) used for the coarse passes
+min_steps = 8
+
+# Returns the settings of every pass, from the coarsest to the full one, as a list of (stride, rsteps, thsteps). The stride is the number of grid positions between the positions of the subgrid, and it's halved on every pass. The number of steps is halved too (i.e. the number of rays is divided by 4), except for the last two passes, which use the full number of rays
+def schedule(passes, rsteps, thsteps):
+    out = []
+
+    for i in range(passes):
+        stride = 2**(passes - 1 - i)
+        factor = 2**max(0, passes - 2 - i)
+
+        out.append((stride, min(rsteps, max(min_steps, rsteps//factor)), min(thsteps, max(min_steps, thsteps//factor))))
+
+    return out
+
+# The indices of the subgrid with the given stride on an axis of n points (the last point is always included, so that every subgrid spans the whole grid)
+def subgrid_indices(n, stride):
+    return np.unique(np.append(np.arange(0, n, stride), n - 1))
+
+class ProgressiveSweep(object):
+    # The sweep evaluates the grid given by the values xs, ys and zs of every coordinate in the given number of passes (see schedule)
+    def __init__(self, xs, ys, zs, passes, rsteps, thsteps):
+        if passes < 1:
+            raise ValueError("Invalid number of passes: {0}".format(passes))
+
+        self._axes = [np.atleast_1d(xs), np.atleast_1d(ys), np.atleast_1d(zs)]
+        self._schedule = schedule(passes, rsteps, thsteps)
+
+        shape = tuple(len(ax) for ax in self._axes)
+
+        # The forces on the positions of the grid as a (nx, ny, nz, 3) array, and the number of rays used for evaluating them (0 if they haven't been evaluated)
+        self._forces = np.full(shape + (3,), np.nan)
+        self._rays = np.zeros(shape, dtype=int)
+
+        # Number of positions evaluated so far
+        self.evaluations = 0
+
+    # Runs the sweep. force_fun takes an (M,3) array of positions and the rsteps and thsteps to use, and returns the (M,3) array of forces and the number of positions that were actually evaluated (the first ones; fewer than M if the sweep has to stop).
+    # After every pass, publish (if given) is called with the number of the pass, its settings (stride, rsteps, thsteps) and the subgrid (the values of each coordinate and the forces as a (nx, ny, nz, 3) array).
+    # Returns whether all the passes were completed
+    def run(self, force_fun, publish=None):
+        for n, (stride, rsteps, thsteps) in enumerate(self._schedule):
+            idx = [subgrid_indices(len(ax), stride) for ax in self._axes]
+            sub = np.ix_(*idx)
+
+            # Only the positions that haven't been evaluated with this number of rays
+            need = self._rays[sub] < rsteps*thsteps
+            ii = np.meshgrid(*idx, indexing='ij')
+            where = tuple(i[need] for i in ii)
+
+            positions = np.column_stack([ax[i] for ax, i in zip(self._axes, where)])
+
+            if len(positions) > 0:
+                forces, done = force_fun(positions, rsteps, thsteps)
+
+                finished = tuple(i[:done] for i in where)
+                self._forces[finished] = forces[:done]
+                self._rays[finished] = rsteps*thsteps
+                self.evaluations += done
+
+                if done < len(positions):
+                    return False
+
+            if publish is not None:
+                publish(n, (stride, rsteps, thsteps), self._axes[0][idx[0]], self._axes[1][idx[1]], self._axes[2][idx[2]], self._forces[sub])
+
+        return True
+
+    # The forces on the full grid as a (nx, ny, nz, 3) array (NaN on the positions that haven't been evaluated)
+    def grid(self):
+        return self._forces
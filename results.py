@@ -0,0 +1,93 @@
+# Reading and writing of result files.
+# Results are saved either as TSV (the first three columns are the coordinates of the particle and the next three are the force acting on the particle in this position) or, if the file name ends with ".npz", as a structured NumPy file that keeps the grid (the values of each coordinate, in increasing order, and the forces as a (nx, ny, nz, 3) array), which is a lot faster to load.
+import os
+
+import numpy as np
+
+# Whether a result file is structured (as opposed to TSV)
+def is_structured(filename):
+    return filename.endswith(".npz")
+
+# Sorts the values of every coordinate of a grid (e.g. of a sweep whose start is bigger than its stop) in increasing order, reordering the forces (a (nx, ny, nz, 3) array) to match. Returns the sorted coordinates and forces
+def sort_grid(xs, ys, zs, grid):
+    axes = [xs, ys, zs]
+    for i, ax in enumerate(axes):
+        if np.any(np.diff(ax) < 0):
+            order = np.argsort(ax, kind='stable')
+            axes[i] = ax[order]
+            grid = np.take(grid, order, axis=i)
+
+    return axes[0], axes[1], axes[2], grid
+
+# Saves the forces calculated on the grid given by xs, ys and zs. The forces are given either in the order of sweep.grid_positions (one row per position) or as a (nx, ny, nz, 3) array. Additional arrays (e.g. metadata) can be passed as keyword arguments and are only kept in structured files
+def save_grid(filename, xs, ys, zs, forces, **extra):
+    xs, ys, zs = np.atleast_1d(xs, ys, zs)
+    forces = np.asarray(forces)
+
+    if forces.ndim == 4:
+        grid = forces
+        forces = grid.transpose(1, 0, 2, 3).reshape(-1, 3)
+    else:
+        # np.meshgrid puts the Y coordinate first
+        grid = forces.reshape(len(ys), len(xs), len(zs), 3).transpose(1, 0, 2, 3)
+
+    if is_structured(filename):
+        xs, ys, zs, grid = sort_grid(xs, ys, zs, grid)
+        np.savez(filename, xs=xs, ys=ys, zs=zs, forces=grid, **extra)
+    else:
+        xx, yy, zz = np.meshgrid(xs, ys, zs)
+        positions = np.vstack([xx.flatten(), yy.flatten(), zz.flatten()]).transpose()
+        save_scattered(filename, positions, forces)
+
+# Same as save_grid, but the file is written under a temporary name first and then renamed, so that a program reading it (e.g. plot2d.py during a progressive sweep) never sees a partially-written file
+def replace_grid(filename, xs, ys, zs, forces, **extra):
+    root, ext = os.path.splitext(filename)
+    tmp = root + ".partial" + ext
+
+    save_grid(tmp, xs, ys, zs, forces, **extra)
+    os.replace(tmp, filename)
+
+# Saves positions and the forces on them (one row per position) into a TSV file
+def save_scattered(filename, positions, forces):
+    out_array = np.hstack([positions, forces])
+    np.savetxt(filename, out_array, delimiter="\t", fmt='%.6e')
+
+# Loads the positions and the forces (as two (N,3) arrays) from any result file
+def load_scattered(filename):
+    if is_structured(filename):
+        xs, ys, zs, grid = load_grid(filename)
+        xx, yy, zz = np.meshgrid(xs, ys, zs, indexing='ij')
+
+        return np.vstack([xx.flatten(), yy.flatten(), zz.flatten()]).transpose(), grid.reshape(-1, 3)
+
+    values = np.loadtxt(filename, ndmin=2)
+
+    return values[:,0:3], values[:,3:6]
+
+# Arranges scattered positions and forces into a grid. Returns the values of each coordinate and the forces as a (nx, ny, nz, 3) array.
+# Raises ValueError if the positions don't form a complete regular grid
+def to_grid(positions, forces):
+    axes = [np.unique(positions[:,i]) for i in range(3)]
+    shape = tuple(len(ax) for ax in axes)
+
+    if np.prod(shape) != len(positions):
+        raise ValueError("The positions don't form a regular grid")
+
+    idx = tuple(np.searchsorted(ax, positions[:,i]) for i, ax in enumerate(axes))
+
+    grid = np.full(shape + (3,), np.nan)
+    grid[idx] = forces
+
+    # Every point of the grid must have been set exactly once
+    if np.any(np.isnan(grid[...,0])) and not np.any(np.isnan(forces[:,0])):
+        raise ValueError("The positions don't form a regular grid")
+
+    return axes[0], axes[1], axes[2], grid
+
+# Loads a result file as a grid (see to_grid). The values of every coordinate are always in increasing order
+def load_grid(filename):
+    if is_structured(filename):
+        with np.load(filename) as data:
+            return sort_grid(data['xs'], data['ys'], data['zs'], data['forces'])
+
+    return to_grid(*load_scattered(filename))
@@ -1,76 +1,142 @@
 # This file calculates the force (adimensional factor Q) on a particle of given index, with optics of given NA in a range of x's, y's and z's.
 # The calculation is done assuming that all the rays are focused in the single spot (so that there is no explicit dependence on the radius of the particle)
-import optical_system as osys
+# With a progressive sweep (see config.py), the result file is rewritten after every pass, from a coarse preview to the full grid.
+# The progress is printed every few seconds (see the progress settings of config.py). Ctrl-C (or SIGTERM) stops the calculation after the positions being evaluated, and saves the results obtained so far (the forces on the positions that were not evaluated are NaN)
+# Many configurations can be run in a single process with jobs.py, and a sweep can be split across machines with --shard (see shards.py)
+import argparse
+import os
+import sys
+
+import adaptive
+import progress
+import progressive
+import results
+import shards
+import sweep
 import numpy as np
 
-# Import the Python configuration file
-import config
+# Runs the sweep described by the configuration cfg with the system opt (made with sweep.make_system), and saves the results into cfg.out_file. stop is a progress.GracefulStop (or None). If shard is given as (i, N), only the positions of that shard are evaluated, and they are saved into its shard file instead (see shards.py).
+# Returns whether the sweep was completed (if it was stopped, the results obtained so far are saved)
+def run(cfg, opt, stop=None, shard=None):
+    # Output file
+    out_file = cfg.out_file
+
+    # The values of each coordinate. If a coordinate is not varied (start and stop are the same), then it's fixed to that value.
+    # All the coordinates are zero when the particle is at the focus. Z decreases when the particle is closer to the lens.
+    xs, ys, zs = sweep.grid_axes(cfg)
 
-# Output file
-out_file = config.out_file
+    # Every row is a position to be calculated
+    positions = sweep.grid_positions(xs, ys, zs)
+
+    if cfg.adaptive and cfg.progressive:
+        raise ValueError("Adaptive and progressive sweeps can't be combined")
+    if shard is not None and (cfg.adaptive or cfg.progressive):
+        raise ValueError("Adaptive and progressive sweeps can't be sharded")
 
-# The radius of the particle will be taken as unity with no loss of generality.
-Rp = config.radius
-n = config.nr
-
-# The NA will be used for calculating the lens radius, though the pair lens radius-focal length can also be specified below
-# Note: if the NA is for liquid-immersion objective, then it should be divided by the index of that liquid (so that it's a number less than 1)
-NA = config.NA
-
-f = 1e5*Rp # A lot to guarantee that the particle doesn't hit the lens (nothing horrible should happen, but still)
-
-# Finally, calculate the lens radius
-Rl = f * np.tan(np.arcsin(NA))
-
-# The first argument is the lowest x, the second is the highest x and the third is the number of steps to take.
-# If not iterating over x, then set it to 0, 0, 1 (or change 0 to the desired fixed value of x)
-# All the coordinates are zero when the particle is at the focus. Z decreases when the particle is closer to the lens.
-
-xstart = config.xstart
-xstop = config.xstop
-xsteps = config.xsteps
-
-if xstart == xstop:
-    xsteps = 1
-xs = np.linspace(xstart, xstop, xsteps)
-
-# Same as above, for y
-ystart = config.ystart
-ystop = config.ystop
-ysteps = config.ysteps
-
-if ystart == ystop:
-    ysteps = 1
-ys = np.linspace(ystart, ystop, ysteps)
-
-# Same as above, for z
-zstart = config.zstart
-zstop = config.zstop
-zsteps = config.zsteps
-
-if zstart == zstop:
-    zsteps = 1
-zs = np.linspace(zstart, zstop, zsteps)
-
-# Now we generate the space of all the necessary coordinates, where every row is a position to be calculated
-xx, yy, zz = np.meshgrid(xs, ys, zs)
-
-positions = np.vstack([xx.flatten(), yy.flatten(), zz.flatten()]).transpose()
-
-# Initialize the system (the 0,0,0 initial position is just for completeness)
-opt = osys.OpticalSystemSimpleArbitrary(np.array([0,0,0]), Rp, n, Rl, f, 
-                                        config.int_pol_function, **config.int_pol_arguments)
-
-# An auxiliary function for applying on each row
-def force(row):
-    opt.set_particle_center(row)
-    force = opt.integrate(config.rsteps, config.thsteps)
-    
-    return force
-
-forces = np.apply_along_axis(force, axis=1, arr=positions)
-
-# Make an array that includes positions and forces
-out_array = np.hstack([positions, forces])
-# Save it into a file
-np.savetxt(out_file, out_array, delimiter="\t", fmt='%.6e')
+    rays = cfg.rsteps*cfg.thsteps
+
+    if cfg.adaptive:
+        # Evaluate the positions adaptively in the box spanned by the grid and then interpolate the results into the grid
+        lo = np.array([cfg.xstart, cfg.ystart, cfg.zstart])
+        hi = np.array([cfg.xstop, cfg.ystop, cfg.zstop])
+
+        # The number of positions of an adaptive sweep is not known beforehand
+        reporter = progress.ProgressReporter(None, rays, cfg.progress_interval, cfg.metrics_file)
+
+        def force_fun(p):
+            forces, done = sweep.compute_forces_chunked(opt, p, cfg, reporter, stop)
+            if done < len(p):
+                raise progress.Interrupted(p[:done], forces[:done])
+            return forces
+
+        sweeper = adaptive.AdaptiveSweep(lo, hi, cfg.adaptive_coarse, cfg.adaptive_depth)
+        root, ext = os.path.splitext(out_file)
+
+        try:
+            sweeper.run(force_fun, cfg.adaptive_tol)
+        except progress.Interrupted as e:
+            # Only the positions that were computed can be saved (there is nothing to interpolate the grid from)
+            done_positions, done_forces = sweeper.results()
+            results.save_scattered(root + ".adaptive.tsv", np.vstack([done_positions, e.positions]), np.vstack([done_forces.reshape(-1, 3), e.forces]))
+
+            reporter.close("interrupted")
+            return False
+
+        forces = sweeper.resample(xs, ys, zs)
+        done = len(positions)
+
+        # The positions that were actually computed are saved too
+        results.save_scattered(root + ".adaptive.tsv", *sweeper.results())
+    elif cfg.progressive:
+        sweeper = progressive.ProgressiveSweep(xs, ys, zs, cfg.progressive_passes, cfg.rsteps, cfg.thsteps)
+
+        def force_fun(p, rsteps, thsteps):
+            reporter = progress.ProgressReporter(len(p), rsteps*thsteps, cfg.progress_interval, cfg.metrics_file)
+            forces, done = sweep.compute_forces_chunked(opt, p, sweep.configure(cfg, rsteps=rsteps, thsteps=thsteps), reporter, stop)
+            reporter.close("finished" if done == len(p) else "interrupted")
+            return forces, done
+
+        # Every pass replaces the result file with a finer grid
+        def publish(n, settings, pxs, pys, pzs, grid):
+            results.replace_grid(out_file, pxs, pys, pzs, grid, progressive_pass=n, rsteps=settings[1], thsteps=settings[2])
+            print("Pass {0}/{1} saved into {2}: {3}x{4}x{5} positions, {6}x{7} rays".format(n + 1, cfg.progressive_passes, out_file, len(pxs), len(pys), len(pzs), settings[1], settings[2]), file=sys.stderr)
+
+        # If the sweep is stopped, the result file keeps the last complete pass
+        return sweeper.run(force_fun, publish)
+    elif shard is not None:
+        indices = shards.shard_indices(cfg, positions, *shard)
+
+        reporter = progress.ProgressReporter(len(indices), rays, cfg.progress_interval, cfg.metrics_file)
+        forces, done = sweep.compute_forces_chunked(opt, positions[indices], cfg, reporter, stop)
+
+        shards.save_shard(shards.shard_filename(out_file, *shard), cfg, xs, ys, zs, indices, forces, shard[0], shard[1], done)
+        reporter.close("finished" if done == len(indices) else "interrupted")
+
+        return done == len(indices)
+    else:
+        reporter = progress.ProgressReporter(len(positions), rays, cfg.progress_interval, cfg.metrics_file)
+        forces, done = sweep.compute_forces_chunked(opt, positions, cfg, reporter, stop)
+
+    # Save the positions and the forces into a file (TSV or structured, depending on the extension)
+    results.save_grid(out_file, xs, ys, zs, forces)
+
+    if done < len(positions):
+        reporter.close("interrupted")
+        return False
+
+    reporter.close()
+    return True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calculates the force on the particle over the positions set in config.py")
+    parser.add_argument("--plan", action="store_true", help="don't calculate anything: estimate the runtime and the memory needed by the sweep (see plan.py)")
+    parser.add_argument("--shard", default=None, metavar="i/N", help="only evaluate the i-th of N parts of the grid (from 0 to N-1), and save it into a shard file (merge the shards with shards.py)")
+    args = parser.parse_args(argv)
+
+    shard = None
+    if args.shard is not None:
+        try:
+            shard = shards.parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+
+    # Import the Python configuration file
+    import config
+
+    cfg = sweep.configure(config)
+
+    if args.plan:
+        import plan
+        plan.print_plan(plan.make_plan(cfg))
+        return
+
+    # Initialize the system. The lens radius is calculated from the NA (see sweep.py)
+    opt = sweep.make_system(cfg)
+
+    with progress.GracefulStop() as stop:
+        if not run(cfg, opt, stop, shard):
+            sys.exit(128 + stop.requested)
+
+# The parallel engine starts new processes, which (on some systems) import this file again: the calculation must only run in the main one
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+# A local force-evaluation service. It keeps the optical systems (and their ray bundles) of the configurations it has been asked about in memory, so that other programs can get forces in milliseconds instead of setting everything up again.
+# Requests that arrive at about the same time for the same configuration are coalesced into a single (batched) evaluation.
+#
+# Start it with e.g.  python3 service.py --socket /tmp/tweezers.sock  (or --port 8765 to listen on localhost), and then, from any program:
+#
+#     client = service.ForceClient(path="/tmp/tweezers.sock")
+#     forces = client.forces([[0, 0, 0.5], [0.1, 0, 0.5]], NA=0.9, int_pol_arguments={'a': 1.2, 'p': [1, 1j]})
+#
+# Any setting of "config.py" can be overridden by a request; the others keep the values of "config.py".
+# The protocol is JSON, one message per line. A request is {"id": ..., "config": {...}, "positions": [[x, y, z], ...]} and the reply is {"id": ..., "forces": [[Fx, Fy, Fz], ...]} (or {"id": ..., "error": "..."}). {"id": ..., "stats": true} returns the number of requests and of evaluations done so far. Complex numbers are sent as strings (e.g. "1j").
+import argparse
+import asyncio
+import json
+import socket
+
+import numpy as np
+
+# Converts the arrays and complex numbers of a message into something that JSON can represent
+def encode_value(value):
+    if isinstance(value, dict):
+        return {k: encode_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [encode_value(v) for v in value]
+    if isinstance(value, (complex, np.complexfloating)):
+        return str(complex(value)) if value.imag != 0 else float(value.real)
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return value
+
+# The inverse of encode_value for the settings of a configuration: lists become arrays (as the beam profiles expect) and strings inside them become complex numbers
+def decode_settings(value):
+    if isinstance(value, dict):
+        return {k: decode_settings(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return np.array([complex(v) if isinstance(v, str) else decode_settings(v) for v in value])
+
+    return value
+
+class ForceService(object):
+    # base is the configuration that requests override (usually, the config module). Requests for the same configuration that arrive within `window` seconds of each other are evaluated together (up to max_positions positions at once)
+    def __init__(self, base, window=0.002, max_positions=4096):
+        self._base = base
+        self._window = window
+        self._max_positions = max_positions
+
+        # The queue of pending requests of every configuration (indexed by the canonical JSON of its overrides)
+        self._queues = {}
+        self._workers = []
+
+        self.requests = 0
+        self.evaluations = 0
+
+    # Returns the forces on the given positions for the configuration given by the overrides
+    async def evaluate(self, overrides, positions):
+        key = json.dumps(overrides, sort_keys=True)
+
+        if key not in self._queues:
+            import sweep
+
+            cfg = sweep.configure(self._base, **decode_settings(overrides))
+
+            self._queues[key] = asyncio.Queue()
+            self._workers.append(asyncio.get_running_loop().create_task(self._worker(key, cfg, self._queues[key])))
+
+        self.requests += 1
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[key].put((np.asarray(positions, dtype=float).reshape(-1, 3), future))
+
+        return await future
+
+    # Evaluates the requests of a single configuration (the one of the queue given by key), coalescing the ones that arrive together
+    async def _worker(self, key, cfg, queue):
+        import sweep
+
+        loop = asyncio.get_running_loop()
+
+        # The system is built in another thread too, so that the other configurations keep being served in the meantime
+        try:
+            opt = await loop.run_in_executor(None, sweep.make_system, cfg)
+        except Exception as e:
+            # The requests that are waiting fail, and the next ones for this configuration will try again
+            del self._queues[key]
+            while not queue.empty():
+                p, future = queue.get_nowait()
+                future.set_exception(e)
+            return
+
+        while True:
+            items = [await queue.get()]
+
+            # Wait a little for other requests to arrive
+            await asyncio.sleep(self._window)
+
+            n = len(items[0][0])
+            while not queue.empty() and n < self._max_positions:
+                items.append(queue.get_nowait())
+                n += len(items[-1][0])
+
+            positions = np.vstack([p for p, future in items])
+
+            # The evaluation is done in another thread so that the service keeps accepting requests in the meantime (one configuration is never evaluated by two threads at once, since every configuration has a single worker)
+            try:
+                batched = sweep.configure(cfg, engine="batched")
+                forces = await loop.run_in_executor(None, sweep.compute_forces, opt, positions, batched)
+            except Exception as e:
+                for p, future in items:
+                    future.set_exception(e)
+                continue
+
+            self.evaluations += 1
+
+            start = 0
+            for p, future in items:
+                future.set_result(forces[start:start + len(p)])
+                start += len(p)
+
+    # Stops evaluating (pending requests are cancelled)
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+        self._workers = []
+        self._queues = {}
+
+    # Answers a single request
+    async def _reply(self, line, writer):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            writer.write(json.dumps({"id": None, "error": "invalid JSON"}).encode() + b"\n")
+            return
+
+        reply = {"id": request.get("id")}
+
+        try:
+            if request.get("stats"):
+                reply.update(requests=self.requests, evaluations=self.evaluations, configurations=len(self._queues))
+            else:
+                reply["forces"] = await self.evaluate(request.get("config", {}), request["positions"])
+        except Exception as e:
+            reply = {"id": request.get("id"), "error": "{0}: {1}".format(type(e).__name__, e)}
+
+        writer.write(json.dumps(encode_value(reply)).encode() + b"\n")
+        await writer.drain()
+
+    # Handles a connection. The requests of a connection are answered concurrently (so a client can send many requests before reading the replies, which are matched by their id)
+    async def _handle(self, reader, writer):
+        tasks = set()
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+
+            task = asyncio.get_running_loop().create_task(self._reply(line, writer))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        writer.close()
+
+    # Starts listening on a Unix socket (if path is given) or on a TCP port of localhost. Returns the asyncio server
+    async def start(self, path=None, host="127.0.0.1", port=None):
+        if path is not None:
+            return await asyncio.start_unix_server(self._handle, path=path)
+
+        return await asyncio.start_server(self._handle, host=host, port=port)
+
+# A (blocking) client of the service
+class ForceClient(object):
+    def __init__(self, path=None, host="127.0.0.1", port=None):
+        if path is not None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(path)
+        else:
+            self._sock = socket.create_connection((host, port))
+
+        self._file = self._sock.makefile("rwb")
+        self._id = 0
+
+    def _request(self, request):
+        self._id += 1
+        request["id"] = self._id
+
+        self._file.write(json.dumps(encode_value(request)).encode() + b"\n")
+        self._file.flush()
+
+        reply = json.loads(self._file.readline())
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+
+        return reply
+
+    # Returns the forces (as an (M,3) array) on the given positions (one per row). The keyword arguments override the settings of "config.py" of the service
+    def forces(self, positions, **config):
+        reply = self._request({"config": config, "positions": np.asarray(positions, dtype=float).reshape(-1, 3)})
+
+        return np.array(reply["forces"]).reshape(-1, 3)
+
+    # Returns the statistics of the service
+    def stats(self):
+        reply = self._request({"stats": True})
+        del reply["id"]
+
+        return reply
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local force-evaluation service")
+    parser.add_argument("--socket", default=None, help="path of the Unix socket to listen on")
+    parser.add_argument("--port", type=int, default=None, help="TCP port to listen on (localhost only)")
+    parser.add_argument("--window", type=float, default=2, help="time (in ms) to wait for concurrent requests to coalesce them")
+    args = parser.parse_args(argv)
+
+    if (args.socket is None) == (args.port is None):
+        parser.error("exactly one of --socket and --port must be given")
+
+    import config
+
+    async def serve():
+        svc = ForceService(config, window=args.window/1000)
+
+        # Warm up the default configuration so that the first request doesn't pay for it
+        await svc.evaluate({}, [[0, 0, 0]])
+
+        server = await svc.start(path=args.socket, port=args.port)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# Sharding of sweeps across machines: `python3 run.py --shard i/N` evaluates only the i-th of N parts of the grid (i goes from 0 to N-1) and saves it into its own shard file (see shard_filename), which carries a hash of the configuration. Once all the shards are done, this file merges them into the complete result file, checking that they come from the same configuration and that none is missing, duplicated or incomplete.
+# The partition is deterministic (every machine computes it on its own, with nothing shared but the configuration), and every shard gets the same number of positions (give or take one) and the same share of the positions where most rays hit the particle (see shard_indices).
+#
+# Usage example (on a shared filesystem):
+#     for i in 0 1 2 3; do ssh node$i "cd $PWD && python3 run.py --shard $i/4" & done; wait
+#     python3 shards.py results.npz results.shard-*-of-4.npz
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# The settings that the results of a sharded sweep depend on (the physics, the rays and the grid), which are the only ones in the configuration hash. The rest only change how, or where, the forces are computed (sharded sweeps are never adaptive or progressive)
+result_settings = ("radius", "nr", "int_pol_function", "int_pol_arguments", "NA", "rsteps", "thsteps", "quadrature",
+                   "xstart", "xstop", "xsteps", "ystart", "ystop", "ysteps", "zstart", "zstop", "zsteps")
+
+# The arrays that every shard file has (see save_shard)
+shard_keys = ("xs", "ys", "zs", "indices", "forces", "shard", "shards", "done", "config_hash")
+
+# Returns a hash (a hex string) of the settings of the configuration cfg that change the results (or of the given ones, and of the values of extra, a dict, if given)
+def config_hash(cfg, names=result_settings, extra=None):
+    import service
+
+    settings = {k: getattr(cfg, k) for k in names}
+    if "int_pol_function" in settings:
+        fun = settings["int_pol_function"]
+        settings["int_pol_function"] = "{0}.{1}".format(fun.__module__, fun.__name__)
+    if extra is not None:
+        settings.update(extra)
+
+    text = json.dumps(service.encode_value(settings), sort_keys=True)
+
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+# Parses the "i/N" notation of a shard. Returns (i, N). Raises ValueError if it's not valid
+def parse_shard(text):
+    try:
+        i, n = (int(v) for v in text.split("/"))
+    except ValueError:
+        raise ValueError("Invalid shard: {0} (it must be i/N)".format(text))
+
+    if n < 1 or not 0 <= i < n:
+        raise ValueError("Invalid shard: {0} (i must be between 0 and N-1)".format(text))
+
+    return i, n
+
+# The name of the file of the shard i of n, for the result file out_file (always a structured file)
+def shard_filename(out_file, i, n):
+    root, ext = os.path.splitext(out_file)
+
+    return "{0}.shard-{1}-of-{2}.npz".format(root, i, n)
+
+# Estimates how many of the rays of a coarse bundle (of about `rays` rays, on a square grid over the lens) hit the particle at every position (an (M,3) array), as an array of integers.
+# All the rays are focused into the focal spot, so a ray hits the particle if its line passes closer than the radius to the center. Only correctly rounded operations are used (no trigonometric functions, no sums of floats), so that every machine gets exactly the same counts
+def hit_counts(cfg, positions, rays=256):
+    k = max(1, int(np.sqrt(4*rays/np.pi)))
+    u = (np.arange(k) + 0.5)*(2/k) - 1
+    u, v = np.meshgrid(u, u)
+    inside = u*u + v*v <= 1
+    u, v = u[inside], v[inside]
+
+    # The directions of the rays (towards the focus), normalized, for a lens of radius tan(arcsin(NA)) at unit distance
+    t = cfg.NA/np.sqrt(1 - cfg.NA*cfg.NA)
+    lx, ly, lz = -u*t, -v*t, np.ones(len(u))
+    ln = np.sqrt(lx*lx + ly*ly + lz*lz)
+    lx, ly, lz = lx/ln, ly/ln, lz/ln
+
+    # The squared distance of every ray to every position
+    x, y, z = (positions[:,i][:,None] for i in range(3))
+    cl = x*lx + y*ly + z*lz
+    d2 = (x*x + y*y + z*z) - cl*cl
+
+    return np.count_nonzero(d2 < cfg.radius*cfg.radius, axis=1)
+
+# Returns the indices (in increasing order) of the positions (an (M,3) array, usually sweep.grid_positions) that belong to the shard i of n.
+# The cost of a position hardly depends on the number of rays that hit the particle (the rays that miss are calculated anyway), so the shards get the same number of positions. Still, the positions are dealt in order of the rays that hit them (the most first, back and forth over the shards), so that the expensive ones are spread evenly too
+def shard_indices(cfg, positions, i, n):
+    order = np.argsort(-hit_counts(cfg, positions), kind='stable')
+
+    k = np.arange(len(order))
+    turn, j = k // n, k % n
+    owner = np.where(turn % 2 == 0, j, n - 1 - j)
+
+    return np.sort(order[owner == i])
+
+# Saves the forces on the positions of the shard i of n (given by their indices in the grid of the configuration cfg, see shard_indices) into a shard file. done is the number of positions that were evaluated (the first ones), in case the shard was stopped
+def save_shard(filename, cfg, xs, ys, zs, indices, forces, i, n, done):
+    np.savez(filename, xs=np.atleast_1d(xs), ys=np.atleast_1d(ys), zs=np.atleast_1d(zs), indices=indices, forces=forces,
+             shard=i, shards=n, done=done, config_hash=config_hash(cfg))
+
+# Loads a shard file (see save_shard) into a dict of arrays. Raises ValueError if the file can't be read or is not a shard file
+def load_shard(filename):
+    try:
+        data = np.load(filename)
+    except (OSError, ValueError) as e:
+        raise ValueError("Can't read {0}: {1}".format(filename, e))
+
+    if not isinstance(data, np.lib.npyio.NpzFile):
+        raise ValueError("{0} is not a shard file".format(filename))
+
+    with data:
+        missing = [k for k in shard_keys if k not in data.files]
+        if missing:
+            raise ValueError("{0} is not a shard file (it has no {1})".format(filename, ", ".join(missing)))
+
+        return {k: data[k] for k in data.files}
+
+# Merges the shard files into the complete grid. Returns the values of each coordinate, the forces as a (nx, ny, nz, 3) array (see results.load_grid) and the configuration hash.
+# Raises ValueError if a file is not a shard file, if the shards come from different configurations or partitions, or if a shard is missing, repeated or incomplete
+def merge(filenames):
+    import results
+
+    if len(filenames) == 0:
+        raise ValueError("No shard files")
+
+    shards = {}
+    for name in filenames:
+        shard = load_shard(name)
+        i = int(shard["shard"])
+
+        if i in shards:
+            raise ValueError("Shard {0} is repeated: {1} and {2}".format(i, shards[i]["file"], name))
+
+        shard["file"] = name
+        shards[i] = shard
+
+    first = shards[min(shards)]
+    n = int(first["shards"])
+
+    for i, shard in sorted(shards.items()):
+        if str(shard["config_hash"]) != str(first["config_hash"]):
+            raise ValueError("{0} was computed with a different configuration than {1}".format(shard["file"], first["file"]))
+        if int(shard["shards"]) != n or any(not np.array_equal(shard[k], first[k]) for k in ("xs", "ys", "zs")):
+            raise ValueError("{0} belongs to a different partition than {1}".format(shard["file"], first["file"]))
+        if int(shard["done"]) < len(shard["indices"]):
+            raise ValueError("Shard {0} is incomplete ({1} of {2} positions): run it again".format(i, int(shard["done"]), len(shard["indices"])))
+
+    missing = sorted(set(range(n)) - set(shards))
+    if missing:
+        raise ValueError("Missing shards: {0}".format(", ".join(str(i) for i in missing)))
+
+    xs, ys, zs = first["xs"], first["ys"], first["zs"]
+
+    # The forces in the order of sweep.grid_positions, where every position must be set by exactly one shard
+    forces = np.full((len(xs)*len(ys)*len(zs), 3), np.nan)
+    count = np.zeros(len(forces), dtype=int)
+
+    for shard in shards.values():
+        forces[shard["indices"]] = shard["forces"]
+        np.add.at(count, shard["indices"], 1)
+
+    if np.any(count != 1):
+        raise ValueError("The shards don't cover every position exactly once")
+
+    # np.meshgrid (in sweep.grid_positions) puts the Y coordinate first
+    grid = forces.reshape(len(ys), len(xs), len(zs), 3).transpose(1, 0, 2, 3)
+    xs, ys, zs, grid = results.sort_grid(xs, ys, zs, grid)
+
+    return xs, ys, zs, grid, str(first["config_hash"])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merges the shard files of a sweep (see run.py --shard) into the complete result file")
+    parser.add_argument("out", help="result file to save the complete grid into (TSV or structured .npz)")
+    parser.add_argument("files", nargs="+", help="shard files (all the shards of the sweep)")
+    args = parser.parse_args(argv)
+
+    import results
+
+    try:
+        xs, ys, zs, grid, digest = merge(args.files)
+    except ValueError as e:
+        parser.exit(1, "shards.py: {0}\n".format(e))
+
+    results.save_grid(args.out, xs, ys, zs, grid, config_hash=digest)
+    print("{0} shards merged into {1} ({2}x{3}x{4} positions)".format(len(args.files), args.out, len(xs), len(ys), len(zs)))
+
+if __name__ == "__main__":
+    main()
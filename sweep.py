@@ -0,0 +1,221 @@
+# Helpers for computing the force on a particle over a set of positions (used by run.py and the other drivers).
+# The configuration is passed as an object with the same attributes as "config.py" (usually, the config module itself)
+import collections
+import multiprocessing
+import os
+import signal
+import types
+
+import beam_profiles as bp
+import optical_system as osys
+import numpy as np
+
+# Memory used for each batch of positions by the batched engine when no memory budget is configured
+default_memory_budget = 2**28
+
+# Makes a configuration object with the settings of `base` (usually, the config module) replaced by the given ones. The intensity/polarization function can also be given by its name in beam_profiles.py
+def configure(base, **overrides):
+    settings = {k: v for k, v in vars(base).items() if not k.startswith('_') and not isinstance(v, types.ModuleType)}
+    settings.update(overrides)
+
+    cfg = types.SimpleNamespace(**settings)
+    if isinstance(cfg.int_pol_function, str):
+        cfg.int_pol_function = getattr(bp, cfg.int_pol_function)
+
+    return cfg
+
+# The focal distance is a lot bigger than the particle to guarantee that the particle doesn't hit the lens (nothing horrible should happen, but still)
+def focal_distance(cfg):
+    return 1e5*cfg.radius
+
+# Calculates the lens radius from the NA and the focal distance
+# Note: if the NA is for liquid-immersion objective, then it should be divided by the index of that liquid (so that it's a number less than 1)
+def lens_radius(NA, f):
+    return f * np.tan(np.arcsin(NA))
+
+# The values taken by one of the coordinates. If start and stop are the same, then the coordinate is fixed and steps is ignored
+def axis_range(start, stop, steps):
+    if start == stop:
+        steps = 1
+
+    return np.linspace(start, stop, steps)
+
+# The values taken by the X, Y and Z coordinates of the particle. All the coordinates are zero when the particle is at the focus. Z decreases when the particle is closer to the lens.
+def grid_axes(cfg):
+    xs = axis_range(cfg.xstart, cfg.xstop, cfg.xsteps)
+    ys = axis_range(cfg.ystart, cfg.ystop, cfg.ysteps)
+    zs = axis_range(cfg.zstart, cfg.zstop, cfg.zsteps)
+
+    return xs, ys, zs
+
+# Generates the space of all the positions of a grid, where every row is a position to be calculated
+def grid_positions(xs, ys, zs):
+    xx, yy, zz = np.meshgrid(xs, ys, zs)
+
+    return np.vstack([xx.flatten(), yy.flatten(), zz.flatten()]).transpose()
+
+# Makes sure that the beam of the configuration is a single one. The profiles of beam_profiles.py accept arrays of parameters (several beams at once, see OpticalSystemSimpleArbitrary.set_beam), but the sweeps, the result files and the tools built on them handle a single beam: raises ValueError otherwise
+def check_single_beam(cfg):
+    f = focal_distance(cfg)
+    int_pol = np.asarray(cfg.int_pol_function(np.zeros(1), np.zeros(1), lens_radius(cfg.NA, f), **cfg.int_pol_arguments))
+
+    if int_pol.ndim > 2:
+        raise ValueError("The beam settings describe {0} beams at once (array parameters), but a sweep can only use one: run a configuration for every beam (e.g. with jobs.py), or integrate all of them at once with OpticalSystemSimpleArbitrary".format(int(np.prod(int_pol.shape[:-2]))))
+
+# Initializes the optical system described by the configuration (the 0,0,0 initial position is just for completeness)
+def make_system(cfg):
+    check_single_beam(cfg)
+
+    f = focal_distance(cfg)
+    Rl = lens_radius(cfg.NA, f)
+
+    opt = osys.OpticalSystemSimpleArbitrary(np.array([0,0,0]), cfg.radius, cfg.nr, Rl, f,
+                                            cfg.int_pol_function, **cfg.int_pol_arguments)
+    opt.set_quadrature(cfg.quadrature)
+    opt.set_ray_layout(cfg.ray_layout)
+
+    return opt
+
+# Calculates the force on the particle at a single position
+def force(opt, position, cfg):
+    opt.set_particle_center(position)
+
+    if cfg.memory_budget is None:
+        return opt.integrate(cfg.rsteps, cfg.thsteps)
+    else:
+        return opt.integrate_streaming(cfg.rsteps, cfg.thsteps, cfg.memory_budget)
+
+# Finds the stable equilibrium on the beam axis from the axial force Fz sampled at increasing axial positions: where the force changes from pushing forward (Fz > 0) to pulling back. Returns the index k of the first one, so that the equilibrium is between the samples k and k+1 (None if there is none)
+def axial_sign_change(Fz):
+    k = np.flatnonzero((Fz[:-1] > 0) & (Fz[1:] <= 0))
+
+    return None if len(k) == 0 else k[0]
+
+# Number of processes used by the parallel engine
+def worker_count(cfg):
+    return cfg.workers if cfg.workers is not None else os.cpu_count()
+
+# Evaluates a part of the positions in a process of the parallel engine (every process builds its own system)
+def _parallel_forces(args):
+    cfg, positions = args
+
+    return compute_forces(make_system(cfg), positions, cfg)
+
+# Maps fun over the items using a pool of processes (or in this process if there is only one)
+def parallel_map(fun, items, workers):
+    if workers <= 1 or len(items) <= 1:
+        return [fun(item) for item in items]
+
+    with multiprocessing.Pool(min(workers, len(items))) as pool:
+        return pool.map(fun, items)
+
+# Calculates the forces for every row of positions with the configured engine
+def compute_forces(opt, positions, cfg):
+    if cfg.engine == "serial":
+        forces = np.zeros((len(positions), 3))
+
+        for i, position in enumerate(positions):
+            forces[i] = np.real(force(opt, position, cfg))
+
+        return forces
+    elif cfg.engine == "batched":
+        budget = default_memory_budget if cfg.memory_budget is None else cfg.memory_budget
+
+        return opt.integrate_positions(positions, cfg.rsteps, cfg.thsteps, budget)
+    elif cfg.engine == "parallel":
+        # The positions are dealt to the processes in turns, so that the expensive regions of the grid are shared among all of them. Every process evaluates its positions with the batched engine
+        workers = max(1, min(worker_count(cfg), len(positions)))
+        sub = configure(cfg, engine="batched")
+
+        parts = parallel_map(_parallel_forces, [(sub, positions[i::workers]) for i in range(workers)], workers)
+
+        forces = np.zeros((len(positions), 3))
+        for i, part in enumerate(parts):
+            forces[i::workers] = part
+
+        return forces
+    else:
+        raise ValueError("Unknown engine: {0}".format(cfg.engine))
+
+# Number of positions evaluated at a time by compute_forces_chunked (between two progress records or checks for a stop request)
+def chunk_size(cfg):
+    if cfg.chunk_positions is not None:
+        return max(1, cfg.chunk_positions)
+
+    if cfg.engine == "serial":
+        return 1
+
+    # As many positions as fit in the memory budget of a process
+    budget = default_memory_budget if cfg.memory_budget is None else cfg.memory_budget
+
+    return max(1, budget // (cfg.rsteps*cfg.thsteps*osys.bytes_per_ray))
+
+# The system of a process of the chunked parallel engine (built once per process)
+_worker_system = None
+
+def _init_worker(cfg):
+    global _worker_system
+    _worker_system = make_system(cfg)
+
+    # Only the main process handles Ctrl-C and SIGTERM (it stops sending chunks and waits for the ones in flight): the workers leave the process group, so that the signals sent to the whole group (e.g. by the terminal) don't reach them, and restore the default handlers
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def _worker_forces(args):
+    cfg, positions = args
+
+    return compute_forces(_worker_system, positions, cfg)
+
+# Calculates the forces for the positions in chunks (see chunk_size), reporting the progress after every chunk to progress (a progress.ProgressReporter, or None) and checking whether stop (a progress.GracefulStop, or None) has been requested.
+# Returns the forces and the number of positions evaluated: if the sweep is stopped, only the first ones are evaluated (the forces on the others are NaN)
+def compute_forces_chunked(opt, positions, cfg, progress=None, stop=None):
+    n = chunk_size(cfg)
+    if cfg.engine == "parallel":
+        # At least a chunk for every process
+        n = max(1, min(n, -(-len(positions) // worker_count(cfg))))
+    chunks = [positions[i:i + n] for i in range(0, len(positions), n)]
+
+    forces = np.full((len(positions), 3), np.nan)
+    done = 0
+
+    def stopped():
+        return stop is not None and stop.requested is not None
+
+    if cfg.engine == "parallel" and len(chunks) > 1 and worker_count(cfg) > 1:
+        # A single pool for the whole sweep (every process builds its system once) that evaluates the chunks with the batched engine. Only one chunk per process is in flight at a time, so that a stop request just waits for them
+        sub = configure(cfg, engine="batched")
+        workers = min(worker_count(cfg), len(chunks))
+
+        with multiprocessing.Pool(workers, _init_worker, (sub,)) as pool:
+            pending = collections.deque()
+            submitted = 0
+
+            while submitted < len(chunks) or pending:
+                while submitted < len(chunks) and len(pending) < workers and not stopped():
+                    pending.append(pool.apply_async(_worker_forces, ((sub, chunks[submitted]),)))
+                    submitted += 1
+
+                if not pending:
+                    break
+
+                # The chunks finish in order (as far as the results are concerned)
+                part = pending.popleft().get()
+                forces[done:done + len(part)] = part
+                done += len(part)
+
+                if progress is not None:
+                    progress.update(len(part))
+    else:
+        for c in chunks:
+            if stopped():
+                break
+
+            forces[done:done + len(c)] = compute_forces(opt, c, cfg)
+            done += len(c)
+
+            if progress is not None:
+                progress.update(len(c))
+
+    return forces, done
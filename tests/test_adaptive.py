@@ -0,0 +1,57 @@
+# Testing rig
+import unittest
+
+# Modules to test
+import adaptive
+
+# Auxiliary
+import numpy as np
+
+class AdaptiveSweepTestCase(unittest.TestCase):
+    def test_linear_no_refinement(self):
+        # A linear field is interpolated exactly, so the coarse lattice is never refined and the resampling is exact
+        field = lambda p: p @ np.array([[1.0, 2, 0], [0, 1, 0], [3, 0, -1]])
+        
+        sw = adaptive.AdaptiveSweep([-1, 0, -2], [1, 0, 2], 4, 3)
+        sw.run(field, 1e-9)
+        
+        # The 4x4 cells are only subdivided once (to check them)
+        self.assertEqual(sw.evaluations(), 9*9)
+        
+        xs = np.linspace(-1, 1, 13)
+        zs = np.linspace(-2, 2, 17)
+        xx, yy, zz = np.meshgrid(xs, [0], zs)
+        pos = np.vstack([xx.flatten(), yy.flatten(), zz.flatten()]).transpose()
+        
+        self.assertTrue(np.allclose(sw.resample(xs, [0], zs), field(pos)))
+        
+    def test_sharp_feature(self):
+        # A sharp localized feature is refined locally, with a lot fewer evaluations than a uniform grid of the finest resolution
+        field = lambda p: p*np.exp(-np.sum((p - 0.3)**2, axis=1)/0.01).reshape(-1,1)
+        
+        sw = adaptive.AdaptiveSweep([-1, -1, 0], [1, 1, 0], 4, 5)
+        sw.run(field, 1e-3)
+        
+        # The finest uniform grid would have (4*2**5 + 1)**2 points
+        self.assertLess(sw.evaluations(), 0.1*129**2)
+        
+        xs = np.linspace(-1, 1, 101)
+        ys = np.linspace(-1, 1, 101)
+        xx, yy, zz = np.meshgrid(xs, ys, [0])
+        pos = np.vstack([xx.flatten(), yy.flatten(), zz.flatten()]).transpose()
+        
+        F = sw.resample(xs, ys, [0])
+        self.assertLess(np.max(np.abs(F - field(pos))), 0.01)
+        
+        # And the scattered results are the evaluated positions
+        positions, forces = sw.results()
+        self.assertEqual(len(positions), sw.evaluations())
+        self.assertTrue(np.allclose(forces, field(positions)))
+        
+    def test_fixed_position(self):
+        # All the coordinates fixed: a single evaluation
+        sw = adaptive.AdaptiveSweep([0, 0, 1], [0, 0, 1], 4, 3)
+        sw.run(lambda p: p + 1, 1e-3)
+        
+        self.assertEqual(sw.evaluations(), 1)
+        self.assertTrue(np.allclose(sw.resample([0], [0], [1]), [[1, 1, 2]]))
@@ -0,0 +1,116 @@
+# Testing rig
+import unittest
+
+# Modules to test
+import averaging
+
+# Auxiliary
+import numpy as np
+import scipy.ndimage as ndi
+
+class AveragingTestCase(unittest.TestCase):
+    def setUp(self):
+        rs = np.random.RandomState(1)
+        self.grid = rs.normal(size=(13, 1, 17, 3))
+        
+        # An asymmetric kernel (so that convolution and correlation differ)
+        self.kernel = rs.uniform(size=(5, 1, 3))
+        self.kernel /= np.sum(self.kernel)
+        
+    def direct(self, mode):
+        return np.stack([ndi.correlate(self.grid[...,j], self.kernel, mode=mode, cval=0) for j in range(3)], axis=-1)
+        
+    def test_edges(self):
+        for edge, mode in (("nearest", "nearest"), ("reflect", "reflect"), ("zero", "constant")):
+            F = averaging.average_forces(self.grid, self.kernel, edge)
+            self.assertTrue(np.allclose(F, self.direct(mode), rtol=0, atol=1e-12), edge)
+            
+    def test_chunks(self):
+        # Chunks of a few X planes (even a single one, with margins longer than the grid) give the same result with every edge mode
+        for edge in averaging.edge_modes:
+            F = averaging.average_forces(self.grid, self.kernel, edge)
+            
+            for planes in (6, 1):
+                Fc = averaging.average_forces(self.grid, self.kernel, edge, max_bytes=planes*1*19*averaging.bytes_per_point)
+                self.assertTrue(np.allclose(F, Fc, rtol=0, atol=1e-12), edge)
+        
+        # A margin longer than the grid
+        kernel = np.ones((31, 1, 1))/31
+        self.assertTrue(np.allclose(averaging.average_forces(self.grid, kernel, "reflect"), np.stack([ndi.correlate(self.grid[...,j], kernel, mode="reflect") for j in range(3)], axis=-1), rtol=0, atol=1e-12))
+        
+    def test_renormalize(self):
+        # A linear field is not changed by a symmetric kernel far from the edges, and a constant one is not changed anywhere (not even next to missing values)
+        xx, yy, zz = np.meshgrid(np.arange(13), [0], np.arange(17), indexing='ij')
+        linear = np.stack([xx, 2*zz, xx + zz], axis=-1).astype(float)
+        kernel = averaging.gaussian_kernel([1, 0, 1], 1.0, truncate=2)
+        
+        self.assertEqual(kernel.shape, (5, 1, 5))
+        self.assertAlmostEqual(np.sum(kernel), 1)
+        
+        F = averaging.average_forces(linear, kernel)
+        self.assertTrue(np.allclose(F[2:-2,:,2:-2], linear[2:-2,:,2:-2], rtol=0, atol=1e-9))
+        
+        constant = np.ones((13, 1, 17, 3))
+        constant[4,0,5] = np.nan
+        F = averaging.average_forces(constant, kernel)
+        self.assertTrue(np.allclose(F, 1, rtol=0, atol=1e-9))
+        
+    def test_shift(self):
+        # The force averaged over a displacement of exactly +1 in X is the force one position further: a point force at 4 is seen from 3
+        grid = np.zeros((9, 1, 1, 3))
+        grid[4,0,0] = [1, 2, 3]
+        kernel = np.zeros((3, 1, 1))
+        kernel[2,0,0] = 1
+        
+        for edge in averaging.edge_modes:
+            F = averaging.average_forces(grid, kernel, edge)
+            self.assertTrue(np.allclose(F[3,0,0], [1, 2, 3], rtol=0, atol=1e-12), edge)
+            
+            # (with "renormalize", the last position has no valid values to average)
+            self.assertTrue(np.allclose(np.delete(F[:8], 3, axis=0), 0, rtol=0, atol=1e-12), edge)
+        
+        # And the same for a kernel sampled from a distribution
+        kernel = averaging.kernel_from_function(lambda dx, dy, dz: (dx == 1).astype(float), [1, 1, 1], [1, 0, 0])
+        self.assertTrue(np.allclose(averaging.average_forces(grid, kernel, "zero")[3,0,0], [1, 2, 3], rtol=0, atol=1e-12))
+        
+    def test_nan(self):
+        grid = self.grid.copy()
+        grid[3,0,4] = np.nan
+        
+        for edge in ("nearest", "reflect", "zero"):
+            with self.assertRaises(ValueError):
+                averaging.average_forces(grid, self.kernel, edge)
+        
+        self.assertTrue(np.all(np.isfinite(averaging.average_forces(grid, self.kernel, "renormalize"))))
+        
+    def test_spacing(self):
+        self.assertEqual(averaging.grid_spacing([3.0]), 0)
+        self.assertAlmostEqual(averaging.grid_spacing(np.linspace(0, 1, 11)), 0.1)
+        
+        with self.assertRaises(ValueError):
+            averaging.grid_spacing([0, 1, 3])
+            
+    def test_descending_axis(self):
+        xs = np.linspace(1, -1, 5)
+        spacings = [averaging.grid_spacing(xs), 0, 0.25]
+        grid = self.grid[:5,:,:9]
+        
+        # The decreasing coordinate is averaged like the increasing one
+        kernel = averaging.gaussian_kernel(spacings, 0.5)
+        self.assertTrue(np.allclose(kernel, averaging.gaussian_kernel(np.abs(spacings), 0.5)))
+        self.assertEqual(kernel.shape[0], 9)
+        
+        # An asymmetric distribution (always towards +X) gives the same forces on the same positions as with the grid in increasing order
+        fun = lambda dx, dy, dz: np.where(dx >= 0, np.exp(-dx - dz**2), 0)
+        F = averaging.average_forces(grid, averaging.kernel_from_function(fun, spacings, (2, 0, 2)), "zero")
+        Fa = averaging.average_forces(grid[::-1], averaging.kernel_from_function(fun, np.abs(spacings), (2, 0, 2)), "zero")
+        self.assertTrue(np.allclose(F, Fa[::-1], rtol=0, atol=1e-12))
+        
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            averaging.average_forces(self.grid, np.ones((2, 1, 3))/6)
+        with self.assertRaises(ValueError):
+            averaging.average_forces(self.grid, self.kernel, "wrap")
+            
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# Testing rig
+import unittest
+
+# Modules to test
+import beam_profiles as bp
+
+# Auxiliary
+import numpy as np
+
+class ModesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.Rl = 2.0
+        
+        # A polar grid on the lens, with the weights of a Gauss-Legendre rule in r
+        x, w = np.polynomial.legendre.leggauss(40)
+        r = self.Rl*(x + 1)/2
+        th = np.linspace(0, 2*np.pi, 48, endpoint=False)
+        self.r, self.th = [v.flatten() for v in np.meshgrid(r, th)]
+        self.w = np.outer(2*np.pi/48*np.ones(48), self.Rl*w/2*r).flatten()
+        
+    def power(self, I):
+        return I @ self.w
+        
+    def test_special_cases(self):
+        p = np.array([1, 1j])
+        
+        # LG_00 and LG_01 are the Gaussian and the donut beams
+        self.assertTrue(np.allclose(bp.laguerre_gauss(self.r, self.th, self.Rl, a=0.8, p=p), bp.gaussian_fixed(self.r, self.th, self.Rl, a=0.8, p=p), rtol=1e-10, atol=0))
+        self.assertTrue(np.allclose(bp.laguerre_gauss(self.r, self.th, self.Rl, a=0.8, l=1, phi=0), bp.donut_radial(self.r, self.th, self.Rl, a=0.8), rtol=1e-10, atol=0))
+        self.assertTrue(np.allclose(bp.hermite_gauss(self.r, self.th, self.Rl, a=1.2, phi=0), bp.gaussian_radial(self.r, self.th, self.Rl, a=1.2), rtol=1e-10, atol=0))
+        
+        # The sign of l doesn't change the intensity
+        self.assertTrue(np.allclose(bp.laguerre_gauss(self.r, self.th, self.Rl, a=0.8, n=1, l=-2, p=p), bp.laguerre_gauss(self.r, self.th, self.Rl, a=0.8, n=1, l=2, p=p), rtol=1e-12, atol=0))
+        
+    def test_normalization(self):
+        for int_pol in [bp.laguerre_gauss(self.r, self.th, self.Rl, a=0.7, n=2, l=3, p=[1, 0]), bp.hermite_gauss(self.r, self.th, self.Rl, a=0.9, m=3, n=1, p=[1, 0])]:
+            self.assertAlmostEqual(self.power(int_pol[:,0]), 1, places=8)
+            self.assertTrue(np.all(int_pol[:,0] >= 0))
+        
+    def test_polarization(self):
+        # Radial, azimuthal and mixed
+        for phi in [0, np.pi/2, 0.3]:
+            pol = bp.laguerre_gauss(self.r, self.th, self.Rl, a=1, phi=phi)[:,1:]
+            radial = np.column_stack([np.cos(self.th), np.sin(self.th), np.zeros(len(self.th))])
+            
+            self.assertTrue(np.allclose(np.sum(pol*radial, axis=1), np.cos(phi)))
+            self.assertTrue(np.allclose(np.sum(pol**2, axis=1), 1))
+        
+    def test_batched_sampling(self):
+        a = np.array([0.6, 0.9, 1.5])
+        l = np.array([0, 1, 3])
+        phi = np.array([0, np.pi/4, np.pi/2])
+        
+        int_pol = bp.laguerre_gauss(self.r, self.th, self.Rl, a=a, l=l, phi=phi)
+        self.assertEqual(int_pol.shape, (3, len(self.r), 4))
+        
+        for k in range(3):
+            self.assertTrue(np.allclose(int_pol[k], bp.laguerre_gauss(self.r, self.th, self.Rl, a=a[k], l=l[k], phi=phi[k]), rtol=1e-12, atol=0))
+        
+        # The parameters are broadcast against each other (here, 2 orders for each of 3 waists), and so are the polarization vectors
+        p = np.array([[1, 0], [0, 1]])
+        int_pol = bp.hermite_gauss(self.r, self.th, self.Rl, a=a, m=[[1], [2]], p=p[:,None,:])
+        self.assertEqual(int_pol.shape, (2, 3, len(self.r), 4))
+        self.assertTrue(np.allclose(self.power(int_pol[...,0]), 1))
+        self.assertTrue(np.allclose(int_pol[1,2], bp.hermite_gauss(self.r, self.th, self.Rl, a=a[2], m=2, p=p[1]), rtol=1e-12, atol=0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+# Testing rig
+import unittest
+
+# Modules to test
+import benchmark
+
+class ParetoTestCase(unittest.TestCase):
+    def test_pareto_front(self):
+        costs = [1, 2, 3, 4, 2, 5]
+        errors = [0.5, 0.1, 0.2, 0.01, 0.3, 0.01]
+        
+        # (3, 0.2), (2, 0.3) and (5, 0.01) are dominated
+        self.assertEqual(benchmark.pareto_front(costs, errors), [0, 1, 3])
+        
+    def test_cheapest(self):
+        costs = [1, 2, 3, 4]
+        errors = [0.5, 0.1, 0.05, 0.01]
+        
+        self.assertEqual(benchmark.cheapest(costs, errors, 0.08), 2)
+        self.assertIsNone(benchmark.cheapest(costs, errors, 0.001))
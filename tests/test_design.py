@@ -0,0 +1,74 @@
+# Testing rig
+import unittest
+
+import os
+import tempfile
+
+# Modules to test
+import design
+
+# Auxiliary
+import config
+import sweep
+import numpy as np
+
+class DesignTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cfg = sweep.configure(config, rsteps=20, thsteps=20, quadrature="gauss")
+        self.zs = np.linspace(-1.5, 2, 15)
+        
+    def test_metrics(self):
+        # A standard trap: stable equilibrium a bit after the focus, with restoring forces
+        opt = sweep.make_system(self.cfg)
+        m = design.trap_metrics(opt, self.cfg, self.zs)
+        
+        self.assertGreater(m["equilibrium"], 0)
+        self.assertGreater(m["axial_q"], 0)
+        self.assertGreater(m["transverse_stiffness"], 0)
+        self.assertGreater(m["trap_depth"], 0)
+        
+        # The axial force vanishes at the equilibrium
+        opt.set_particle_center([0, 0, m["equilibrium"]])
+        self.assertAlmostEqual(np.real(opt.integrate(20, 20)[2]), 0, places=6)
+        
+    def test_search_and_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache = os.path.join(d, "cache.json")
+            
+            search = design.DesignSearch(self.cfg, self.zs, workers=1, cache_file=cache)
+            ranking = search.run("axial_q", {"transverse_stiffness": (0, np.inf)}, (0.7, 0.9), (0.8, 1.5), ["gaussian_fixed"], points=3, levels=2)
+            
+            # The ranking is sorted and the best design meets the constraint
+            scores = [r[0] for r in ranking]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+            self.assertGreater(ranking[0][4]["transverse_stiffness"], 0)
+            
+            # A new search reads the cache instead of evaluating again
+            self.assertEqual(search.evaluations, len(ranking))
+            
+            again = design.DesignSearch(self.cfg, self.zs, workers=1, cache_file=cache)
+            metrics = again.evaluate([r[1:4] for r in ranking])
+            
+            self.assertEqual(again.evaluations, 0)
+            self.assertEqual(len(metrics), len(ranking))
+            self.assertTrue(np.allclose([m["axial_q"] for m in metrics], [r[4]["axial_q"] for r in ranking]))
+            
+            # Other settings (or axial positions) don't use the cache, but keep it
+            designs = [r[1:4] for r in ranking[:2]]
+            for cfg, zs in [(sweep.configure(self.cfg, nr=1.8), self.zs), (sweep.configure(self.cfg, int_pol_arguments={'a': 1.0, 'p': np.array([1, 1j])}), self.zs), (self.cfg, self.zs[1:])]:
+                other = design.DesignSearch(cfg, zs, workers=1, cache_file=cache)
+                other.evaluate(designs)
+                self.assertEqual(other.evaluations, len(designs))
+            
+            # The file keeps the designs of every setting, each with its own metrics
+            high = design.DesignSearch(sweep.configure(self.cfg, nr=1.8), self.zs, workers=1, cache_file=cache)
+            high_metrics = high.evaluate(designs)
+            self.assertEqual(high.evaluations, 0)
+            self.assertFalse(np.allclose([m["axial_q"] for m in high_metrics], [r[4]["axial_q"] for r in ranking[:2]]))
+            
+            again = design.DesignSearch(self.cfg, self.zs, workers=1, cache_file=cache)
+            again.evaluate(designs)
+            self.assertEqual(again.evaluations, 0)
+            
+            # The beam size is searched, so it doesn't change the settings
+            self.assertEqual(design.settings_hash(sweep.configure(self.cfg, NA=0.5, int_pol_arguments=dict(self.cfg.int_pol_arguments, a=3)), self.zs), design.settings_hash(self.cfg, self.zs))
@@ -0,0 +1,120 @@
+# Testing rig
+import unittest
+
+import json
+import os
+import tempfile
+
+# Modules to test
+import jobs
+
+# Auxiliary
+import config
+import results
+import run
+import sweep
+import numpy as np
+
+class JobsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+        self.defaults = {"rsteps": 20, "thsteps": 20, "engine": "batched", "zstart": -1, "zstop": 1, "zsteps": 5, "progress_interval": None}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, data):
+        path = os.path.join(self.dir, "jobs.json")
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+        return path
+
+    def out(self, name):
+        return os.path.join(self.dir, name + ".npz")
+
+    def test_load_jobs(self):
+        path = self.write({"defaults": {"NA": 0.9, "nr": 1.2}, "jobs": [{"out_file": "a.npz"}, {"name": "b", "out_file": "b.npz", "nr": 1.3}]})
+        a, b = jobs.load_jobs(path)
+
+        self.assertEqual(a, {"name": "0", "out_file": "a.npz", "NA": 0.9, "nr": 1.2})
+        self.assertEqual(b, {"name": "b", "out_file": "b.npz", "NA": 0.9, "nr": 1.3})
+
+        # A plain list of jobs
+        self.assertEqual(jobs.load_jobs(self.write([{"out_file": "a.npz"}])), [{"name": "0", "out_file": "a.npz"}])
+
+    def test_invalid_jobs(self):
+        for data in [{"defaults": {}}, {"jobs": [{"NA": 0.9}]}, {"jobs": [{"out_file": "a.npz"}, {"out_file": "a.npz"}]}, {"jobs": [1]}]:
+            with self.assertRaises(ValueError):
+                jobs.load_jobs(self.write(data))
+
+        with self.assertRaises(ValueError):
+            jobs.make_configs(config, [{"name": "0", "out_file": "a.npz", "NA_": 0.9}])
+
+    def test_decoding(self):
+        cfg, = jobs.make_configs(config, [{"name": "0", "out_file": "a.npz", "int_pol_function": "donut_fixed", "int_pol_arguments": {"a": 1.2, "p": [1, "1j"]}}])
+
+        self.assertEqual(cfg.int_pol_function.__name__, "donut_fixed")
+        self.assertTrue(np.array_equal(cfg.int_pol_arguments["p"], [1, 1j]))
+        self.assertEqual(cfg.name, "0")
+
+    def test_several_beams(self):
+        # Array parameters (several beams at once) can't be swept
+        cfg = sweep.configure(config, int_pol_function="laguerre_gauss", int_pol_arguments={'a': np.array([0.5, 1.0]), 'l': 1, 'p': np.array([1, 0])}, engine="serial")
+        with self.assertRaises(ValueError):
+            sweep.make_system(cfg)
+
+        with self.assertRaises(ValueError):
+            jobs.make_configs(config, [{"name": "0", "out_file": "a.npz", "int_pol_function": "laguerre_gauss", "int_pol_arguments": {"a": [0.5, 1.0], "p": [1, 0]}}])
+
+        # A single one can
+        sweep.make_system(sweep.configure(cfg, int_pol_arguments={'a': 0.5, 'l': 1, 'p': np.array([1, 0])}))
+
+    def test_order(self):
+        job_list = [{"name": str(i), "out_file": str(i), "NA": NA, "nr": nr, "int_pol_arguments": {"a": a, "p": [1, 0]}} for i, (NA, nr, a) in
+                    enumerate([(0.9, 1.2, 1.0), (0.8, 1.2, 1.0), (0.9, 1.3, 1.5), (0.9, 1.4, 1.0), (0.8, 1.3, 1.0)])]
+        cfgs = jobs.make_configs(config, job_list)
+
+        order = jobs.order_jobs(cfgs)
+        self.assertEqual([cfgs[i].NA for i in order], [0.8, 0.8, 0.9, 0.9, 0.9])
+
+        # The beams are grouped too (and otherwise the order of the file is kept)
+        self.assertEqual(order[2:], [0, 3, 2])
+
+    def test_run_matches_separate_runs(self):
+        beam = {"a": 1.0, "p": [1, "1j"]}
+        job_list = [{"out_file": self.out("a"), "NA": 0.9, "nr": 1.2, "int_pol_arguments": beam},
+                    {"out_file": self.out("b"), "NA": 0.8, "nr": 1.2, "int_pol_arguments": beam},
+                    {"out_file": self.out("c"), "NA": 0.9, "nr": 1.5, "int_pol_arguments": beam},
+                    {"out_file": self.out("d"), "NA": 0.9, "nr": 1.5, "int_pol_function": "donut_fixed", "int_pol_arguments": beam}]
+
+        path = self.write({"defaults": self.defaults, "jobs": job_list})
+        cfgs = jobs.make_configs(config, jobs.load_jobs(path))
+
+        runner = jobs.JobRunner(stream=None)
+        failed, remaining = runner.run(cfgs)
+
+        self.assertEqual((failed, remaining), ([], []))
+        self.assertEqual((runner.systems, runner.beams), (2, 3))
+
+        for cfg in cfgs:
+            ref = sweep.configure(cfg, out_file=cfg.out_file + ".ref.npz")
+            run.run(ref, sweep.make_system(ref))
+
+            self.assertTrue(np.array_equal(results.load_grid(cfg.out_file)[3], results.load_grid(ref.out_file)[3]))
+
+    def test_keep_going(self):
+        job_list = [{"out_file": self.out("a"), "quadrature": "simpson"}, {"out_file": self.out("b")}]
+        cfgs = jobs.make_configs(config, jobs.load_jobs(self.write({"defaults": self.defaults, "jobs": job_list})))
+
+        with self.assertRaises(ValueError):
+            jobs.JobRunner(stream=None).run(cfgs)
+
+        failed, remaining = jobs.JobRunner(stream=None).run(cfgs, keep_going=True)
+        self.assertEqual((failed, remaining), (["0"], []))
+        self.assertTrue(os.path.exists(self.out("b")))
+
+if __name__ == '__main__':
+    unittest.main()
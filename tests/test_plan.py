@@ -0,0 +1,67 @@
+# Testing rig
+import unittest
+
+# Modules to test
+import plan
+
+# Auxiliary
+import config
+import optical_system as osys
+import sweep
+
+class PlanTestCase(unittest.TestCase):
+    def test_position_count(self):
+        cfg = sweep.configure(config, xstart=0, xstop=1, xsteps=5, ystart=0, ystop=0, zstart=-1, zstop=1, zsteps=7, adaptive=False)
+        self.assertEqual(plan.position_count(cfg), (35, 35))
+        
+        # Two varying coordinates, 4 coarse cells, up to 2 subdivisions: between 9x9 and 17x17 points
+        cfg = sweep.configure(cfg, adaptive=True, adaptive_coarse=4, adaptive_depth=2)
+        self.assertEqual(plan.position_count(cfg), (81, 289))
+        
+    def test_peak_memory(self):
+        bundle = 1000*osys.bytes_per_ray
+        base = plan.process_overhead + 50*plan.bytes_per_position
+        
+        self.assertEqual(plan.peak_memory("serial", 1000, 50, None, 1), base + bundle)
+        self.assertEqual(plan.peak_memory("streaming", 1000, 50, bundle//4, 1), base + bundle//4)
+        
+        # 10 positions per batch, or a single one if the budget is too small
+        self.assertEqual(plan.peak_memory("batched", 1000, 50, 10*bundle, 1), base + 10*bundle)
+        self.assertEqual(plan.peak_memory("batched", 1000, 50, 1, 1), base + bundle)
+        
+        # 4 processes with 13 positions each (at most)
+        self.assertEqual(plan.peak_memory("parallel", 1000, 50, 100*bundle, 4), base + 4*(plan.process_overhead + 13*bundle))
+        
+        with self.assertRaises(ValueError):
+            plan.peak_memory("quantum", 1000, 50, None, 1)
+            
+    def test_calibration_config(self):
+        cfg = sweep.configure(config, rsteps=1000, thsteps=1000, engine="parallel", memory_budget=10**6*osys.bytes_per_ray//4)
+        small = plan.calibration_config(cfg)
+        
+        # Fewer rays, the same share of the bundle in the budget, and a single process
+        rays = small.rsteps*small.thsteps
+        self.assertLessEqual(rays, plan.max_calibration_rays)
+        self.assertAlmostEqual(small.memory_budget/(rays*osys.bytes_per_ray), 0.25, places=3)
+        self.assertEqual(small.engine, "batched")
+        
+        # Small bundles are calibrated as they are
+        cfg = sweep.configure(cfg, rsteps=20, thsteps=20, engine="serial")
+        self.assertEqual(plan.calibration_config(cfg).memory_budget, cfg.memory_budget)
+        self.assertEqual(plan.calibration_config(cfg).rsteps, 20)
+        
+    def test_make_plan(self):
+        cfg = sweep.configure(config, rsteps=20, thsteps=20, engine="serial", memory_budget=100*osys.bytes_per_ray)
+        p = plan.make_plan(cfg)
+        
+        self.assertEqual(p["engine"], "streaming")
+        self.assertEqual(p["rays"], 400)
+        self.assertGreater(p["rays_per_second"], 0)
+        self.assertLessEqual(p["runtime"][0], p["runtime"][1])
+        
+        if p["memory_available"] is not None:
+            self.assertGreaterEqual(p["suggested_workers"], 1)
+            self.assertGreaterEqual(p["suggested_batch"], 1)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# Testing rig
+import unittest
+
+import os
+import tempfile
+
+# Modules to test
+import plot2d
+
+# Auxiliary
+import results
+import sweep
+import numpy as np
+
+# A known (linear) field, which the splines and the triangulation reproduce exactly
+def field(positions):
+    x, y, z = positions[:,0], positions[:,1], positions[:,2]
+
+    return np.column_stack([x + 2*y + 3*z, 4*x - y, z - 2*x + 0.5*y])
+
+class SliceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.xs = np.linspace(-1, 1, 5)
+        self.ys = np.linspace(0, 2, 3)
+        self.zs = np.linspace(-2, 2, 9)
+
+        positions = sweep.grid_positions(self.xs, self.ys, self.zs)
+        self.grid = results.to_grid(positions, field(positions))[3]
+
+    def test_grid_slice(self):
+        # The zx plane (h > v, so the plane is transposed) at the y closest to 1.2
+        hs, vs, fh, fv = plot2d.grid_slice(self.xs, self.ys, self.zs, self.grid, 2, 0, at=1.2)
+        zz, xx = np.meshgrid(self.zs, self.xs, indexing='ij')
+        F = field(np.column_stack([xx.flatten(), np.full(xx.size, 1.0), zz.flatten()])).reshape(zz.shape + (3,))
+
+        self.assertTrue(np.array_equal(hs, self.zs) and np.array_equal(vs, self.xs))
+        self.assertEqual(fh.shape, (len(self.zs), len(self.xs)))
+        np.testing.assert_allclose(fh, F[...,2], atol=1e-12)
+        np.testing.assert_allclose(fv, F[...,0], atol=1e-12)
+
+        # The xy plane at the first z
+        hs, vs, fh, fv = plot2d.grid_slice(self.xs, self.ys, self.zs, self.grid, 0, 1)
+        xx, yy = np.meshgrid(self.xs, self.ys, indexing='ij')
+        F = field(np.column_stack([xx.flatten(), yy.flatten(), np.full(xx.size, -2.0)])).reshape(xx.shape + (3,))
+
+        self.assertTrue(np.array_equal(hs, self.xs) and np.array_equal(vs, self.ys))
+        np.testing.assert_allclose(fh, F[...,0], atol=1e-12)
+        np.testing.assert_allclose(fv, F[...,1], atol=1e-12)
+
+    def test_resample(self):
+        hs, vs, fh, fv = plot2d.grid_slice(self.xs, self.ys, self.zs, self.grid, 2, 0)
+
+        # At most 6 points along z (which had 9), and all the 5 along x
+        hi, vi, rh, rv = plot2d.resample(hs, vs, fh, fv, 6)
+        self.assertTrue(np.allclose(hi, np.linspace(-2, 2, 6)) and np.allclose(vi, self.xs))
+
+        zz, xx = np.meshgrid(hi, vi, indexing='ij')
+        F = field(np.column_stack([xx.flatten(), np.zeros(xx.size), zz.flatten()])).reshape(zz.shape + (3,))
+        np.testing.assert_allclose(rh, F[...,2], atol=1e-9)
+        np.testing.assert_allclose(rv, F[...,0], atol=1e-9)
+
+    def test_scattered_slice(self):
+        # Random positions on two planes of constant y
+        rs = np.random.RandomState(0)
+        positions = np.column_stack([rs.uniform(-1, 1, 200), rs.choice([0.0, 1.0], 200), rs.uniform(-2, 2, 200)])
+        positions[:8] = [[x, y, z] for x in (-1, 1) for y in (0, 1) for z in (-2, 2)]
+
+        hs, vs, fh, fv = plot2d.scattered_slice(positions, field(positions), 2, 0, at=0.9, n=11)
+        self.assertTrue(np.allclose(hs, np.linspace(-2, 2, 11)) and np.allclose(vs, np.linspace(-1, 1, 11)))
+
+        zz, xx = np.meshgrid(hs, vs, indexing='ij')
+        F = field(np.column_stack([xx.flatten(), np.ones(xx.size), zz.flatten()])).reshape(zz.shape + (3,))
+        np.testing.assert_allclose(fh, F[...,2], atol=1e-9)
+        np.testing.assert_allclose(fv, F[...,0], atol=1e-9)
+
+    def test_main(self):
+        import matplotlib
+        matplotlib.use("Agg")
+
+        with tempfile.TemporaryDirectory() as d:
+            positions = sweep.grid_positions(self.xs, self.ys, self.zs[::-1])
+            forces = field(positions)
+
+            # A regular grid in both formats (with a descending axis), and scattered positions
+            files = []
+            for name in ("grid.npz", "grid.tsv"):
+                files.append(os.path.join(d, name))
+                results.save_grid(files[-1], self.xs, self.ys, self.zs[::-1], forces)
+            files.append(os.path.join(d, "scattered.tsv"))
+            results.save_scattered(files[-1], positions[1:], forces[1:])
+
+            for i, filename in enumerate(files):
+                for options in ([], ["--plane", "zy", "--mirror", "--style", "quiver", "--at", "0.5"]):
+                    out = os.path.join(d, "{0}-{1}.png".format(i, len(options)))
+                    plot2d.main([filename, "--out", out, "--resolution", "20"] + options)
+                    self.assertTrue(os.path.getsize(out) > 0)
+
+class MirrorTestCase(unittest.TestCase):
+    def test_mirror(self):
+        hs = np.array([0., 1.])
+        fh = np.array([[1., 2., 3.], [4., 5., 6.]])
+        fv = 10*fh
+
+        # v = 0 is not repeated, and the v component changes its sign
+        _, vs, mfh, mfv = plot2d.mirror(hs, np.array([0., 1., 2.]), fh, fv)
+        self.assertTrue(np.array_equal(vs, [-2, -1, 0, 1, 2]))
+        self.assertTrue(np.array_equal(mfh, [[3, 2, 1, 2, 3], [6, 5, 4, 5, 6]]))
+        self.assertTrue(np.array_equal(mfv, [[-30, -20, 10, 20, 30], [-60, -50, 40, 50, 60]]))
+
+        # Without v = 0, all of them are mirrored
+        _, vs, mfh, _ = plot2d.mirror(hs, np.array([1., 2., 3.]), fh, fv)
+        self.assertTrue(np.array_equal(vs, [-3, -2, -1, 1, 2, 3]))
+        self.assertTrue(np.array_equal(mfh, [[3, 2, 1, 1, 2, 3], [6, 5, 4, 4, 5, 6]]))
+
+        # Negative values would overlap the image
+        with self.assertRaises(ValueError):
+            plot2d.mirror(hs, np.array([-1., 0., 1.]), fh, fv)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# Testing rig
+import unittest
+
+import io
+import json
+import os
+import signal
+import tempfile
+
+# Modules to test
+import progress
+import sweep
+
+# Auxiliary
+import config
+import numpy as np
+
+class ProgressTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cfg = sweep.configure(config, rsteps=20, thsteps=20, engine="serial", memory_budget=None, chunk_positions=2)
+        self.opt = sweep.make_system(self.cfg)
+        self.positions = np.array([[0, 0, z] for z in np.linspace(-1, 1, 7)])
+        
+    def test_chunked_matches_compute_forces(self):
+        for engine in ("serial", "batched"):
+            cfg = sweep.configure(self.cfg, engine=engine)
+            forces, done = sweep.compute_forces_chunked(self.opt, self.positions, cfg)
+            
+            self.assertEqual(done, len(self.positions))
+            np.testing.assert_allclose(forces, sweep.compute_forces(self.opt, self.positions, cfg), rtol=1e-9, atol=1e-12)
+            
+    def test_reporter(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            metrics = os.path.join(tmp, "metrics.jsonl")
+            out = io.StringIO()
+            
+            # Report after every chunk
+            reporter = progress.ProgressReporter(len(self.positions), 400, interval=0, metrics_file=metrics, stream=out)
+            forces, done = sweep.compute_forces_chunked(self.opt, self.positions, self.cfg, reporter)
+            reporter.close()
+            
+            with open(metrics) as f:
+                records = [json.loads(line) for line in f]
+                
+        # 4 chunks and the final record
+        self.assertEqual([r["done"] for r in records], [2, 4, 6, 7, 7])
+        self.assertEqual(records[-1]["event"], "finished")
+        self.assertEqual(records[-1]["eta"], 0)
+        self.assertAlmostEqual(records[-1]["rays_per_second"], 400*records[-1]["positions_per_second"])
+        self.assertEqual(len(out.getvalue().splitlines()), 5)
+        
+    def test_stop(self):
+        # A stop requested during the first chunk: the chunk is finished and the rest is left undone
+        stop = progress.GracefulStop()
+        
+        class Reporter(object):
+            def update(self, n):
+                stop.requested = signal.SIGINT
+                
+        forces, done = sweep.compute_forces_chunked(self.opt, self.positions, self.cfg, Reporter(), stop)
+        
+        self.assertEqual(done, 2)
+        self.assertFalse(np.any(np.isnan(forces[:2])))
+        self.assertTrue(np.all(np.isnan(forces[2:])))
+        
+    def test_signal(self):
+        previous = signal.getsignal(signal.SIGTERM)
+        
+        with progress.GracefulStop() as stop:
+            os.kill(os.getpid(), signal.SIGTERM)
+            self.assertEqual(stop.requested, signal.SIGTERM)
+            
+        # The previous handler is restored
+        self.assertEqual(signal.getsignal(signal.SIGTERM), previous)
+        
+if __name__ == '__main__':
+    unittest.main()
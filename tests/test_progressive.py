@@ -0,0 +1,67 @@
+# Testing rig
+import unittest
+
+# Modules to test
+import progressive
+
+# Auxiliary
+import numpy as np
+
+# A force that depends on the number of rays (so that it can be checked which positions were evaluated with which rays)
+def fake_forces(positions, rsteps, thsteps):
+    return positions + rsteps*thsteps, len(positions)
+
+class ProgressiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.xs = np.linspace(0, 1, 9)
+        self.ys = np.array([0])
+        self.zs = np.linspace(-1, 1, 10)
+        
+    def test_schedule(self):
+        self.assertEqual(progressive.schedule(4, 200, 100), [(8, 50, 25), (4, 100, 50), (2, 200, 100), (1, 200, 100)])
+        self.assertEqual(progressive.schedule(1, 200, 100), [(1, 200, 100)])
+        
+        # Never fewer than min_steps (nor more than the full steps)
+        self.assertEqual(progressive.schedule(3, 10, 4)[0], (4, progressive.min_steps, 4))
+        
+    def test_subgrid_indices(self):
+        self.assertEqual(list(progressive.subgrid_indices(10, 4)), [0, 4, 8, 9])
+        self.assertEqual(list(progressive.subgrid_indices(9, 4)), [0, 4, 8])
+        self.assertEqual(list(progressive.subgrid_indices(1, 4)), [0])
+        
+    def test_run(self):
+        published = []
+        sweeper = progressive.ProgressiveSweep(self.xs, self.ys, self.zs, 3, 20, 20)
+        
+        self.assertTrue(sweeper.run(fake_forces, lambda n, settings, xs, ys, zs, grid: published.append((settings, xs, zs, grid))))
+        
+        # The passes get finer and the last one is the full grid, evaluated with the full rays
+        self.assertEqual([len(p[1]) for p in published], [3, 5, 9])
+        self.assertEqual([len(p[2]) for p in published], [4, 6, 10])
+        
+        xx, yy, zz = np.meshgrid(self.xs, self.ys, self.zs, indexing='ij')
+        self.assertTrue(np.array_equal(sweeper.grid(), np.stack([xx, yy, zz], axis=-1) + 400))
+        self.assertTrue(np.array_equal(published[-1][3], sweeper.grid()))
+        
+        # The positions of the second pass (which already has the full rays) are reused by the last one
+        self.assertEqual(sweeper.evaluations, 3*4 + 5*6 + 9*10 - 5*6)
+        
+    def test_interrupted(self):
+        published = []
+        calls = []
+        
+        def forces(positions, rsteps, thsteps):
+            calls.append(len(positions))
+            F, done = fake_forces(positions, rsteps, thsteps)
+            
+            # Stop in the middle of the second pass
+            return F, done if len(calls) < 2 else 7
+        
+        sweeper = progressive.ProgressiveSweep(self.xs, self.ys, self.zs, 3, 20, 20)
+        
+        self.assertFalse(sweeper.run(forces, lambda *args: published.append(args)))
+        self.assertEqual(len(published), 1)
+        self.assertEqual(sweeper.evaluations, 3*4 + 7)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# Testing rig
+import unittest
+
+import os
+import tempfile
+
+# Modules to test
+import results
+import sweep
+
+# Auxiliary
+import numpy as np
+
+class ResultsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.xs = np.linspace(0, 1, 4)
+        self.ys = np.array([0.5])
+        self.zs = np.linspace(-2, 2, 5)
+        self.positions = sweep.grid_positions(self.xs, self.ys, self.zs)
+        self.forces = np.array([[1, 2, 3]]) * self.positions + np.array([[0, 0, 1]])
+        
+        self.dir = tempfile.TemporaryDirectory()
+        
+    def tearDown(self):
+        self.dir.cleanup()
+        
+    def check_grid(self, filename):
+        results.save_grid(filename, self.xs, self.ys, self.zs, self.forces)
+        xs, ys, zs, grid = results.load_grid(filename)
+        
+        self.assertTrue(np.allclose(xs, self.xs) and np.allclose(ys, self.ys) and np.allclose(zs, self.zs))
+        self.assertEqual(grid.shape, (4, 1, 5, 3))
+        
+        # The grid is indexed by (x, y, z)
+        self.assertTrue(np.allclose(grid[2,0,3], [1*self.xs[2], 2*self.ys[0], 3*self.zs[3] + 1]))
+        
+    def test_grid_tsv(self):
+        self.check_grid(os.path.join(self.dir.name, "res.tsv"))
+        
+    def test_grid_structured(self):
+        self.check_grid(os.path.join(self.dir.name, "res.npz"))
+        
+    def test_scattered_not_grid(self):
+        # Removing a position breaks the grid
+        with self.assertRaises(ValueError):
+            results.to_grid(self.positions[1:], self.forces[1:])
+            
+    def test_shuffled_grid(self):
+        # The order of the rows doesn't matter
+        order = np.random.RandomState(0).permutation(len(self.positions))
+        xs, ys, zs, grid = results.to_grid(self.positions[order], self.forces[order])
+        
+        self.assertTrue(np.allclose(grid[1,0,4], self.forces[np.all(self.positions == [xs[1], ys[0], zs[4]], axis=1)][0]))
+        
+    def test_replace_grid(self):
+        # A grid given as an (nx, ny, nz, 3) array, written through a temporary file
+        filename = os.path.join(self.dir.name, "res.npz")
+        xs, ys, zs, grid = results.to_grid(self.positions, self.forces)
+        results.replace_grid(filename, xs, ys, zs, grid)
+        
+        self.assertEqual(os.listdir(self.dir.name), ["res.npz"])
+        self.assertTrue(np.allclose(results.load_grid(filename)[3], grid))
+        
+    def test_descending_axes(self):
+        # A sweep from a bigger start to a smaller stop
+        xs, zs = self.xs[::-1], self.zs[::-1]
+        forces = np.array([[1, 2, 3]]) * sweep.grid_positions(xs, self.ys, zs) + np.array([[0, 0, 1]])
+        
+        for name in ("desc.tsv", "desc.npz"):
+            filename = os.path.join(self.dir.name, name)
+            results.save_grid(filename, xs, self.ys, zs, forces)
+            
+            # Always loaded in increasing order, with the forces where they belong
+            lxs, lys, lzs, grid = results.load_grid(filename)
+            self.assertTrue(np.allclose(lxs, self.xs) and np.allclose(lzs, self.zs))
+            self.assertTrue(np.allclose(grid[2,0,3], [1*self.xs[2], 2*self.ys[0], 3*self.zs[3] + 1]))
+            
+        # Also for files written with the axes in any order
+        filename = os.path.join(self.dir.name, "old.npz")
+        grid = results.to_grid(self.positions, self.forces)[3]
+        np.savez(filename, xs=xs, ys=self.ys, zs=self.zs, forces=grid[::-1])
+        self.assertTrue(np.array_equal(results.load_grid(filename)[3], grid))
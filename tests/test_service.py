@@ -0,0 +1,119 @@
+# Testing rig
+import unittest
+
+import asyncio
+import os
+import tempfile
+import threading
+
+# Modules to test
+import service
+
+# Auxiliary
+import config
+import sweep
+import numpy as np
+
+class ServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "service.sock")
+        
+        # Run the service in its own thread (with a long coalescing window, so that concurrent requests are coalesced for sure)
+        self.loop = asyncio.new_event_loop()
+        self.svc = service.ForceService(config, window=0.2)
+        self.server = self.loop.run_until_complete(self.svc.start(path=self.path))
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        
+        self.settings = {'rsteps': 30, 'thsteps': 40, 'NA': 0.9, 'int_pol_arguments': {'a': 1.2, 'p': np.array([1, 1j])}}
+        
+    def tearDown(self):
+        async def shutdown():
+            self.server.close()
+            await self.svc.close()
+            
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(timeout=10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.dir.cleanup()
+        
+    def expected(self, positions):
+        cfg = sweep.configure(config, **self.settings)
+        
+        return sweep.compute_forces(sweep.make_system(cfg), positions, cfg)
+        
+    def test_forces(self):
+        client = service.ForceClient(path=self.path)
+        positions = np.array([[0, 0, 0.5], [0.3, 0, 0.5], [0, 0.7, -0.2]])
+        
+        F = client.forces(positions, **self.settings)
+        client.close()
+        
+        self.assertTrue(np.allclose(F, self.expected(positions), rtol=0, atol=1e-10))
+        
+    def test_coalescing(self):
+        # Concurrent requests from several clients are evaluated together
+        positions = [np.array([[0, 0, z]]) for z in np.linspace(-1, 1, 6)]
+        forces = [None]*len(positions)
+        
+        def request(i):
+            client = service.ForceClient(path=self.path)
+            forces[i] = client.forces(positions[i], **self.settings)
+            client.close()
+            
+        threads = [threading.Thread(target=request, args=(i,)) for i in range(len(positions))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+            
+        self.assertTrue(np.allclose(np.vstack(forces), self.expected(np.vstack(positions)), rtol=0, atol=1e-10))
+        
+        client = service.ForceClient(path=self.path)
+        stats = client.stats()
+        client.close()
+        
+        self.assertEqual(stats['requests'], len(positions))
+        self.assertLess(stats['evaluations'], len(positions))
+        
+    def test_error(self):
+        client = service.ForceClient(path=self.path)
+        
+        with self.assertRaises(RuntimeError):
+            client.forces([[0, 0, 0]], NA=0.9, int_pol_function='no_such_profile')
+        client.close()
+        
+    def test_system_error(self):
+        # The system of a configuration is built outside of the event loop, and if it fails, the request fails (and the next ones try again)
+        client = service.ForceClient(path=self.path)
+        
+        with self.assertRaises(RuntimeError):
+            client.forces([[0, 0, 0]], nr=-1)
+        with self.assertRaises(RuntimeError):
+            client.forces([[0, 0, 0]], nr=-1)
+            
+        F = client.forces([[0, 0, 0.5]], **self.settings)
+        client.close()
+        
+        self.assertTrue(np.allclose(F, self.expected(np.array([[0, 0, 0.5]])), rtol=0, atol=1e-10))
+        
+    def test_system_in_executor(self):
+        threads = []
+        make_system = sweep.make_system
+        
+        def recording(cfg):
+            threads.append(threading.current_thread())
+            return make_system(cfg)
+            
+        sweep.make_system = recording
+        try:
+            client = service.ForceClient(path=self.path)
+            client.forces([[0, 0, 0.5]], **self.settings)
+            client.close()
+        finally:
+            sweep.make_system = make_system
+            
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], self.thread)
@@ -0,0 +1,127 @@
+# Testing rig
+import unittest
+
+import os
+import tempfile
+
+# Modules to test
+import shards
+
+# Auxiliary
+import config
+import results
+import run
+import sweep
+import numpy as np
+
+class ShardsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+        self.cfg = sweep.configure(config, rsteps=16, thsteps=16, engine="batched", progress_interval=None,
+                                   xstart=0, xstop=1.5, xsteps=7, ystart=0, ystop=0, zstart=-2, zstop=2, zsteps=9,
+                                   out_file=os.path.join(self.tmp.name, "results.npz"))
+        self.positions = sweep.grid_positions(*sweep.grid_axes(self.cfg))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_shards(self, n, cfg=None):
+        cfg = self.cfg if cfg is None else cfg
+        opt = sweep.make_system(cfg)
+
+        for i in range(n):
+            self.assertTrue(run.run(cfg, opt, shard=(i, n)))
+
+        return [shards.shard_filename(cfg.out_file, i, n) for i in range(n)]
+
+    def test_parse_shard(self):
+        self.assertEqual(shards.parse_shard("0/4"), (0, 4))
+        self.assertEqual(shards.parse_shard("3/4"), (3, 4))
+
+        for text in ["4/4", "-1/4", "1/0", "1", "a/b", "1/2/3"]:
+            with self.assertRaises(ValueError):
+                shards.parse_shard(text)
+
+    def test_partition(self):
+        n = 4
+        parts = [shards.shard_indices(self.cfg, self.positions, i, n) for i in range(n)]
+
+        # Every position in exactly one shard
+        self.assertTrue(np.array_equal(np.sort(np.concatenate(parts)), np.arange(len(self.positions))))
+
+        # The same number of positions and about the same number of hits
+        hits = shards.hit_counts(self.cfg, self.positions)
+        self.assertLessEqual(max(len(p) for p in parts) - min(len(p) for p in parts), 1)
+        self.assertLess(np.ptp([np.sum(hits[p]) for p in parts]), np.max(hits))
+
+        # Deterministic
+        self.assertTrue(np.array_equal(shards.shard_indices(self.cfg, self.positions, 1, n), parts[1]))
+
+    def test_hit_counts(self):
+        hits = shards.hit_counts(self.cfg, np.array([[0, 0, 0], [0, 0, 0.5], [1.2, 0, 0], [5, 0, 0]]), rays=256)
+
+        # All the rays pass through the focus (so they all hit the particle when it contains the focus), and none close to a far particle
+        self.assertTrue(hits[0] > 150)
+        self.assertEqual(hits[0], hits[1])
+        self.assertTrue(0 < hits[2] < hits[0])
+        self.assertEqual(hits[3], 0)
+
+    def test_config_hash(self):
+        h = shards.config_hash(self.cfg)
+
+        self.assertEqual(shards.config_hash(sweep.configure(self.cfg, engine="serial", out_file="other.tsv", ray_layout="rows")), h)
+        self.assertEqual(shards.config_hash(sweep.configure(self.cfg, workers=4, memory_budget=2**20, adaptive=True, adaptive_tol=0.1, progressive=True, progressive_passes=2)), h)
+        self.assertNotEqual(shards.config_hash(sweep.configure(self.cfg, NA=0.9)), h)
+        self.assertNotEqual(shards.config_hash(sweep.configure(self.cfg, int_pol_arguments={'a': 1.0, 'p': np.array([1, 1j])})), h)
+
+    def test_merge_matches_full_sweep(self):
+        files = self.run_shards(3)
+
+        xs, ys, zs, grid, digest = shards.merge(files)
+        self.assertEqual(digest, shards.config_hash(self.cfg))
+
+        run.run(self.cfg, sweep.make_system(self.cfg))
+        full = results.load_grid(self.cfg.out_file)
+
+        for a, b in zip((xs, ys, zs, grid), full):
+            self.assertTrue(np.array_equal(a, b))
+
+    def test_merge_errors(self):
+        files = self.run_shards(3)
+
+        # Missing and repeated shards
+        with self.assertRaises(ValueError):
+            shards.merge(files[:2])
+        with self.assertRaises(ValueError):
+            shards.merge(files + [files[0]])
+
+        # A shard of another configuration
+        other = sweep.configure(self.cfg, nr=1.3, out_file=os.path.join(self.tmp.name, "other.npz"))
+        other_files = self.run_shards(3, other)
+        with self.assertRaises(ValueError):
+            shards.merge(files[:2] + other_files[2:])
+
+        # An incomplete shard
+        with np.load(files[1]) as data:
+            shard = {k: data[k] for k in data.files}
+        shard["done"] = 1
+        np.savez(files[1], **shard)
+        with self.assertRaises(ValueError):
+            shards.merge(files)
+
+    def test_not_shards(self):
+        files = self.run_shards(2)
+
+        # A result file, a text file and a missing one
+        run.run(self.cfg, sweep.make_system(self.cfg))
+        tsv = os.path.join(self.tmp.name, "results.tsv")
+        with open(tsv, "w") as f:
+            f.write("0\t0\t0\t1\t2\t3\n")
+
+        for name in [self.cfg.out_file, tsv, os.path.join(self.tmp.name, "missing.npz")]:
+            with self.assertRaises(ValueError):
+                shards.merge(files[:1] + [name])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,7 @@ import unittest
 import optical_system as osys
 
 # Auxiliary
+import beam_profiles as bp
 import numpy as np
 import numpy.linalg as npl
 
@@ -98,6 +99,24 @@ class OpticalSystemIntersectionTestCase(unittest.TestCase):
         angle = opt._intersection_angle()
         self.assertAlmostEqual(angle[0], np.pi/4)
         
+    def test_intersect_far_origin_near_focus(self):
+        # The rays start at the lens, very far from the sphere (like in the simple systems), and pass close to its center: the incidence angle must still be accurate close to normal incidence (the discriminant must not be calculated by subtracting the big squared distances to the lens)
+        f = 1e5
+        opt = osys.OpticalSystem(np.array([0, 0, f]), 1.0, 1.5)
+        
+        # Rays from points of the lens through points at distance b from the center, in the focal plane
+        b = np.array([1e-7, 1e-4, 0.5])
+        opt._o = np.array([[0.3*f, 0, 0], [-0.5*f, 0, 0], [0.8*f, 0, 0]])
+        l = np.column_stack([b, np.zeros(3), f*np.ones(3)]) - opt._o
+        opt._l = l/np.linalg.norm(l, axis=1).reshape(-1,1)
+        
+        # The distance between the ray and the center is b cos(angle of the ray with the focal plane)
+        expected = np.arcsin(b*opt._l[:,2])
+        
+        angle = opt._intersection_angle()
+        for a, e in zip(angle, expected):
+            self.assertAlmostEqual(a, e, places=8)
+        
     def test_intersect_invalid_radius(self):
         ## The system should not accept zero or negative sphere radiuses
         for R in [-1, 0]:
@@ -410,4 +429,274 @@ class TestIntegration(unittest.TestCase):
         res = np.apply_along_axis(check, axis=1, arr=data)
         t1 = dt.datetime.now()
         print(t1-t0)
-        self.assertLess(np.max(res), 0.006)
\ No newline at end of file
+        self.assertLess(np.max(res), 0.006)
+        
+## A system with a Gaussian beam and circular polarization, with the particle slightly off the focus (shared by the test cases below)
+class ArbitrarySystemTestCase(unittest.TestCase):
+    def setUp(self):
+        f = 1e-3
+        Rl = f * np.tan(np.arcsin(1.25/1.33))
+        rp = 5e-6
+        
+        p = np.array([1,1j,0])
+        
+        def gaussian_int_pol(r, th, Rl, **kwargs):
+            I = 2/(np.pi*Rl**2*(1 - np.exp(-2))) * np.exp(-2 * (r/Rl)**2)
+            pol = np.tile(p, (len(r), 1))
+            
+            return np.hstack([I.reshape(-1,1), pol])
+        
+        self.opt = osys.OpticalSystemSimpleArbitrary(np.array([0.3*rp, 0, 0.5*rp]), rp, 1.2, Rl, f, gaussian_int_pol)
+        
+## This class tests the memory-bounded (streaming) integration
+class TestStreamingIntegration(ArbitrarySystemTestCase):
+    def test_streaming_matches_integrate(self):
+        # Blocks of a few hundred rays (which don't fit evenly in the bundle) must give the same result as the whole bundle
+        Ft = self.opt.integrate(60, 70)
+        Fs = self.opt.integrate_streaming(60, 70, 333*osys.bytes_per_ray)
+        
+        self.assertTrue(np.allclose(Ft, Fs, rtol=0, atol=1e-12))
+        
+    def test_streaming_does_not_corrupt_cache(self):
+        # The blocks of rays must not be mistaken for the full bundle by a later integration
+        Ft = self.opt.integrate(60, 70)
+        self.opt.integrate_streaming(60, 70, 100*osys.bytes_per_ray)
+        
+        self.assertTrue(np.allclose(self.opt.integrate(60, 70), Ft, rtol=0, atol=1e-12))
+        
+    def test_compensated_add(self):
+        # Adding many small numbers to a big one loses them without compensation
+        s = np.array([1.0])
+        c = np.zeros(1)
+        for i in range(1000):
+            s, c = osys.compensated_add(s, c, np.array([1e-17]))
+        
+        self.assertEqual(s[0], 1)
+        self.assertTrue(np.isclose(c[0], 1e-14, rtol=1e-6, atol=0))
+        
+## This class tests the evaluation of many positions at once
+class TestIntegratePositions(ArbitrarySystemTestCase):
+    def test_positions_match_integrate(self):
+        rp = 5e-6
+        cs = rp*np.array([[0, 0, 0], [0.3, 0, 0.5], [0, -0.9, 1.1], [2, 0, 0], [0.1, 0.2, -0.4]])
+        
+        # In batches of two positions (which don't fit evenly) and all at once
+        Fb = self.opt.integrate_positions(cs, 40, 50, 2*40*50*osys.bytes_per_ray)
+        Fa = self.opt.integrate_positions(cs, 40, 50)
+        
+        for c, F1, F2 in zip(cs, Fb, Fa):
+            self.opt.set_particle_center(c)
+            F = self.opt.integrate(40, 50)
+            
+            self.assertTrue(np.allclose(F, F1, rtol=0, atol=1e-10))
+            self.assertTrue(np.allclose(F, F2, rtol=0, atol=1e-10))
+            
+    def test_change_of_steps(self):
+        # The rays must be generated again when the number of steps changes
+        F1 = self.opt.integrate(40, 50)
+        self.opt.integrate(30, 20)
+        
+        self.assertTrue(np.allclose(self.opt.integrate_positions([[0.3*5e-6, 0, 0.5*5e-6]], 40, 50)[0], F1, rtol=0, atol=1e-12))
+        
+## This class tests the quadrature rules for integrating over the lens
+class TestQuadrature(ArbitrarySystemTestCase):
+    def test_rules_agree(self):
+        # All the rules converge to the same value (the rectangle rule slowly and with a bias of about 1/thsteps)
+        self.opt.set_quadrature("gauss")
+        Fg = np.real(self.opt.integrate(80, 80))
+        
+        self.opt.set_quadrature("midpoint")
+        Fm = np.real(self.opt.integrate(160, 160))
+        
+        self.opt.set_quadrature("rectangle")
+        Fr = np.real(self.opt.integrate(400, 400))
+        
+        self.assertTrue(np.allclose(Fg, Fm, rtol=0, atol=1e-4))
+        self.assertTrue(np.allclose(Fg, Fr, rtol=0, atol=3e-3))
+        
+    def test_rule_change_regenerates_rays(self):
+        self.opt.set_quadrature("gauss")
+        Fg = self.opt.integrate(40, 40)
+        self.opt.set_quadrature("midpoint")
+        self.opt.integrate(40, 40)
+        self.opt.set_quadrature("gauss")
+        
+        self.assertTrue(np.allclose(self.opt.integrate(40, 40), Fg, rtol=0, atol=1e-12))
+        
+    def test_invalid_rule(self):
+        with self.assertRaises(ValueError):
+            self.opt.set_quadrature("simpson")
+        
+## This class tests changing the beam of an existing system
+class TestSetBeam(ArbitrarySystemTestCase):
+    def test_set_beam(self):
+        # Changing the beam of a system must give the same result as a new system with that beam
+        f = 1e-3
+        Rl = f * np.tan(np.arcsin(1.25/1.33))
+        rp = 5e-6
+        
+        import beam_profiles as bp
+        
+        self.opt.integrate(40, 40)
+        self.opt.set_beam(bp.donut_fixed, a=1.1, p=np.array([0, 1]))
+        
+        opt = osys.OpticalSystemSimpleArbitrary(np.array([0.3*rp, 0, 0.5*rp]), rp, 1.2, Rl, f, bp.donut_fixed, a=1.1, p=np.array([0, 1]))
+        
+        self.assertTrue(np.allclose(self.opt.integrate(40, 40), opt.integrate(40, 40), rtol=0, atol=1e-12))
+        
+## This class tests the component (structure-of-arrays) layout of the rays
+class TestRayLayout(ArbitrarySystemTestCase):
+    def test_ray_forces_match(self):
+        # The forces of every ray (including the ones that miss the sphere, which is far enough from the focus for some of them) must be the same in both layouts
+        self.opt.set_particle_center(5e-6*np.array([1.5, 0, 0]))
+        self.opt.integrate(30, 40)
+        rows = self.opt._ray_force(self.opt._p)
+        
+        self.opt.set_ray_layout("components")
+        self.opt.integrate(30, 40)
+        components = self.opt._ray_force(self.opt._p)
+        
+        self.assertEqual(components.shape, (3, 30*40))
+        self.assertTrue(np.any(np.all(rows == 0, axis=1)))
+        self.assertTrue(np.allclose(components.transpose(), rows, rtol=0, atol=1e-12))
+        
+    def test_integrals_match(self):
+        rp = 5e-6
+        cs = rp*np.array([[0, 0, 0], [0.3, 0, 0.5], [0, -0.9, 1.1], [2, 0, 0]])
+        
+        Ft = self.opt.integrate(40, 50)
+        Fs = self.opt.integrate_streaming(40, 50, 333*osys.bytes_per_ray)
+        Fp = self.opt.integrate_positions(cs, 40, 50, 3*40*50*osys.bytes_per_ray)
+        
+        self.opt.set_ray_layout("components")
+        
+        self.assertTrue(np.allclose(self.opt.integrate(40, 50), Ft, rtol=0, atol=1e-12))
+        self.assertTrue(np.allclose(self.opt.integrate_streaming(40, 50, 333*osys.bytes_per_ray), Fs, rtol=0, atol=1e-12))
+        self.assertTrue(np.allclose(self.opt.integrate_positions(cs, 40, 50, 3*40*50*osys.bytes_per_ray), Fp, rtol=0, atol=1e-12))
+        
+        # And back
+        self.opt.set_ray_layout("rows")
+        self.assertTrue(np.allclose(self.opt.integrate(40, 50), Ft, rtol=0, atol=1e-12))
+        
+    def test_invalid_layout(self):
+        with self.assertRaises(ValueError):
+            self.opt.set_ray_layout("columns")
+        
+## This class tests the analytic Jacobian of the force with respect to the center of the particle
+class TestJacobian(ArbitrarySystemTestCase):
+    def numeric_jacobian(self, c, h, rsteps, thsteps):
+        J = np.zeros((3, 3))
+        
+        for j in range(3):
+            dc = np.zeros(3)
+            dc[j] = h
+            
+            self.opt.set_particle_center(c + dc)
+            Fp = np.real(self.opt.integrate(rsteps, thsteps))
+            self.opt.set_particle_center(c - dc)
+            Fm = np.real(self.opt.integrate(rsteps, thsteps))
+            
+            J[:,j] = (Fp - Fm)/(2*h)
+        
+        return J
+        
+    def test_matches_finite_differences(self):
+        # With Gauss quadrature, the integral is smooth enough in the center for central differences to be accurate
+        self.opt.set_quadrature("gauss")
+        rp = 5e-6
+        c = rp*np.array([0.3, -0.2, 0.6])
+        
+        for layout in osys.ray_layouts:
+            self.opt.set_ray_layout(layout)
+            Jn = self.numeric_jacobian(c, 1e-5*rp, 60, 60)
+            
+            self.opt.set_particle_center(c)
+            F, J = self.opt.integrate(60, 60, jacobian=True)
+            
+            self.assertEqual(J.shape, (3, 3))
+            self.assertTrue(np.allclose(F, self.opt.integrate(60, 60), rtol=0, atol=1e-14))
+            self.assertTrue(np.allclose(J, Jn, rtol=0, atol=1e-5*np.max(np.abs(Jn))))
+            
+    def test_positions_match_integrate(self):
+        rp = 5e-6
+        cs = rp*np.array([[0, 0, 0], [0.3, 0, 0.5], [0, -0.9, 1.1], [2, 0, 0]])
+        
+        for layout in osys.ray_layouts:
+            self.opt.set_ray_layout(layout)
+            Ft, Jt = self.opt.integrate_positions(cs, 30, 40, 3*30*40*osys.bytes_per_ray, jacobian=True)
+            
+            self.assertEqual(Jt.shape, (len(cs), 3, 3))
+            for c, Fc, Jc in zip(cs, Ft, Jt):
+                self.opt.set_particle_center(c)
+                F, J = self.opt.integrate(30, 40, jacobian=True)
+                
+                self.assertTrue(np.allclose(Fc, F, rtol=0, atol=1e-14))
+                self.assertTrue(np.allclose(Jc, J, rtol=0, atol=1e-12*np.max(np.abs(J))))
+        
+## This class tests the integration of several beams at once
+class TestSeveralBeams(ArbitrarySystemTestCase):
+    def setUp(self):
+        super().setUp()
+        
+        self.a = np.array([0.6, 0.9, 1.3, 1.1])
+        self.phi = np.array([0, np.pi/4, np.pi/2, 1.0])
+        self.opt.set_beam(bp.laguerre_gauss, a=self.a, l=1, phi=self.phi)
+        self.opt.set_ray_layout("components")
+        
+    # The same system with only the beam k
+    def single(self, k):
+        self.opt.set_beam(bp.laguerre_gauss, a=self.a[k], l=1, phi=self.phi[k])
+        
+    def test_integrals_match(self):
+        rp = 5e-6
+        cs = rp*np.array([[0, 0, 0], [0.3, 0, 0.5], [2, 0, 0]])
+        
+        F, J = self.opt.integrate(30, 40, jacobian=True)
+        Fs = self.opt.integrate_streaming(30, 40, 333*osys.bytes_per_ray)
+        Fp, Jp = self.opt.integrate_positions(cs, 30, 40, 2*30*40*osys.bytes_per_ray, jacobian=True)
+        
+        self.assertEqual((F.shape, J.shape, Fs.shape, Fp.shape, Jp.shape), ((4, 3), (4, 3, 3), (4, 3), (3, 4, 3), (3, 4, 3, 3)))
+        
+        for k in range(len(self.a)):
+            self.single(k)
+            Fk, Jk = self.opt.integrate(30, 40, jacobian=True)
+            Fpk, Jpk = self.opt.integrate_positions(cs, 30, 40, jacobian=True)
+            
+            self.assertTrue(np.allclose(F[k], Fk, rtol=0, atol=1e-14))
+            self.assertTrue(np.allclose(J[k], Jk, rtol=0, atol=1e-12*np.max(np.abs(Jk))))
+            self.assertTrue(np.allclose(Fs[k], Fk, rtol=0, atol=1e-14))
+            self.assertTrue(np.allclose(Fp[:,k], Fpk, rtol=0, atol=1e-14))
+            self.assertTrue(np.allclose(Jp[:,k], Jpk, rtol=0, atol=1e-12*np.max(np.abs(Jpk))))
+            
+    def test_rows_layout(self):
+        self.opt.set_ray_layout("rows")
+        
+        with self.assertRaises(ValueError):
+            self.opt.integrate(30, 40)
+        
+## This class checks the memory per ray used to size the blocks and batches of rays (optical_system.bytes_per_ray) against the peak memory of the force calculation, measured with tracemalloc
+class TestMemoryPerRay(ArbitrarySystemTestCase):
+    def peak(self, fun):
+        import tracemalloc
+        
+        tracemalloc.start()
+        try:
+            fun()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    
+    def test_bytes_per_ray(self):
+        n = 0
+        for layout in ("rows", "components"):
+            for rule in ("rectangle", "midpoint", "gauss"):
+                self.opt.set_ray_layout(layout)
+                self.opt.set_quadrature(rule)
+                
+                # A new bundle every time (generating the rays is the worst case)
+                n += 1
+                rsteps, thsteps = 100 + n, 100
+                self.assertLessEqual(self.peak(lambda: self.opt.integrate(rsteps, thsteps)), rsteps*thsteps*osys.bytes_per_ray)
+                
+                cs = np.array([[0.1*i, 0, 0.5] for i in range(4)])*5e-6
+                self.assertLessEqual(self.peak(lambda: self.opt.integrate_positions(cs, rsteps, thsteps)), len(cs)*rsteps*thsteps*osys.bytes_per_ray)
@@ -0,0 +1,77 @@
+# Testing rig
+import unittest
+
+# Modules to test
+import trap
+
+# Auxiliary
+import config
+import design
+import sweep
+import numpy as np
+
+class TrapTestCase(unittest.TestCase):
+    def test_fan_directions(self):
+        u = trap.fan_directions(50)
+        
+        np.testing.assert_allclose(np.linalg.norm(u, axis=1), 1)
+        # Evenly spread: the mean is close to zero
+        self.assertLess(np.linalg.norm(np.mean(u, axis=0)), 0.05)
+        
+    def test_equilibrium(self):
+        K = np.array([[2, 0.5, 0], [0.5, 1, 0], [0, 0, 3]])
+        a = np.array([0.1, -0.2, 0.3])
+        
+        x = trap.find_equilibrium(lambda p: -(p - a) @ K.transpose(), [0, 0, 0], h=1e-3)
+        np.testing.assert_allclose(x, a, atol=1e-12)
+        
+    def test_axial_guess(self):
+        zs = np.linspace(-2, 2, 9)
+        
+        # Only the change from pushing forward to pulling back is stable (the first one, linearly interpolated)
+        fun = lambda p: np.column_stack([p[:,0], p[:,1], np.cos(2*p[:,2])])
+        np.testing.assert_allclose(trap.axial_guess(fun, zs), [0, 0, 0.5 + 0.5*np.cos(1)/(np.cos(1) - np.cos(2))])
+        
+        self.assertIsNone(trap.axial_guess(lambda p: p + 1, zs))
+        
+    def test_escape_search(self):
+        # A force that stops being restoring at a distance of 1 in every direction: the restoring force is s - s^3, with its maximum 2/(3*sqrt(3)) at s = 1/sqrt(3), and the barrier is 1/4
+        force = lambda p: -p*(1 - np.sum(p**2, axis=1))[:,None]
+        r = trap.escape_search(force, np.zeros(3), trap.fan_directions(10), 2.0, samples=20, levels=4)
+        
+        np.testing.assert_allclose(r["escape_force"], 2/(3*np.sqrt(3)), rtol=1e-3)
+        np.testing.assert_allclose(r["escape_distance"], 1/np.sqrt(3), rtol=2e-2)
+        np.testing.assert_allclose(r["exit_distance"], 1, rtol=1e-4)
+        np.testing.assert_allclose(r["barrier"], 0.25, rtol=1e-2)
+        
+    def test_weakest_direction(self):
+        # Anisotropic trap, weakest along x: the barrier along u is (u.K.u)*w^2
+        K = np.diag([1.0, 2.0, 3.0])
+        w = 0.5
+        force = lambda p: -(p @ K)*np.exp(-np.sum(p**2, axis=1)/(2*w**2))[:,None]
+        
+        directions = np.vstack([np.eye(3), -np.eye(3), trap.fan_directions(20)])
+        r = trap.escape_search(force, np.zeros(3), directions, 10*w, samples=200, levels=2)
+        
+        self.assertAlmostEqual(abs(r["weakest_direction"][0]), 1)
+        self.assertAlmostEqual(r["depth"], w**2, places=4)
+        self.assertAlmostEqual(r["min_escape_force"], w*np.exp(-0.5), places=4)
+        self.assertEqual(r["evaluations"], len(directions)*(200 + 2*2*6))
+        
+    def test_trap_depth(self):
+        # A standard trap: the weakest direction is along the beam (the scattering force pushes the particle out), and its depth is close to the axial one
+        cfg = sweep.configure(config, rsteps=20, thsteps=20, quadrature="gauss")
+        opt = sweep.make_system(cfg)
+        zs = np.linspace(-1.5, 2, 15)
+        
+        r = trap.trap_depth(opt, cfg, zs, directions=30)
+        axial = design.trap_metrics(opt, cfg, np.linspace(-1.5, 2, 141))
+        
+        self.assertAlmostEqual(r["equilibrium"][2], axial["equilibrium"], places=4)
+        self.assertLess(np.linalg.norm(r["equilibrium"][:2]), 1e-4)
+        self.assertGreater(r["weakest_direction"][2], 0.9)
+        self.assertGreater(r["depth"], 0)
+        self.assertLess(r["depth"], 1.2*axial["trap_depth"])
+        
+if __name__ == '__main__':
+    unittest.main()
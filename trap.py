@@ -0,0 +1,203 @@
+# Trap depth and escape force finder.
+# Starting from the (3D) equilibrium of the particle, a fan of directions is fired and the force is sampled along every direction (all the directions at once, in a single batched evaluation per step). For every direction:
+# - the escape force is the maximum restoring force (the component of the force against the direction), located adaptively by refining the samples around the maximum a few times
+# - the barrier is the integral of the restoring force from the equilibrium until the force stops being restoring (the work needed to pull the particle out of the trap along that direction, in units of Q times the units of the positions)
+# The depth of the trap is the smallest barrier, and the direction where it's found is the weakest escape direction. This takes a few thousand positions instead of the hundreds of thousands of a full 3D force map.
+#
+# Usage example: python3 trap.py --directions 100 --distance 3 --out escape.tsv
+# All the other settings (particle, beam, rays...) are taken from "config.py".
+import argparse
+
+import numpy as np
+
+import sweep
+
+# Returns n directions (an (n,3) array of unit vectors) spread evenly over the sphere (a Fibonacci lattice)
+def fan_directions(n):
+    k = np.arange(n) + 0.5
+    cos_polar = 1 - 2*k/n
+    sin_polar = np.sqrt(1 - cos_polar**2)
+    azimuth = np.pi*(1 + np.sqrt(5))*k
+
+    return np.column_stack([sin_polar*np.cos(azimuth), sin_polar*np.sin(azimuth), cos_polar])
+
+# Finds the equilibrium of the particle, i.e. the position where the force vanishes, with Newton's method (the Jacobian is found by central differences with step h, in a single batched evaluation with the force on the current point).
+# force_fun takes an (M,3) array of positions and returns the (M,3) array of forces on them. guess is the starting point. Raises RuntimeError if it doesn't converge
+def find_equilibrium(force_fun, guess, h, tol=1e-9, max_step=None, max_iter=50):
+    x = np.array(guess, dtype=float)
+    offsets = h*np.vstack([np.eye(3), -np.eye(3)])
+
+    for _ in range(max_iter):
+        F = force_fun(np.vstack([x, x + offsets]))
+        J = (F[1:4] - F[4:7]).transpose()/(2*h)
+
+        if np.max(np.abs(F[0])) < tol:
+            return x
+
+        step = -np.linalg.lstsq(J, F[0], rcond=None)[0]
+
+        # Damping, since the force is far from linear away from the equilibrium
+        if max_step is not None and np.linalg.norm(step) > max_step:
+            step *= max_step/np.linalg.norm(step)
+
+        x = x + step
+
+    raise RuntimeError("The equilibrium was not found (the force is still {0} at {1})".format(F[0], x))
+
+# Returns a starting point for find_equilibrium: the stable equilibrium on the beam axis (where the axial force changes from pushing forward to pulling back), sampled at the axial positions zs. Returns None if there is none
+def axial_guess(force_fun, zs):
+    Fz = force_fun(np.column_stack([np.zeros(len(zs)), np.zeros(len(zs)), zs]))[:,2]
+
+    k = sweep.axial_sign_change(Fz)
+    if k is None:
+        return None
+
+    # Linear interpolation between the samples around the sign change
+    z = zs[k] + (zs[k+1] - zs[k])*Fz[k]/(Fz[k] - Fz[k+1])
+
+    return np.array([0, 0, z])
+
+# Samples the restoring force along the directions (an (n,3) array) from the equilibrium x0 at the distances of every row of s (an (n,m) array), in a single evaluation
+def _restoring(force_fun, x0, directions, s):
+    positions = x0 + s[:,:,None]*directions[:,None,:]
+    F = force_fun(positions.reshape(-1, 3)).reshape(s.shape + (3,))
+
+    return -np.einsum('nmj,nj->nm', F, directions)
+
+# Integrates the restoring force along every direction from the equilibrium until it stops being restoring (the first sign change after the maximum, found by linear interpolation). s and Fr are (n,m) arrays with the distances (sorted along every row, starting at 0) and the restoring forces.
+# Returns the barriers and the distances where the force stops being restoring (inf if it's still restoring at the last sample)
+def barriers(s, Fr):
+    n, m = s.shape
+    out = np.zeros(n)
+    ends = np.full(n, np.inf)
+
+    for i in range(n):
+        k = np.argmax(Fr[i])
+        crossing = np.flatnonzero(Fr[i,k:] <= 0)
+
+        if len(crossing) == 0:
+            last = m - 1
+            si, Fi = s[i], Fr[i]
+        else:
+            # The samples up to the one where the force stops being restoring, with that one moved to the interpolated sign change
+            last = k + crossing[0]
+            si, Fi = s[i,:last+1].copy(), Fr[i,:last+1].copy()
+            if Fi[last-1] != Fi[last]:
+                si[last] = si[last-1] + (si[last] - si[last-1])*Fi[last-1]/(Fi[last-1] - Fi[last])
+            Fi[last] = 0
+            ends[i] = si[last]
+
+        out[i] = np.sum((Fi[1:last+1] + Fi[:last])*np.diff(si[:last+1]))/2
+
+    return out, ends
+
+# Finds the escape force and the barrier of the trap along the given directions (see above). x0 is the equilibrium, distance the maximum distance from it along every direction (the barrier is a lower bound if the force is still restoring there), samples the number of initial samples per direction, and every one of the `levels` refinements adds `refine` samples around the maximum of every direction and `refine` more around the point where it stops being restoring.
+# Returns a dict with the per-direction results ("escape_force", "escape_distance", "barrier", "exit_distance", all arrays) and the summary: the depth of the trap ("depth") and its direction ("weakest_direction"), the smallest escape force ("min_escape_force") and its direction ("escape_direction"), and the number of positions evaluated ("evaluations")
+def escape_search(force_fun, x0, directions, distance, samples=24, levels=3, refine=6):
+    directions = np.asarray(directions, dtype=float)
+    directions = directions/np.linalg.norm(directions, axis=1)[:,None]
+    n = len(directions)
+
+    s = np.tile(np.linspace(0, distance, samples), (n, 1))
+    Fr = _restoring(force_fun, x0, directions, s)
+    evaluations = s.size
+
+    # Refine around the maximum of every direction (the interval between its neighbours) and around the point where the force stops being restoring (or the last interval, if it doesn't), which is where the barrier is most sensitive
+    t = np.arange(1, refine + 1)/(refine + 1)
+    rows = np.arange(n)
+
+    for level in range(levels):
+        m = s.shape[1]
+        k = np.argmax(Fr, axis=1)
+        lo = s[rows, np.maximum(k - 1, 0)]
+        hi = s[rows, np.minimum(k + 1, m - 1)]
+
+        after = (np.arange(m) > k[:,None]) & (Fr <= 0)
+        c = np.where(after.any(axis=1), np.argmax(after, axis=1), m - 1)
+        c_lo = s[rows, c - 1]
+        c_hi = s[rows, c]
+
+        new_s = np.concatenate([lo[:,None] + (hi - lo)[:,None]*t, c_lo[:,None] + (c_hi - c_lo)[:,None]*t], axis=1)
+        new_F = _restoring(force_fun, x0, directions, new_s)
+        evaluations += new_s.size
+
+        s = np.concatenate([s, new_s], axis=1)
+        Fr = np.concatenate([Fr, new_F], axis=1)
+
+        order = np.argsort(s, axis=1, kind='stable')
+        s = np.take_along_axis(s, order, axis=1)
+        Fr = np.take_along_axis(Fr, order, axis=1)
+
+    k = np.argmax(Fr, axis=1)
+    barrier, ends = barriers(s, Fr)
+
+    weakest = np.argmin(barrier)
+    escape = np.argmin(Fr[rows, k])
+
+    return {
+        "directions": directions,
+        "escape_force": Fr[rows, k],
+        "escape_distance": s[rows, k],
+        "barrier": barrier,
+        "exit_distance": ends,
+        "depth": barrier[weakest],
+        "weakest_direction": directions[weakest],
+        "min_escape_force": Fr[escape, k[escape]],
+        "escape_direction": directions[escape],
+        "evaluations": evaluations,
+    }
+
+# Finds the equilibrium of the system opt and the depth of its trap (see escape_search) with the configuration cfg (all the evaluations use the batched engine). zs are the axial positions used for finding a starting point for the equilibrium
+def trap_depth(opt, cfg, zs, directions=100, distance=None, samples=24, levels=3, refine=6):
+    batched = sweep.configure(cfg, engine="batched")
+    counter = [0]
+
+    def force_fun(positions):
+        counter[0] += len(positions)
+        return sweep.compute_forces(opt, positions, batched)
+
+    guess = axial_guess(force_fun, np.asarray(zs, dtype=float))
+    if guess is None:
+        raise RuntimeError("There is no stable axial equilibrium between z={0} and z={1}".format(zs[0], zs[-1]))
+
+    # The noise of the integration over the rays limits how close to zero the force can get
+    x0 = find_equilibrium(force_fun, guess, h=1e-3*cfg.radius, tol=1e-6, max_step=0.1*cfg.radius)
+
+    if distance is None:
+        distance = 3*cfg.radius
+
+    result = escape_search(force_fun, x0, fan_directions(directions), distance, samples, levels, refine)
+    result["equilibrium"] = x0
+    result["evaluations"] = counter[0]
+
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trap depth and escape force finder")
+    parser.add_argument("--directions", type=int, default=100, help="number of escape directions (spread evenly over the sphere)")
+    parser.add_argument("--distance", type=float, default=3.0, help="maximum distance from the equilibrium (in particle radii)")
+    parser.add_argument("--samples", type=int, default=24, help="initial samples per direction")
+    parser.add_argument("--levels", type=int, default=3, help="refinements around the maximum restoring force")
+    parser.add_argument("--zrange", nargs=3, type=float, default=[-1.5, 2.0, 36], metavar=("START", "STOP", "STEPS"), help="axial positions (in particle radii) used for finding the equilibrium")
+    parser.add_argument("--out", default=None, help="TSV file to save the results of every direction into")
+    args = parser.parse_args(argv)
+
+    import config
+
+    cfg = sweep.configure(config)
+    opt = sweep.make_system(cfg)
+    zs = cfg.radius*np.linspace(args.zrange[0], args.zrange[1], int(args.zrange[2]))
+
+    r = trap_depth(opt, cfg, zs, args.directions, args.distance*cfg.radius, args.samples, args.levels)
+
+    if args.out is not None:
+        data = np.column_stack([r["directions"], r["escape_force"], r["escape_distance"], r["barrier"], r["exit_distance"]])
+        np.savetxt(args.out, data, delimiter="\t", header="ux\tuy\tuz\tescape_force\tescape_distance\tbarrier\texit_distance")
+
+    print("Equilibrium:        ({0:.6g}, {1:.6g}, {2:.6g})".format(*r["equilibrium"]))
+    print("Trap depth:         {0:.6g} (direction ({1:.3f}, {2:.3f}, {3:.3f}))".format(r["depth"], *r["weakest_direction"]))
+    print("Min. escape force:  {0:.6g} (direction ({1:.3f}, {2:.3f}, {3:.3f}))".format(r["min_escape_force"], *r["escape_direction"]))
+    print("Positions evaluated: {0}".format(r["evaluations"]))
+
+if __name__ == "__main__":
+    main()